@@ -1,7 +1,14 @@
 import hashlib
 import time
 import json
+import os
 from collections import deque
+from modules import wire
+from modules.history import ADDRESS_INDEX_FILE, AddressIndex
+from modules.merkle import merkle_root, merkle_proof
+from modules.mining import MIN_PARALLEL_DIFFICULTY, ParallelMiner
+from modules.state import STATE_FILE, AccountState
+from modules.storage import BlockStore, StoredChain
 
 class Block:
     def __init__(self, index, transactions, timestamp, previous_hash, nonce=0):
@@ -10,18 +17,55 @@ class Block:
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.nonce = nonce
+        self.merkle_root = merkle_root(transactions)
         self.hash = self.calculate_hash()
 
+    def header(self):
+        """ Return the fixed-size block header; transactions are committed through the Merkle root. """
+        return {
+            "index": self.index,
+            "merkle_root": self.merkle_root,
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "nonce": self.nonce
+        }
+
     def calculate_hash(self):
-        block_data = {
+        header_string = json.dumps(self.header(), sort_keys=True).encode()
+        return hashlib.sha256(header_string).hexdigest()
+
+    def header_parts(self):
+        """
+        Split the serialized header around the nonce.
+        The bytes match `calculate_hash`'s encoding, so prefix + str(nonce) + suffix hashes to the same digest.
+        :return: (prefix, suffix) as bytes.
+        """
+        prefix = '{"index": %s, "merkle_root": %s, "nonce": ' % (
+            json.dumps(self.index),
+            json.dumps(self.merkle_root)
+        )
+        suffix = ', "previous_hash": %s, "timestamp": %s}' % (
+            json.dumps(self.previous_hash),
+            json.dumps(self.timestamp)
+        )
+        return prefix.encode(), suffix.encode()
+
+    def merkle_proof(self, tx_index):
+        """ Inclusion proof for one transaction, checkable against `merkle_root` by light clients. """
+        return merkle_proof(self.transactions, tx_index)
+
+    def to_dict(self):
+        return {
             "index": self.index,
             "transactions": self.transactions,
             "timestamp": self.timestamp,
             "previous_hash": self.previous_hash,
             "nonce": self.nonce
         }
-        block_string = json.dumps(block_data, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+
+    @staticmethod
+    def from_dict(data):
+        return Block(data["index"], data["transactions"], data["timestamp"], data["previous_hash"], data["nonce"])
 
     def __repr__(self):
         return f"Block(index={self.index}, hash={self.hash}, previous_hash={self.previous_hash}, transactions={self.transactions})"
@@ -29,19 +73,91 @@ class Block:
 class Blockchain:
     difficulty = 4  # Number of leading zeros required in hash for proof of work
 
-    def __init__(self):
+    def __init__(self, mining_workers=None, data_dir=None, min_parallel_difficulty=MIN_PARALLEL_DIFFICULTY):
         self.chain = []
         self.pending_transactions = deque()
         self.mining_reward = 50
-        self.create_genesis_block()
+        self.miner = ParallelMiner(mining_workers, min_parallel_difficulty)
+        self.state = AccountState()
+        self.state_path = os.path.join(data_dir, STATE_FILE) if data_dir else None
+        self.addresses = AddressIndex()
+        if data_dir:
+            self.addresses = AddressIndex(os.path.join(data_dir, ADDRESS_INDEX_FILE))
+            self.chain = StoredChain(
+                BlockStore(data_dir),
+                lambda block: wire.dumps(block.to_dict()),
+                lambda data: Block.from_dict(wire.loads(data)),
+                lambda block: block.hash
+            )
+        if len(self.chain):
+            # Stored blocks were validated before they were appended.
+            self.update_checkpoint(len(self.chain) - 1)
+            if self.state_path and self.state.load(self.state_path):
+                height = self.state.height
+                if height >= len(self.chain) or self.chain[height].hash != self.state.tip_hash:
+                    self.state.reset()
+            height = min(self.addresses.height, len(self.chain) - 1)
+            # Step back past index records for blocks the chain no longer has.
+            while height >= 0 and self.addresses.hashes[height] != self.chain[height].hash:
+                height -= 1
+            self.addresses.truncate(height)
+            self.sync_state()
+        else:
+            self.addresses.truncate(-1)  # left over from a block store that was removed
+            self.create_genesis_block()
 
     def create_genesis_block(self):
         genesis_block = Block(0, [], time.time(), "0")
         self.chain.append(genesis_block)
+        self.update_checkpoint(len(self.chain) - 1)
+        self.sync_state()
+
+    def sync_state(self, snapshot_interval=100):
+        """ Apply the blocks appended since the account state and address index were last updated. """
+        for height in range(min(self.state.height, self.addresses.height) + 1, len(self.chain)):
+            block = self.chain[height]
+            if height > self.state.height:
+                self.state.apply_block(height, block.hash, block.transactions)
+                if self.state_path and height % snapshot_interval == 0:
+                    self.state.save(self.state_path)
+            if height > self.addresses.height:
+                self.addresses.add_block(height, block.hash, block.transactions)
+
+    def get_balance(self, address):
+        """ Confirmed balance of an address, in O(1). """
+        return self.state.balance_of(address)
+
+    def transactions_for(self, address, offset=0, limit=50, newest_first=True):
+        """
+        One page of the transactions sent or received by an address, without scanning the chain.
+        Same result as the modules chain's `transactions_for`.
+        """
+        page = []
+        for height, position in self.addresses.page(address, offset, limit, newest_first):
+            block = self.chain[height]
+            page.append({
+                'height': height,
+                'block_hash': block.hash,
+                'position': position,
+                'transaction': block.transactions[position],
+            })
+        return {
+            'address': address,
+            'total': self.addresses.count(address),
+            'offset': offset,
+            'limit': limit,
+            'transactions': page,
+        }
 
     def get_latest_block(self):
         return self.chain[-1]
 
+    def get_block_by_hash(self, block_hash):
+        if isinstance(self.chain, StoredChain):
+            height = self.chain.index_of_hash(block_hash)
+            return None if height is None else self.chain[height]
+        return next((block for block in reversed(self.chain) if block.hash == block_hash), None)
+
     def add_transaction(self, transaction):
         if not transaction.get("sender") or not transaction.get("receiver") or not transaction.get("amount"):
             raise ValueError("Transaction must include sender, receiver, and amount")
@@ -59,7 +175,8 @@ class Blockchain:
         new_block = self.proof_of_work(new_block)
 
         # Add the newly mined block to the blockchain
-        self.chain.append(new_block)
+        if not self.add_block(new_block):
+            return False
         print(f"Block mined: {new_block.hash}")
 
         # Clear pending transactions and reward the miner
@@ -72,27 +189,63 @@ class Blockchain:
         return True
 
     def proof_of_work(self, block):
-        block.nonce = 0
-        calculated_hash = block.calculate_hash()
-        while not calculated_hash.startswith('0' * Blockchain.difficulty):
-            block.nonce += 1
-            calculated_hash = block.calculate_hash()
-        block.hash = calculated_hash
+        prefix, suffix = block.header_parts()
+        block.nonce, block.hash = self.miner.mine(prefix, suffix, Blockchain.difficulty)
         return block
 
-    def is_chain_valid(self):
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i - 1]
+    def validate_block(self, current_block, previous_block):
+        """ Check a single block against its predecessor. """
+        # Check if the hash of the block is correct
+        if current_block.hash != current_block.calculate_hash():
+            print(f"Invalid hash for block {current_block.index}")
+            return False
 
-            # Check if the hash of the block is correct
-            if current_block.hash != current_block.calculate_hash():
-                print(f"Invalid hash for block {current_block.index}")
-                return False
+        # Check that the transactions match the committed Merkle root
+        if current_block.merkle_root != merkle_root(current_block.transactions):
+            print(f"Invalid Merkle root for block {current_block.index}")
+            return False
+
+        # Check if the block points to the correct previous block
+        if current_block.previous_hash != previous_block.hash:
+            print(f"Invalid previous hash for block {current_block.index}")
+            return False
+
+        return True
+
+    def add_block(self, block):
+        """ Validate a block against the current tip in O(1) and append it. """
+        if not self.validate_block(block, self.get_latest_block()):
+            return False
+        self.chain.append(block)
+        if self.verified_height == len(self.chain) - 2:
+            self.update_checkpoint(len(self.chain) - 1)
+        self.sync_state()
+        return True
 
-            # Check if the block points to the correct previous block
-            if current_block.previous_hash != previous_block.hash:
-                print(f"Invalid previous hash for block {current_block.index}")
+    def update_checkpoint(self, height):
+        """ Remember the highest block known to be valid. """
+        self.verified_height = height
+        self.verified_hash = self.chain[height].hash
+
+    def checkpoint_matches(self):
+        """ True if the verified tip is still part of the current chain. """
+        return (self.verified_height < len(self.chain)
+                and self.chain[self.verified_height].hash == self.verified_hash)
+
+    def is_chain_valid(self, full=False):
+        """
+        Validate the chain. By default only blocks above the verified checkpoint are checked;
+        `full=True` re-validates everything from genesis.
+        """
+        start = 1
+        if not full and self.checkpoint_matches():
+            start = self.verified_height + 1
+        else:
+            self.update_checkpoint(0)
+
+        for i in range(start, len(self.chain)):
+            if not self.validate_block(self.chain[i], self.chain[i - 1]):
                 return False
+            self.update_checkpoint(i)
 
         return True
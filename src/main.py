@@ -73,6 +73,11 @@ class SypherCoreMain:
             logging.error("Invalid amount. Please enter a valid number.")
             return
 
+        if not self.blockchain.state.can_afford(sender, amount):
+            balance = self.blockchain.get_balance(sender)
+            logging.error(f"Insufficient balance: {sender} holds {balance} Sypher tokens.")
+            return
+
         transaction = self.wallet.create_transaction(sender, receiver, amount)
         if transaction:
             self.blockchain.add_transaction(transaction)
@@ -1,15 +1,57 @@
 import hashlib
 import json
+import logging
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
 from uuid import uuid4
 
+import requests
+
+from modules import wire
+from modules.history import ADDRESS_INDEX_FILE, AddressIndex
+from modules.merkle import merkle_root
+from modules.state import STATE_FILE, AccountState
+from modules.storage import BlockStore, IndexedChain, StoredChain
+from modules.validation import ValidationPipeline
+
+HEADER_FIELDS = ('index', 'timestamp', 'merkle_root', 'proof', 'previous_hash')
+# fetch_chain_length's result for a neighbour that answers but does not serve /chain/length.
+LENGTH_UNAVAILABLE = object()
+# Committed to by the header only when the block has them, so blocks without them keep their hashes.
+OPTIONAL_HEADER_FIELDS = ('proposer',)
+
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
+    def __init__(self, data_dir=None, snapshot_interval=100, parallel_validation=False, verifier=None):
+        """
+        :param data_dir: <str> Optional directory for the persistent block store.
+                         Without it the chain is kept in memory only.
+        :param snapshot_interval: <int> Blocks between account state snapshots in `data_dir`.
+        :param parallel_validation: <bool> Validate incoming blocks with a ValidationPipeline, which
+                                    also checks transaction signatures and balances.
+        :param verifier: <BatchVerifier> Signature verifier for the pipeline to share.
+        """
+        self.chain = IndexedChain(self.hash)
         self.current_transactions = []
         self.nodes = set()
-        self.create_genesis_block()
+        self.pipeline = ValidationPipeline(self, verifier) if parallel_validation else None
+        self.rejection = None  # why add_block last refused a block
+        self.state = AccountState()
+        self.state_path = os.path.join(data_dir, STATE_FILE) if data_dir else None
+        self.snapshot_interval = snapshot_interval
+        self.addresses = AddressIndex()
+        if data_dir:
+            self.chain = StoredChain(BlockStore(data_dir), wire.dumps, wire.loads, self.hash)
+            self.addresses = AddressIndex(os.path.join(data_dir, ADDRESS_INDEX_FILE))
+        if len(self.chain):
+            # Stored blocks were validated before they were appended.
+            self.update_checkpoint(len(self.chain) - 1)
+            self.restore_state()
+        else:
+            self.addresses.truncate(-1)  # left over from a block store that was removed
+            self.create_genesis_block()
 
     def create_genesis_block(self):
         """
@@ -18,21 +60,27 @@ class Blockchain:
         """
         genesis_block = self.create_block(previous_hash='1', proof=100)
         self.chain.append(genesis_block)
+        self.update_checkpoint(0)
+        self.sync_indexes()
 
-    def create_block(self, proof, previous_hash=None):
+    def create_block(self, proof, previous_hash=None, proposer=None):
         """
         Create a new block in the blockchain.
         :param proof: The proof given by the Proof of Work algorithm.
         :param previous_hash: Hash of the previous block.
+        :param proposer: Staker proposing the block under proof of stake; committed to by its hash.
         :return: A dictionary representing the new block.
         """
         block = {
             'index': len(self.chain) + 1,
             'timestamp': time.time(),
             'transactions': self.current_transactions,
+            'merkle_root': merkle_root(self.current_transactions),
             'proof': proof,
             'previous_hash': previous_hash or self.hash(self.chain[-1]),
         }
+        if proposer is not None:
+            block['proposer'] = proposer
 
         # Reset the current list of transactions
         self.current_transactions = []
@@ -45,6 +93,117 @@ class Blockchain:
         """
         self.chain.append(block)
 
+    def add_block(self, block):
+        """
+        Validate a block against the current tip and append it.
+        Only the new block is checked, so this is O(1) in the chain length.
+        :param block: <dict> Block to be added.
+        :return: <bool> True if the block was appended. If not, `rejection` says why: 'stale' if the
+                 block does not extend our tip, which is no fault of the block, otherwise 'invalid'
+                 or the validation stage it failed.
+        """
+        self.rejection = None
+        if block.get('previous_hash') != self.hash(self.last_block):
+            self.rejection = 'stale'
+            return False
+        if self.pipeline is not None:
+            if not self.extend_chain(len(self.chain) - 1, [block]):
+                self.rejection = self.pipeline.failed_stage or 'invalid'
+                return False
+            return True
+        if not self.validate_block(block, self.last_block):
+            self.rejection = 'invalid'
+            return False
+        self.chain.append(block)
+        if self.verified_height == len(self.chain) - 2:
+            self.update_checkpoint(len(self.chain) - 1)
+        self.sync_indexes()
+        return True
+
+    def update_checkpoint(self, height):
+        """
+        Record the highest block of our chain known to be valid.
+        :param height: <int> Position of the block in the chain.
+        """
+        self.verified_height = height
+        self.verified_hash = self.hash(self.chain[height])
+
+    # -------------------------
+    # Account state and address index
+    # -------------------------
+    def restore_state(self):
+        """
+        Load the latest state snapshot and the address index if they match our chain, then replay
+        the blocks after them.
+        """
+        if self.state_path and self.state.load(self.state_path):
+            height = self.state.height
+            if height >= len(self.chain) or self.hash(self.chain[height]) != self.state.tip_hash:
+                logging.warning("State snapshot does not match the chain; rebuilding account state.")
+                self.state.reset()
+        height = min(self.addresses.height, len(self.chain) - 1)
+        # Step back past index records for blocks the chain no longer has.
+        while height >= 0 and self.addresses.hashes[height] != self.hash(self.chain[height]):
+            height -= 1
+        self.addresses.truncate(height)
+        self.sync_indexes()
+
+    def sync_indexes(self, stop=None):
+        """
+        Apply the blocks appended since the account state and address index were last updated.
+        :param stop: <int> Height to stop before; defaults to the chain length.
+        """
+        stop = len(self.chain) if stop is None else stop
+        for height in range(min(self.state.height, self.addresses.height) + 1, stop):
+            block = self.chain[height]
+            block_hash = self.hash(block)
+            if height > self.state.height:
+                self.state.apply_block(height, block_hash, block['transactions'])
+                if self.state_path and height % self.snapshot_interval == 0:
+                    self.state.save(self.state_path)
+            if height > self.addresses.height:
+                self.addresses.add_block(height, block_hash, block['transactions'])
+
+    def rewind_indexes(self, height):
+        """ Roll the account state and address index back to `height` before the blocks above it change. """
+        if not self.state.rollback_to(height):
+            logging.warning("Reorg below the state undo history; rebuilding account state.")
+            self.state.reset()
+        self.addresses.truncate(height)
+
+    def transactions_for(self, address, offset=0, limit=50, newest_first=True):
+        """
+        One page of the transactions sent or received by an address, without scanning the chain.
+        :param offset: <int> Number of transactions to skip.
+        :param limit: <int> Maximum number of transactions to return.
+        :param newest_first: <bool> Page from the most recent transaction backwards.
+        :return: <dict> The total count and the page, each entry with its block height and position.
+        """
+        page = []
+        for height, position in self.addresses.page(address, offset, limit, newest_first):
+            block = self.chain[height]
+            page.append({
+                'height': height,
+                'block_hash': self.hash(block),
+                'position': position,
+                'transaction': block['transactions'][position],
+            })
+        return {
+            'address': address,
+            'total': self.addresses.count(address),
+            'offset': offset,
+            'limit': limit,
+            'transactions': page,
+        }
+
+    def balance_of(self, address):
+        """ Confirmed balance of an address, in O(1). """
+        return self.state.balance_of(address)
+
+    def can_afford(self, sender, amount, fee=0):
+        """ True if the confirmed balance of `sender` covers amount + fee, in O(1). """
+        return self.state.can_afford(sender, amount, fee)
+
     def new_transaction(self, sender, recipient, amount):
         """
         Add a new transaction to the list of transactions.
@@ -94,69 +253,313 @@ class Blockchain:
         parsed_url = urlparse(address)
         self.nodes.add(parsed_url.netloc)
 
-    def valid_chain(self, chain):
+    def validate_block(self, block, last_block):
+        """
+        Check a single block against its predecessor.
+        :param block: <dict> Block to check.
+        :param last_block: <dict> The block it should extend.
+        :return: <bool> True if valid, False if not.
+        """
+        # Check that the hash of the block is correct
+        if block['previous_hash'] != self.hash(last_block):
+            return False
+
+        # Check that the transactions match the committed Merkle root
+        if block.get('merkle_root') != merkle_root(block['transactions']):
+            return False
+
+        # Check that the Proof of Work is correct
+        if not self.valid_proof(last_block['proof'], block['proof']):
+            return False
+
+        return True
+
+    def valid_chain(self, chain, full=False):
         """
         Determine if a given blockchain is valid.
+        If the chain contains our verified checkpoint, only the blocks above it are checked;
+        pass full=True to re-validate from genesis.
         :param chain: <list> A blockchain.
+        :param full: <bool> Ignore the checkpoint and validate every block.
         :return: <bool> True if valid, False if not.
         """
-        last_block = chain[0]
         current_index = 1
+        if not full and self.verified_height < len(chain) \
+                and self.hash(chain[self.verified_height]) == self.verified_hash:
+            current_index = self.verified_height + 1
+        elif chain is self.chain:
+            self.update_checkpoint(0)
 
+        last_block = chain[current_index - 1]
         while current_index < len(chain):
             block = chain[current_index]
-            # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(last_block):
-                return False
-
-            # Check that the Proof of Work is correct
-            if not self.valid_proof(last_block['proof'], block['proof']):
+            if not self.validate_block(block, last_block):
                 return False
 
+            if chain is self.chain:
+                self.update_checkpoint(current_index)
             last_block = block
             current_index += 1
 
         return True
 
-    def resolve_conflicts(self):
+    def replace_chain(self, chain):
+        """
+        Adopt a longer valid chain.
+        Blocks up to our verified checkpoint are kept from our own chain, so only the new suffix
+        needs to be validated.
+        :param chain: <list> Candidate blockchain.
+        :return: <bool> True if the chain was replaced, False if not.
+        """
+        if len(chain) <= len(self.chain) or not self.valid_chain(chain):
+            return False
+
+        fork_height = 0
+        if self.verified_height < len(chain) and self.hash(chain[self.verified_height]) == self.verified_hash:
+            fork_height = self.verified_height + 1
+        self.rewind_indexes(fork_height - 1)
+        del self.chain[fork_height:]
+        self.chain.extend(chain[fork_height:])
+        self.update_checkpoint(len(self.chain) - 1)
+        self.sync_indexes()
+        return True
+
+    def resolve_conflicts(self, timeout=5):
         """
         Consensus Algorithm, resolves conflicts by replacing the chain with the longest one.
+        All neighbours are asked for their chain length concurrently; only the longest candidate
+        is downloaded and validated, falling back to the next one if it turns out to be invalid.
+        Neighbours that do not report a length are only downloaded, one at a time, if no neighbour
+        with a known longer chain gave us a valid one.
+        :param timeout: <float> Seconds to wait for each stage of a neighbour's reply.
         :return: <bool> True if the chain was replaced, False if not.
         """
-        neighbours = self.nodes
-        new_chain = None
+        neighbours = list(self.nodes)
+        if not neighbours:
+            return False
+
+        executor = ThreadPoolExecutor(max_workers=min(32, len(neighbours)))
+        futures = {executor.submit(self.fetch_chain_length, node, timeout): node for node in neighbours}
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+            logging.warning(f"Neighbour {futures[future]} did not report its chain length in time")
+        executor.shutdown(wait=False)
+
+        # Chains known to be longer than ours, longest first, then those of unknown length
+        candidates, unknown = [], []
+        for future in done:
+            length = future.result()
+            if length is LENGTH_UNAVAILABLE:
+                unknown.append(futures[future])
+            elif length is not None and length > len(self.chain):
+                candidates.append((length, futures[future]))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        candidates.extend((None, node) for node in unknown)
+
+        for length, node in candidates:
+            chain = self.fetch_chain(node, timeout)
+            if chain is None or len(chain) < (length or 0) or len(chain) <= len(self.chain):
+                continue
+            if self.replace_chain(chain):
+                return True
+            logging.warning(f"Chain from neighbour {node} failed validation")
 
-        # Look for chains longer than ours
-        max_length = len(self.chain)
+        return False
 
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
+    @staticmethod
+    def fetch_chain_length(node, timeout):
+        """
+        Ask a neighbour for the length of its chain without downloading it.
+        :return: <int> Advertised length; LENGTH_UNAVAILABLE if the neighbour does not serve
+                 /chain/length (404), or None if it did not answer.
+        """
+        try:
+            response = requests.get(f'http://{node}/chain/length', timeout=timeout)
+            if response.status_code == 200:
+                return int(response.json()['length'])
+            if response.status_code == 404:
+                return LENGTH_UNAVAILABLE
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.error(f"Failed to query chain length from {node} - {e}")
+        return None
 
+    @staticmethod
+    def fetch_chain(node, timeout):
+        """
+        Download a neighbour's full chain.
+        :return: <list> The chain, or None on failure.
+        """
+        try:
+            response = requests.get(f'http://{node}/chain', timeout=timeout)
             if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
+                return response.json()['chain']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.error(f"Failed to download chain from {node} - {e}")
+        return None
 
-                # Replace our chain if we find a longer, valid chain
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+    def get_block(self, height):
+        """
+        Return the block at a given position in the chain.
+        :param height: <int> Position of the block, genesis is 0.
+        """
+        return self.chain[height]
 
-        if new_chain:
-            self.chain = new_chain
-            return True
+    def get_block_by_hash(self, block_hash):
+        """
+        Look up a block by its hash.
+        :param block_hash: <str> Hex hash of the block.
+        :return: <dict> Block, or None if unknown.
+        """
+        height = self.height_of(block_hash)
+        return None if height is None else self.chain[height]
 
-        return False
+    def height_of(self, block_hash):
+        """
+        :param block_hash: <str> Hex hash of a block.
+        :return: <int> Position of the block in our chain, or None.
+        """
+        return self.chain.index_of_hash(block_hash)
+
+    def block_locator(self):
+        """
+        Hashes describing our chain for a peer to find the fork point:
+        the 10 most recent blocks, then exponentially sparser ones, then genesis.
+        :return: <list> Block hashes, newest first.
+        """
+        heights = []
+        height = len(self.chain) - 1
+        step = 1
+        while height > 0:
+            heights.append(height)
+            if len(heights) >= 10:
+                step *= 2
+            height -= step
+        heights.append(0)
+        return [self.hash(self.chain[height]) for height in heights]
+
+    def find_fork_point(self, locator):
+        """
+        :param locator: <list> Block hashes from a peer's block_locator.
+        :return: <int> Height of the newest locator block we also have, or None.
+        """
+        for block_hash in locator:
+            height = self.height_of(block_hash)
+            if height is not None:
+                return height
+        return None
+
+    def headers_after(self, locator, limit=2000):
+        """
+        Headers of our blocks following the fork point described by a locator.
+        :param locator: <list> Block hashes from a peer's block_locator.
+        :param limit: <int> Maximum number of headers to return.
+        :return: (fork height, list of headers); the fork height is None if we share no block.
+        """
+        fork_height = self.find_fork_point(locator)
+        if fork_height is None:
+            return None, []
+        stop = min(len(self.chain), fork_height + 1 + limit)
+        return fork_height, [self.block_header(self.chain[height]) for height in range(fork_height + 1, stop)]
+
+    def is_fork_height(self, fork_height):
+        """ True if `fork_height` is an integer height of a block in our chain; peers supply it. """
+        return isinstance(fork_height, int) and not isinstance(fork_height, bool) \
+            and 0 <= fork_height < len(self.chain)
+
+    def extend_chain(self, fork_height, blocks):
+        """
+        Replace everything above `fork_height` with `blocks` if that makes the chain longer.
+        Only the new blocks are validated.
+        :param fork_height: <int> Height of the last block shared with the new branch.
+        :param blocks: <list> Blocks following the fork point, in order.
+        :return: <bool> True if the chain was extended.
+        """
+        if not self.is_fork_height(fork_height):
+            logging.warning(f"Rejecting blocks after out-of-range fork height {fork_height!r}.")
+            return False
+        if fork_height + 1 + len(blocks) <= len(self.chain):
+            return False
+        if self.pipeline is not None:
+            return self.extend_chain_pipelined(fork_height, blocks)
+        last_block = self.chain[fork_height]
+        for block in blocks:
+            if not self.validate_block(block, last_block):
+                return False
+            last_block = block
+
+        self.rewind_indexes(fork_height)
+        del self.chain[fork_height + 1:]
+        self.chain.extend(blocks)
+        if self.verified_height >= fork_height:
+            self.update_checkpoint(len(self.chain) - 1)
+        self.sync_indexes()
+        return True
+
+    def extend_chain_pipelined(self, fork_height, blocks):
+        """
+        extend_chain through the validation pipeline. The account state is rewound to the fork
+        point for the state stage and replayed over our own blocks if the new ones are rejected.
+        """
+        self.rewind_indexes(fork_height)
+        self.sync_indexes(stop=fork_height + 1)
+        if not self.pipeline.validate(blocks, self.chain[fork_height], fork_height + 1, self.state):
+            self.sync_indexes()
+            return False
+
+        del self.chain[fork_height + 1:]
+        self.chain.extend(blocks)
+        if self.verified_height >= fork_height:
+            self.update_checkpoint(len(self.chain) - 1)
+        self.sync_indexes()
+        if self.state_path and (len(self.chain) - 1) // self.snapshot_interval > fork_height // self.snapshot_interval:
+            self.state.save(self.state_path)
+        timings = ', '.join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in self.pipeline.last_timings.items())
+        logging.debug(f"Validated {len(blocks)} blocks: {timings}")
+        return True
+
+    def to_dict(self):
+        """
+        Return the chain in the format served to peers.
+        """
+        return {'chain': list(self.chain), 'length': len(self.chain)}
+
+    def chain_payload(self):
+        """
+        Return `to_dict()` ready to be sent to a peer.
+        Stored blocks are passed on in their encoded form instead of being decoded.
+        """
+        if not isinstance(self.chain, StoredChain):
+            return self.to_dict()
+        blocks = [wire.Encoded(self.chain.raw(height)) for height in range(len(self.chain))]
+        return {'chain': blocks, 'length': len(blocks)}
 
     @staticmethod
-    def hash(block):
+    def block_header(block):
         """
-        Creates a SHA-256 hash of a block.
+        Extract the compact header of a block.
+        Transactions are committed through the Merkle root, so the header size is independent of the block size.
         :param block: <dict> Block
+        :return: <dict> Header
+        """
+        header = {field: block.get(field) for field in HEADER_FIELDS}
+        for field in OPTIONAL_HEADER_FIELDS:
+            if block.get(field) is not None:
+                header[field] = block[field]
+        if header['merkle_root'] is None and 'transactions' in block:
+            header['merkle_root'] = merkle_root(block['transactions'])
+        return header
+
+    @staticmethod
+    def hash(block):
+        """
+        Creates a SHA-256 hash of a block header.
+        :param block: <dict> Block or header
         :return: <str>
         """
         # Ensure that the Dictionary is Ordered, or we will have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        header_string = json.dumps(Blockchain.block_header(block), sort_keys=True).encode()
+        return hashlib.sha256(header_string).hexdigest()
 
     @property
     def last_block(self):
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import threading
+
+from modules.merkle import merkle_root
+from modules.transaction import TransactionPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SHORT_ID_SIZE = 6
+
+
+def short_id(block_hash, txid):
+    """ Short transaction id, salted with the block hash so collisions differ from block to block. """
+    return hashlib.sha256(bytes.fromhex(block_hash) + bytes.fromhex(txid)).digest()[:SHORT_ID_SIZE]
+
+
+class CompactBlockRelay:
+    """
+    Relays blocks as a header plus 6-byte short transaction ids.
+    Transactions the sender does not expect its peers to have are prefilled; the receiver rebuilds
+    the rest from its mempool and asks the sender only for what it is missing.
+    A block relayed before we finished validating it is marked pending, so peers asking us for its
+    transactions wait for it instead of being told we do not have it.
+    """
+
+    def __init__(self, blockchain, transaction_pool, connections, origin, pending_timeout=10):
+        self.blockchain = blockchain
+        self.transaction_pool = transaction_pool
+        self.connections = connections
+        self.origin = origin  # (host, port) peers use to reach us
+        self.pending_timeout = pending_timeout
+        self.pending = {}  # block hash -> Event set once the block is added or rejected
+        self.lock = threading.Lock()
+
+    def expect(self, block_hash):
+        """ Mark a block we have announced but not yet added to our chain. """
+        with self.lock:
+            self.pending.setdefault(block_hash, threading.Event())
+
+    def settle(self, block_hash):
+        """ Release the peers waiting on a pending block, whether it was added or not. """
+        with self.lock:
+            event = self.pending.pop(block_hash, None)
+        if event is not None:
+            event.set()
+
+    def make_compact_block(self, block):
+        """
+        Build the compact_block message for a block.
+        Transactions found in our mempool are sent as short ids, the others in full.
+        """
+        block_hash = self.blockchain.hash(block)
+        short_ids = bytearray()
+        prefilled = []
+        for position, transaction in enumerate(block['transactions']):
+            txid = TransactionPool.transaction_id(transaction)
+            if txid in self.transaction_pool.transactions:
+                short_ids += short_id(block_hash, txid)
+            else:
+                prefilled.append([position, transaction])
+        return {
+            "action": "compact_block",
+            "header": self.blockchain.block_header(block),
+            "short_ids": short_ids.hex(),
+            "prefilled": prefilled,
+            "peer_host": self.origin[0],
+            "peer_port": self.origin[1],
+        }
+
+    def reconstruct(self, message):
+        """
+        Rebuild the full block announced by a compact_block message.
+        :return: <dict> The block, or None if it could not be rebuilt.
+        """
+        header = message["header"]
+        block_hash = self.blockchain.hash(header)
+        if self.blockchain.get_block_by_hash(block_hash) is not None:
+            return None
+        peer = (message["peer_host"], message["peer_port"])
+
+        try:
+            raw_ids = bytes.fromhex(message.get("short_ids") or '')
+        except (TypeError, ValueError):
+            logging.warning(f"Malformed compact block {block_hash[:16]} from {peer}")
+            return None
+        ids = [raw_ids[i:i + SHORT_ID_SIZE] for i in range(0, len(raw_ids), SHORT_ID_SIZE)]
+        prefilled = {position: transaction for position, transaction in message.get("prefilled") or []}
+        count = len(ids) + len(prefilled)
+        if any(not 0 <= position < count for position in prefilled):
+            logging.warning(f"Malformed compact block {block_hash[:16]} from {peer}")
+            return None
+
+        candidates = {}
+        for txid, transaction in list(self.transaction_pool.transactions.items()):
+            key = short_id(block_hash, txid)
+            # A short id shared by two pooled transactions is ambiguous; fetch it instead.
+            candidates[key] = None if key in candidates else transaction
+
+        transactions = [None] * count
+        missing = []
+        remaining = iter(ids)
+        for position in range(count):
+            if position in prefilled:
+                transactions[position] = prefilled[position]
+                continue
+            transaction = candidates.get(next(remaining))
+            if transaction is None:
+                missing.append(position)
+            else:
+                transactions[position] = transaction.to_dict()
+
+        if missing:
+            reply = self.connections.request(
+                peer, {"action": "get_block_txns", "block_hash": block_hash, "indexes": missing}
+            )
+            fetched = (reply.get("transactions") or []) if reply else []
+            if len(fetched) != len(missing):
+                return self.fetch_full_block(peer, block_hash)
+            for position, transaction in zip(missing, fetched):
+                transactions[position] = transaction
+            logging.info(f"Fetched {len(missing)} of {count} transactions for compact block {block_hash[:16]}")
+
+        if header['merkle_root'] != merkle_root(transactions):
+            # A short id collided with an unrelated pooled transaction.
+            return self.fetch_full_block(peer, block_hash)
+        return dict(header, transactions=transactions)
+
+    def fetch_full_block(self, peer, block_hash):
+        reply = self.connections.request(peer, {"action": "get_blocks", "hashes": [block_hash]})
+        blocks = (reply.get("blocks") or []) if reply else []
+        return blocks[0] if blocks else None
+
+    def handle_get_block_txns(self, message):
+        """ Reply with the requested transactions of one of our blocks. """
+        block_hash = message.get("block_hash")
+        block = self.blockchain.get_block_by_hash(block_hash)
+        event = self.pending.get(block_hash)
+        if block is None and event is not None and event.wait(self.pending_timeout):
+            block = self.blockchain.get_block_by_hash(block_hash)
+        if block is None:
+            return {"transactions": []}
+        transactions = block['transactions']
+        indexes = message.get("indexes") or []
+        if any(not 0 <= index < len(transactions) for index in indexes):
+            return {"transactions": []}
+        return {"transactions": [transactions[index] for index in indexes]}
@@ -0,0 +1,53 @@
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 5000,
+    "data_dir": None,         # block store directory; in memory if unset
+    "seeds": [],              # "host:port" strings or [host, port] pairs
+    "peers_file": None,       # address book saved across restarts
+    "max_peers": 8,
+    "connect_timeout": 5,
+    "ready_timeout": 10,      # seconds bootstrap may take before the node reports ready anyway
+    "min_peers": 1,           # active peers needed to count as ready
+    "sync_on_start": True,
+    "pipelined_relay": False,
+    "parallel_validation": False,  # staged block validation with batched signature checks
+}
+
+
+def parse_address(address):
+    """
+    Turn "host:port" or [host, port] into a (host, port) tuple.
+    :raises ValueError: if the address is malformed.
+    """
+    if isinstance(address, str):
+        host, separator, port = address.rpartition(':')
+        if not separator or not host:
+            raise ValueError(f"Invalid peer address {address!r}, expected host:port.")
+        return host, int(port)
+    host, port = address
+    return str(host), int(port)
+
+
+def load_config(path=None, **overrides):
+    """
+    Build a node configuration from the defaults, an optional JSON file and keyword overrides.
+    Overrides set to None are ignored, so unset command-line options do not mask the file.
+    :param path: <str> JSON file holding any of the DEFAULT_CONFIG keys.
+    :return: <dict> Configuration with seeds parsed into (host, port) tuples.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path) as config_file:
+            loaded = json.load(config_file)
+        unknown = set(loaded) - set(DEFAULT_CONFIG)
+        if unknown:
+            logging.warning(f"Ignoring unknown configuration keys: {', '.join(sorted(unknown))}")
+        config.update((key, value) for key, value in loaded.items() if key in DEFAULT_CONFIG)
+    config.update((key, value) for key, value in overrides.items() if value is not None)
+    config["seeds"] = [parse_address(seed) for seed in config["seeds"]]
+    return config
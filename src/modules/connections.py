@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+import logging
+import random
+import threading
+
+from modules.protocol import FRAME_HEADER, encode_frame, encode_message, decode_message, read_frame
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class PeerConnection:
+    """
+    One long-lived connection to a peer, owned by the ConnectionManager's event loop.
+    Outgoing frames are queued and written by a single writer task; replies to requests are
+    matched to their callers by message id. Broken connections are re-established with
+    exponential backoff.
+    """
+
+    def __init__(self, manager, peer):
+        self.manager = manager
+        self.peer = peer
+        self.queue = asyncio.Queue(maxsize=manager.max_queue)
+        self.pending = {}  # message id -> Future
+        self.failures = 0
+        self.closed = False
+        self.task = asyncio.ensure_future(self.run())
+
+    def enqueue(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logging.warning(f"Send queue full for {self.peer}, dropping message")
+            return
+        self.manager.bytes_sent += len(payload)
+
+    async def run(self):
+        while not self.closed:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*self.peer), self.manager.connect_timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                await self.backoff(e)
+                continue
+
+            self.failures = 0
+            reader_task = asyncio.ensure_future(self.read_replies(reader))
+            try:
+                await self.write_frames(writer, reader_task)
+            except (OSError, ConnectionError) as e:
+                logging.error(f"Connection to {self.peer} lost - {e}")
+            finally:
+                reader_task.cancel()
+                writer.close()
+                self.fail_pending(ConnectionError(f"Connection to {self.peer} lost"))
+            if not self.closed:
+                await self.backoff(None)
+
+    async def write_frames(self, writer, reader_task):
+        """ Write queued frames, coalescing whatever is already queued into one drain. """
+        while not self.closed:
+            get_task = asyncio.ensure_future(self.queue.get())
+            try:
+                done, _ = await asyncio.wait({get_task, reader_task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not get_task.done():
+                    get_task.cancel()
+            if get_task not in done:
+                raise ConnectionError("peer closed the connection")
+            writer.write(get_task.result())
+            while not self.queue.empty():
+                writer.write(self.queue.get_nowait())
+            await writer.drain()
+
+    async def read_replies(self, reader):
+        while True:
+            payload = await read_frame(reader)
+            if payload is None:
+                return
+            self.manager.bytes_received += FRAME_HEADER.size + len(payload)
+            reply = decode_message(payload)
+            future = self.pending.pop(reply.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(reply.get("reply"))
+
+    async def backoff(self, error):
+        self.failures += 1
+        if error is not None:
+            logging.error(f"Failed to connect to {self.peer} - {error}")
+        if self.failures >= self.manager.max_failures:
+            self.manager.drop(self.peer)
+            return
+        delay = min(self.manager.max_backoff, self.manager.base_backoff * 2 ** (self.failures - 1))
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def request(self, message_id, payload, timeout):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        self.enqueue(payload)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(message_id, None)
+
+    def fail_pending(self, error):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+        self.fail_pending(ConnectionError(f"Connection to {self.peer} closed"))
+
+
+class ConnectionManager:
+    """
+    Keeps persistent, framed connections to peers on a background event loop.
+    Methods are safe to call from any thread. Broadcasts encode the message once and hand it to
+    every peer's send queue, so a slow peer only delays its own queue.
+    """
+
+    def __init__(self, max_queue=10000, connect_timeout=5, base_backoff=0.5, max_backoff=30,
+                 max_failures=5, on_peer_failed=None):
+        self.max_queue = max_queue
+        self.connect_timeout = connect_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.on_peer_failed = on_peer_failed
+        self.connections = {}  # (host, port) -> PeerConnection
+        self.message_ids = itertools.count(1)
+        self.bytes_sent = 0      # frames queued for peers
+        self.bytes_received = 0  # replies read back
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='peer-connections', daemon=True)
+        self.thread.start()
+
+    def connection(self, peer):
+        """ Return the connection for a peer, creating it on first use. Runs on the manager loop. """
+        peer = tuple(peer)
+        connection = self.connections.get(peer)
+        if connection is None:
+            connection = PeerConnection(self, peer)
+            self.connections[peer] = connection
+        return connection
+
+    def send(self, peer, message):
+        """ Queue a message for one peer without waiting for it to be written. """
+        frame = encode_frame(encode_message(message))
+        self.loop.call_soon_threadsafe(self.deliver, peer, frame)
+
+    def broadcast(self, peers, message):
+        """ Queue a message for every peer; the payload is encoded and framed once. """
+        frame = encode_frame(encode_message(message))
+        peers = list(peers)
+
+        def fan_out():
+            for peer in peers:
+                self.deliver(peer, frame)
+
+        self.loop.call_soon_threadsafe(fan_out)
+
+    def deliver(self, peer, frame):
+        """ Hand a framed message to a peer's send queue. Runs on the manager loop. """
+        self.connection(peer).enqueue(frame)
+
+    def request(self, peer, message, timeout=10):
+        """
+        Send a request over the pooled connection and block until the peer replies.
+        :param peer: (host, port) tuple.
+        :param message: <dict> Request message; an "id" field is added for matching the reply.
+        :return: The peer's reply.
+        """
+        return asyncio.run_coroutine_threadsafe(self.request_async(peer, message, timeout), self.loop).result(timeout + 1)
+
+    async def request_async(self, peer, message, timeout=10):
+        """ Coroutine form of request, for callers already running on the manager loop. """
+        message_id = next(self.message_ids)
+        payload = encode_frame(encode_message(dict(message, id=message_id)))
+        return await self.connection(peer).request(message_id, payload, timeout)
+
+    def drop(self, peer):
+        """ Close and forget a peer's connection. Runs on the manager loop. """
+        connection = self.connections.pop(tuple(peer), None)
+        if connection is None:
+            return
+        connection.close()
+        logging.warning(f"Giving up on peer {peer} after {self.max_failures} failed attempts")
+        if self.on_peer_failed:
+            self.on_peer_failed(tuple(peer))
+
+    def remove(self, peer):
+        """ Close a peer's connection from any thread. """
+        def close():
+            connection = self.connections.pop(tuple(peer), None)
+            if connection:
+                connection.close()
+
+        self.loop.call_soon_threadsafe(close)
+
+    def close(self):
+        """ Close every connection and stop the background loop. """
+        async def shutdown():
+            for connection in self.connections.values():
+                connection.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.connections.clear()
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
@@ -1,56 +1,197 @@
+import json
+import os
 import random
 import time
 import logging
 from hashlib import sha256
 from modules.transaction import TransactionPool
 from modules.blockchain import Blockchain
+from modules.stake import StakeIndex, to_units
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+DEFAULT_EPOCH_LENGTH = 100  # slots (block heights) per epoch
+CACHED_EPOCHS = 4
+SNAPSHOT_EPOCHS = 64  # per-epoch stake snapshots kept, so schedules can be recomputed after a reorg
+STAKES_FILE = 'stakes.json'  # written next to the account state snapshot
+
+
 class Consensus:
-    def __init__(self, blockchain, transaction_pool):
+    def __init__(self, blockchain, transaction_pool, epoch_length=DEFAULT_EPOCH_LENGTH):
         self.blockchain = blockchain
         self.transaction_pool = transaction_pool
-        self.stakeholders = {}  # Maps stakeholder public keys to their stake
+        self.stakeholders = {}  # Maps stakeholder public keys to their stake, in integer stake units
+        self.stake_index = StakeIndex()  # Cumulative stake, for O(log n) selection
         self.current_staker = None
+        self.epoch_length = epoch_length
+        self.schedules = {}  # epoch -> (hash of its boundary block, leader of each slot or None)
+        self.stake_snapshots = {}  # epoch -> {staker: stake units} frozen when it was first scheduled
+        self.stakes_path = None
+        if blockchain.state_path:
+            self.stakes_path = os.path.join(os.path.dirname(blockchain.state_path), STAKES_FILE)
+            self.load_stakes()
 
     def add_stakeholder(self, stakeholder_public_key, stake_amount):
-        """ Add a stakeholder to the list of stakeholders. """
-        if stake_amount <= 0:
+        """ Add a stakeholder to the list of stakeholders. `stake_amount` is in coins. """
+        units = to_units(stake_amount)
+        if units <= 0:
             raise ValueError("Stake amount must be positive.")
-        self.stakeholders[stakeholder_public_key] = self.stakeholders.get(stakeholder_public_key, 0) + stake_amount
+        self.stakeholders[stakeholder_public_key] = self.stake_index.update(stakeholder_public_key, units)
+        self.save_stakes()
         logging.info(f"Added stakeholder {stakeholder_public_key} with stake {stake_amount}.")
 
     def remove_stakeholder(self, stakeholder_public_key, stake_amount):
         """ Remove a stakeholder or decrease their stake. """
         if stakeholder_public_key in self.stakeholders:
-            self.stakeholders[stakeholder_public_key] -= stake_amount
-            if self.stakeholders[stakeholder_public_key] <= 0:
+            remaining = self.stake_index.update(stakeholder_public_key, -to_units(stake_amount))
+            if remaining <= 0:
                 del self.stakeholders[stakeholder_public_key]
+            else:
+                self.stakeholders[stakeholder_public_key] = remaining
+            self.save_stakes()
             logging.info(f"Removed stakeholder {stakeholder_public_key} or decreased their stake.")
 
-    def select_staker(self):
-        """ Select a staker based on weighted random selection. """
+    def select_staker(self, seed=None):
+        """
+        Select a staker based on weighted random selection, in O(log n).
+        :param seed: Optional seed (e.g. a block hash and slot number). Every node that has applied
+                     the same stake updates selects the same staker for the same seed.
+        """
         if not self.stakeholders:
             raise Exception("No stakeholders available for staking.")
 
-        total_stake = sum(self.stakeholders.values())
-        cumulative_weights = []
-        running_sum = 0
+        if seed is None:
+            staker = self.stake_index.select(random.random())
+        else:
+            staker = self.stake_index.select_seeded(seed)
+        logging.info(f"Selected staker {staker}.")
+        self.current_staker = staker
+        return staker
+
+    # -------------------------
+    # Leader schedule
+    # -------------------------
+    def epoch_of(self, slot):
+        return slot // self.epoch_length
+
+    def boundary_height(self, epoch):
+        """ Height of the last block before `epoch`; epoch 0 uses the genesis block. """
+        return max(epoch * self.epoch_length - 1, 0)
+
+    def boundary_hash(self, epoch):
+        height = self.boundary_height(epoch)
+        if height >= len(self.blockchain.chain):
+            raise ValueError(f"Epoch {epoch} cannot be scheduled before block {height} exists.")
+        return self.blockchain.hash(self.blockchain.get_block(height))
+
+    def epoch_seed(self, epoch):
+        """
+        Seed for an epoch: the hash of the last block before it, which every node agrees on once
+        that block is final.
+        """
+        return self.boundary_hash(epoch)
+
+    def epoch_stakes(self, epoch):
+        """
+        Stake of each staker for an epoch: the staking registry as it stood when the epoch was first
+        scheduled, which nodes do with prepare_epoch once its boundary block is in. Later changes to
+        the registry only affect later epochs, and a reorg reuses the snapshot with the new seed.
+        :return: <dict> staker -> stake units.
+        """
+        stakes = self.stake_snapshots.get(epoch)
+        if stakes is None:
+            stakes = self.stake_snapshots[epoch] = dict(self.stakeholders)
+            for stale in sorted(self.stake_snapshots)[:-SNAPSHOT_EPOCHS]:
+                del self.stake_snapshots[stale]
+            self.save_stakes()
+        return stakes
+
+    def save_stakes(self):
+        """ Write the registry and the per-epoch snapshots next to the account state, atomically. """
+        if self.stakes_path is None:
+            return
+        temporary = f"{self.stakes_path}.tmp"
+        with open(temporary, 'w') as stakes_file:
+            json.dump({'stakeholders': self.stakeholders, 'epochs': self.stake_snapshots}, stakes_file)
+        os.replace(temporary, self.stakes_path)
+
+    def load_stakes(self):
+        """
+        Restore what save_stakes wrote.
+        :return: <bool> True if the registry and snapshots were loaded.
+        """
+        try:
+            with open(self.stakes_path) as stakes_file:
+                saved = json.load(stakes_file)
+            stakeholders = saved['stakeholders']
+            snapshots = {int(epoch): stakes for epoch, stakes in saved['epochs'].items()}
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable stake snapshot {self.stakes_path} - {e}")
+            return False
+        self.stakeholders = stakeholders
+        self.stake_index = StakeIndex.from_stakes(stakeholders)
+        self.stake_snapshots = snapshots
+        logging.info(f"Loaded {len(stakeholders)} stakeholders and {len(snapshots)} epoch snapshots.")
+        return True
+
+    def compute_schedule(self, epoch):
+        """
+        Compute the leaders of every slot of an epoch from its stake snapshot, seeded by the hash of
+        its boundary block. The snapshot index is built over sorted keys, so nodes with the same
+        snapshot and chain derive the same schedule. Schedules are cached with the boundary block's hash; after a reorg replaces that
+        block, the cached schedule no longer matches and is recomputed.
+        :return: <list> Leader of each slot of the epoch, or None if nothing was staked.
+        """
+        boundary_hash = self.boundary_hash(epoch)
+        snapshot = StakeIndex.from_stakes(self.epoch_stakes(epoch))
+        schedule = None
+        if len(snapshot):
+            schedule = [snapshot.select_seeded(f"{boundary_hash}:{slot}") for slot in range(self.epoch_length)]
+        self.schedules[epoch] = (boundary_hash, schedule)
+        for stale in sorted(self.schedules)[:-CACHED_EPOCHS]:
+            del self.schedules[stale]
+        logging.info(f"Computed leader schedule for epoch {epoch} over {len(snapshot)} stakers.")
+        return schedule
+
+    def schedule_for(self, epoch):
+        """ An epoch's schedule, from the cache if it was computed on the current branch. """
+        cached = self.schedules.get(epoch)
+        if cached is not None and cached[0] == self.boundary_hash(epoch):
+            return cached[1]
+        return self.compute_schedule(epoch)
+
+    def prepare_epoch(self, epoch):
+        """ Compute and cache an epoch's schedule ahead of its first slot. """
+        return self.schedule_for(epoch)
 
-        for staker, stake in self.stakeholders.items():
-            running_sum += stake
-            cumulative_weights.append((staker, running_sum))
+    def leader_for_slot(self, slot):
+        """
+        The staker scheduled to propose the block at height `slot`, in O(1) once its epoch is cached.
+        :return: The leader, or None if nothing was staked at the epoch boundary.
+        """
+        epoch = self.epoch_of(slot)
+        schedule = self.schedule_for(epoch)
+        return None if schedule is None else schedule[slot - epoch * self.epoch_length]
 
-        random_point = random.uniform(0, total_stake)
-        for staker, weight in cumulative_weights:
-            if random_point <= weight:
-                logging.info(f"Selected staker {staker}.")
-                self.current_staker = staker
-                return staker
+    def create_block(self, proof, proposer=None):
+        """
+        Create the next block, proposed by `proposer` or else by the slot's scheduled leader.
+        """
+        if proposer is None:
+            proposer = self.leader_for_slot(len(self.blockchain.chain))
+        return self.blockchain.create_block(proof, proposer=proposer)
 
     def validate_block(self, block):
         """ Validate a block before adding it to the blockchain. """
-        previous_block = self.blockchain.get_last_block()
-        if block.previous_hash != previous_block.calculate_hash(
+        previous_block = self.blockchain.last_block
+        if not self.blockchain.validate_block(block, previous_block):
+            return False
+        # Block indexes start at 1 for the genesis block at height 0.
+        leader = self.leader_for_slot(block['index'] - 1)
+        if leader is not None and block.get('proposer') != leader:
+            logging.warning(f"Block {block['index']} was not proposed by the scheduled leader.")
+            return False
+        return True
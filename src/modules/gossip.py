@@ -0,0 +1,238 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.transaction import TransactionPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SEEN_CAPACITY = 100000
+PEER_SEEN_CAPACITY = 20000
+REJECTED_CAPACITY = 50000
+MAX_GETDATA = 1000
+MAX_ANNOUNCERS = 8
+FETCH_WORKERS = 16
+
+
+class SeenFilter:
+    """
+    Bounded set of recently seen hashes. The least recently seen hash is forgotten once the
+    filter is full, so memory stays fixed however long the node runs.
+    """
+
+    def __init__(self, capacity=SEEN_CAPACITY):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        """
+        Mark a hash as seen.
+        :return: <bool> True if the hash was not seen before.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return False
+            self.entries[key] = None
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class InventoryGossip:
+    """
+    Announce-then-fetch transaction gossip.
+    New transactions are announced to peers by hash (inv); a peer asks for the bodies it has not
+    seen (getdata) from the first peer that announced them. A node-wide seen filter stops repeated
+    fetches, and a filter per peer stops us announcing a hash back to a peer that already has it.
+    Fetches run on a thread pool rather than the handler thread, and hashes announced before a
+    fetch starts are batched into one getdata per peer. Other peers announcing a hash that is
+    being fetched are remembered, and the hash is fetched from the next of them if the first
+    peer fails to deliver it. Hashes whose bodies were delivered but rejected go into a bounded
+    rejected filter, so later announcements of them are ignored until the next block, which may
+    make them valid, clears it.
+    """
+
+    def __init__(self, transaction_pool, connections, origin, on_transactions,
+                 seen_capacity=SEEN_CAPACITY, peer_seen_capacity=PEER_SEEN_CAPACITY, timeout=10,
+                 rejected_capacity=REJECTED_CAPACITY, max_getdata=MAX_GETDATA, fetch_workers=FETCH_WORKERS):
+        self.transaction_pool = transaction_pool
+        self.connections = connections
+        self.origin = origin  # (host, port) peers use to reach us
+        self.on_transactions = on_transactions  # verifies, pools and announces a fetched batch
+        self.seen = SeenFilter(seen_capacity)
+        self.rejected = SeenFilter(rejected_capacity)
+        self.peer_seen_capacity = peer_seen_capacity
+        self.known = {}  # peer -> SeenFilter of hashes that peer has
+        self.timeout = timeout
+        self.max_getdata = max_getdata
+        self.announcers = {}  # hash being fetched -> peers that announced it, the one asked first
+        self.wanted = {}      # peer -> OrderedDict of hashes to ask it for in the next flush
+        self.flush_pending = False
+        self.closed = False
+        self.fetch_lock = threading.Lock()
+        self.fetcher = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='gossip-fetch')
+
+    def known_by(self, peer):
+        peer = tuple(peer)
+        known = self.known.get(peer)
+        if known is None:
+            known = self.known.setdefault(peer, SeenFilter(self.peer_seen_capacity))
+        return known
+
+    def mark_seen(self, hashes):
+        for hash_value in hashes:
+            self.seen.add(hash_value)
+
+    def forget_peer(self, peer):
+        self.known.pop(tuple(peer), None)
+
+    def announce(self, hashes, peers):
+        """
+        Send an inv for `hashes` to every peer that is not already known to have them.
+        :param hashes: <list> Transaction hashes.
+        :param peers: Iterable of (host, port) tuples.
+        """
+        for hash_value in hashes:
+            self.seen.add(hash_value)
+        for peer in list(peers):
+            known = self.known_by(peer)
+            fresh = [hash_value for hash_value in hashes if known.add(hash_value)]
+            if fresh:
+                self.connections.send(peer, {
+                    "action": "inv",
+                    "hashes": fresh,
+                    "peer_host": self.origin[0],
+                    "peer_port": self.origin[1],
+                })
+
+    def relay(self, key, message, peers):
+        """
+        Send a full message (e.g. a compact block) only to peers not known to have `key` yet.
+        :return: <int> Number of peers the message was sent to.
+        """
+        targets = [peer for peer in list(peers) if self.known_by(peer).add(key)]
+        if targets:
+            self.connections.broadcast(targets, message)
+        return len(targets)
+
+    def handle_inv(self, message):
+        """ Queue the announced transactions we have not seen for fetching from the announcing peer. """
+        peer = (message["peer_host"], message["peer_port"])
+        hashes = message.get("hashes") or []
+        known = self.known_by(peer)
+        for hash_value in hashes:
+            known.add(hash_value)
+
+        with self.fetch_lock:
+            for hash_value in hashes:
+                if hash_value in self.transaction_pool or hash_value in self.rejected:
+                    continue
+                announcers = self.announcers.get(hash_value)
+                if announcers is not None:
+                    if peer not in announcers and len(announcers) < MAX_ANNOUNCERS:
+                        announcers.append(peer)
+                elif self.seen.add(hash_value):
+                    self.announcers[hash_value] = [peer]
+                    self.want(peer, hash_value)
+
+    def want(self, peer, hash_value):
+        """ Queue a hash for the next flush. Called with `fetch_lock` held. """
+        self.wanted.setdefault(peer, OrderedDict())[hash_value] = None
+        if not self.flush_pending and not self.closed:
+            self.flush_pending = True
+            self.fetcher.submit(self.flush)
+
+    def flush(self):
+        """ Send one getdata per peer, of at most `max_getdata` hashes, for everything queued. """
+        with self.fetch_lock:
+            wanted, self.wanted = self.wanted, {}
+            self.flush_pending = False
+            if self.closed:
+                return
+        for peer, hashes in wanted.items():
+            hashes = list(hashes)
+            for start in range(0, len(hashes), self.max_getdata):
+                self.fetcher.submit(self.fetch, peer, hashes[start:start + self.max_getdata])
+
+    def fetch(self, peer, hashes):
+        if self.closed:
+            return
+        try:
+            reply = self.connections.request(peer, {"action": "getdata", "hashes": hashes}, self.timeout)
+            transactions = (reply.get("transactions") or []) if reply else []
+        except Exception as e:
+            logging.error(f"Failed to fetch announced transactions from {peer} - {e}")
+            transactions = []
+
+        requested = set(hashes)
+        delivered = {}
+        for transaction in transactions:
+            try:
+                hash_value = TransactionPool.transaction_id(transaction)
+            except (TypeError, ValueError):
+                continue
+            if hash_value in requested:
+                delivered.setdefault(hash_value, transaction)
+        if len(delivered) < len(transactions):
+            logging.warning(f"Ignored {len(transactions) - len(delivered)} unrequested transactions from {peer}")
+
+        if delivered:
+            try:
+                self.on_transactions(list(delivered.values()))
+            except Exception as e:
+                logging.error(f"Rejected transactions from {peer} - {e}")
+
+        with self.fetch_lock:
+            for hash_value in hashes:
+                announcers = self.announcers.pop(hash_value, None) or []
+                if hash_value in self.transaction_pool:
+                    continue
+                if hash_value in delivered:
+                    # The rejected filter, not the seen filter, keeps it from being fetched again.
+                    self.rejected.add(hash_value)
+                    self.seen.discard(hash_value)
+                    continue
+                # Ask the next peer that announced it; with none left, let a later announcement fetch it.
+                remaining = [announcer for announcer in announcers if announcer != peer]
+                if remaining:
+                    self.announcers[hash_value] = remaining
+                    self.want(remaining[0], hash_value)
+                else:
+                    self.seen.discard(hash_value)
+
+    def clear_rejected(self):
+        """ Forget rejected hashes, e.g. once a new block may have made them valid. """
+        self.rejected.clear()
+
+    def close(self):
+        # Queued fetches see `closed` and return at once, so this does not wait on the network.
+        with self.fetch_lock:
+            self.closed = True
+            self.wanted.clear()
+        self.fetcher.shutdown(wait=False)
+
+    def handle_getdata(self, message):
+        """ Reply with the requested transactions that are still in our pool. """
+        transactions = []
+        for hash_value in message.get("hashes") or []:
+            transaction = self.transaction_pool.get(hash_value)
+            if transaction is not None:
+                transactions.append(transaction.to_dict())
+        return {"transactions": transactions}
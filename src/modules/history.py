@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+
+from modules.state import MINT_SENDERS, transaction_fields
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ADDRESS_INDEX_FILE = 'addresses.jsonl'
+
+
+class AddressIndex:
+    """
+    Secondary index from address to the (block height, transaction position) pairs that involve it.
+    Entries are appended block by block, so each address's list is ordered by height and a page of
+    its history is a slice. A reorg drops the entries above the fork point. With a path, each
+    block's entries are appended to a log file beside the block store and reloaded on startup.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}     # address -> [(height, position)], oldest first
+        self.touched = []     # height -> addresses with entries in that block
+        self.hashes = []      # height -> block hash
+        self.offsets = []     # height -> offset of the block's record in the log file
+        self.log = None
+        if path:
+            self.load()
+            self.log = open(path, 'ab')
+
+    @property
+    def height(self):
+        return len(self.hashes) - 1
+
+    def add_block(self, height, block_hash, transactions):
+        """ Index the transactions of the block at `height`, which must follow the last indexed block. """
+        if height != len(self.hashes):
+            raise ValueError(f"Block {height} does not follow address index height {self.height}.")
+        pairs = []
+        for position, transaction in enumerate(transactions):
+            sender, receiver, _, _ = transaction_fields(transaction)
+            for address in (sender, receiver):
+                if address is None or address in MINT_SENDERS or (address, position) in pairs[-1:]:
+                    continue
+                pairs.append((address, position))
+        self.insert(block_hash, pairs)
+        if self.log:
+            self.offsets.append(self.log.tell())
+            record = json.dumps({'hash': block_hash, 'entries': pairs}) + '\n'
+            self.log.write(record.encode())
+            self.log.flush()
+
+    def insert(self, block_hash, pairs):
+        height = len(self.hashes)
+        touched = []
+        for address, position in pairs:
+            history = self.entries.get(address)
+            if history is None:
+                history = self.entries[address] = []
+            if not history or history[-1][0] != height:
+                touched.append(address)
+            history.append((height, position))
+        self.touched.append(touched)
+        self.hashes.append(block_hash)
+
+    def truncate(self, height):
+        """ Drop every block above `height`. """
+        while len(self.hashes) > height + 1:
+            for address in self.touched.pop():
+                history = self.entries[address]
+                while history and history[-1][0] == len(self.hashes) - 1:
+                    history.pop()
+                if not history:
+                    del self.entries[address]
+            self.hashes.pop()
+        if self.log and len(self.offsets) > height + 1:
+            self.log.truncate(self.offsets[height + 1])
+            self.log.seek(0, os.SEEK_END)
+            del self.offsets[height + 1:]
+
+    def count(self, address):
+        return len(self.entries.get(address, ()))
+
+    def page(self, address, offset=0, limit=50, newest_first=True):
+        """
+        :return: <list> Up to `limit` (height, position) pairs, skipping the first `offset`.
+        """
+        history = self.entries.get(address, [])
+        if newest_first:
+            end = max(len(history) - offset, 0)
+            return history[max(end - limit, 0):end][::-1]
+        return history[offset:offset + limit]
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def load(self):
+        """ Rebuild the in-memory index from the log, dropping a torn trailing record. """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as log:
+            data = log.read()
+        offset = 0
+        while offset < len(data):
+            end = data.find(b'\n', offset)
+            if end < 0:
+                break
+            try:
+                record = json.loads(data[offset:end])
+                pairs = [(address, position) for address, position in record['entries']]
+            except (ValueError, KeyError, TypeError):
+                break
+            self.offsets.append(offset)
+            self.insert(record['hash'], pairs)
+            offset = end + 1
+        if offset < len(data):
+            logging.warning("Discarding damaged address index records.")
+            with open(self.path, 'r+b') as log:
+                log.truncate(offset)
+        logging.info(f"Loaded address index for {len(self.hashes)} blocks from {self.path}.")
+
+    def reset(self):
+        self.entries = {}
+        self.touched = []
+        self.hashes = []
+        self.offsets = []
+        if self.log:
+            self.log.truncate(0)
+            self.log.seek(0)
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
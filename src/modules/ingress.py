@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Lower numbers are served first: blocks, then requests peers are waiting on, then transaction gossip.
+BLOCK_PRIORITY = 0
+REQUEST_PRIORITY = 1
+TRANSACTION_PRIORITY = 2
+PRIORITIES = {
+    "new_block": BLOCK_PRIORITY,
+    "compact_block": BLOCK_PRIORITY,
+    "get_block_txns": BLOCK_PRIORITY,
+    "new_transaction": TRANSACTION_PRIORITY,
+    "inv": TRANSACTION_PRIORITY,
+}
+
+
+def rejection(reason):
+    """ Reply sent in place of a handler's result when a message is shed. """
+    return {"status": "rejected", "reason": reason}
+
+
+class TokenBucket:
+    """ Allows `rate` messages per second on average, with bursts of up to `capacity`. """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now=None, cost=1):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def full(self, now):
+        """ True once the bucket has refilled; it is then no different from a new one. """
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def peer_key(peer):
+    """
+    Identity a peer is rate-limited under: the host its connection comes from. The connection's port
+    is ephemeral and the listening port a peer reports is not checked, so keying on either would let
+    a peer start over with a full budget just by reconnecting. Peers behind one address share a budget.
+    """
+    return peer[0] if peer else None
+
+
+class IngressQueue:
+    """
+    Bounded, prioritised queue between the peer server and its message handlers.
+    Each peer host (see peer_key) has a token bucket; messages over the rate are rejected straight
+    away, and buckets that have refilled are dropped so idle peers are not tracked. When the queue
+    is full a new message displaces the newest queued message of a lower priority, or is rejected
+    itself if there is none. Rejected messages get an explicit rejection reply.
+    Used from a single event loop.
+    """
+
+    def __init__(self, max_size=10000, peer_rate=500, peer_burst=1000, max_tracked_peers=4096):
+        self.max_size = max_size
+        self.peer_rate = peer_rate
+        self.peer_burst = peer_burst
+        self.max_tracked_peers = max_tracked_peers
+        self.buckets = OrderedDict()  # host -> TokenBucket, least recently active first
+        self.queues = [deque() for _ in range(TRANSACTION_PRIORITY + 1)]
+        self.size = 0
+        self.ready = None
+        self.stats = {"accepted": 0, "rate_limited": 0, "overloaded": 0}
+
+    def start(self):
+        """ Bind to the running event loop. """
+        self.ready = asyncio.Semaphore(0)
+
+    def bucket(self, peer, now=None):
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        bucket = self.buckets.get(peer)
+        if bucket is None:
+            bucket = self.buckets[peer] = TokenBucket(self.peer_rate, self.peer_burst)
+            if len(self.buckets) > self.max_tracked_peers:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(peer)
+        return bucket
+
+    def expire(self, now):
+        """ Drop the least recently active buckets that have refilled completely. """
+        while self.buckets:
+            peer, bucket = next(iter(self.buckets.items()))
+            if not bucket.full(now):
+                break
+            del self.buckets[peer]
+
+    def admit(self, peer, handler, message):
+        """
+        Queue a message for its handler.
+        :param peer: Address of the connection the message arrived on; the rate limit is per peer_key.
+        :return: A Future for the handler's result, or a rejection reply if the message was shed.
+        """
+        if not self.bucket(peer_key(peer)).take():
+            self.stats["rate_limited"] += 1
+            return rejection("rate_limited")
+
+        priority = PRIORITIES.get(message.get("action"), REQUEST_PRIORITY)
+        displaced = False
+        if self.size >= self.max_size:
+            displaced = self.shed_below(priority)
+            if not displaced:
+                self.stats["overloaded"] += 1
+                return rejection("overloaded")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].append((handler, message, future))
+        self.stats["accepted"] += 1
+        if displaced:
+            return future
+        self.size += 1
+        self.ready.release()
+        return future
+
+    def shed_below(self, priority):
+        """ Drop the newest queued message with a lower priority than `priority`. """
+        for lower in range(len(self.queues) - 1, priority, -1):
+            if self.queues[lower]:
+                _, _, future = self.queues[lower].pop()
+                self.stats["overloaded"] += 1
+                if not future.done():
+                    future.set_result(rejection("overloaded"))
+                return True
+        return False
+
+    async def get(self):
+        """ Wait for the highest-priority queued message. """
+        await self.ready.acquire()
+        self.size -= 1
+        for queue in self.queues:
+            if queue:
+                return queue.popleft()
+        raise RuntimeError("Ingress queue is out of step with its semaphore.")
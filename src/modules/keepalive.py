@@ -0,0 +1,139 @@
+import asyncio
+import bisect
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Upper bounds of the round-trip time buckets, in seconds; the last bucket is open-ended.
+RTT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+class RttHistogram:
+    """ Fixed-bucket histogram of round-trip times, so memory per peer stays constant. """
+
+    def __init__(self, bounds=RTT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, rtt):
+        self.counts[bisect.bisect_left(self.bounds, rtt)] += 1
+        self.count += 1
+        self.total += rtt
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket holding the given fraction of samples.
+        :param fraction: <float> e.g. 0.5 for the median.
+        :return: <float> Seconds, inf for the open-ended bucket, or None without samples.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for position, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.bounds[position] if position < len(self.bounds) else float('inf')
+        return float('inf')
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class KeepaliveScheduler:
+    """
+    Pings peers over their pooled connections from the connection manager's event loop.
+    Probes are spread evenly over the interval instead of fired in a burst, and each one runs as
+    its own task, so a slow peer never holds up the others. Round-trip times go into a histogram
+    per peer and into the PeerManager's latency score; a peer that misses `max_missed` pongs in
+    a row is evicted.
+    """
+
+    def __init__(self, connections, peers, interval=30, timeout=5, max_missed=3, on_evict=None):
+        self.connections = connections
+        self.peers = peers
+        self.interval = interval
+        self.timeout = timeout
+        self.max_missed = max_missed
+        self.on_evict = on_evict
+        self.histograms = {}  # peer -> RttHistogram
+        self.missed = {}      # peer -> consecutive missed pongs
+        self.future = None
+
+    def start(self):
+        if self.future is None:
+            self.future = asyncio.run_coroutine_threadsafe(self.run(), self.connections.loop)
+
+    def stop(self):
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+
+    async def run(self):
+        probes = set()
+        try:
+            while True:
+                peers = list(self.peers)
+                if not peers:
+                    await asyncio.sleep(self.interval)
+                    continue
+                gap = self.interval / len(peers)
+                for peer in peers:
+                    if peer not in self.peers:
+                        continue  # evicted earlier in this round
+                    probe = asyncio.ensure_future(self.probe(peer))
+                    probes.add(probe)
+                    probe.add_done_callback(probes.discard)
+                    await asyncio.sleep(gap)
+        finally:
+            for probe in probes:
+                probe.cancel()
+
+    async def probe(self, peer):
+        """ Ping one peer and record the round trip, or count a miss. """
+        started = time.monotonic()
+        try:
+            reply = await self.connections.request_async(peer, {"action": "ping"}, self.timeout)
+            if not reply or reply.get("action") != "pong":
+                raise ValueError(f"unexpected reply {reply!r}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record_miss(peer, e)
+            return
+        rtt = time.monotonic() - started
+        self.missed[peer] = 0
+        self.histograms.setdefault(peer, RttHistogram()).record(rtt)
+        self.peers.record_success(peer, rtt)
+
+    def record_miss(self, peer, error):
+        self.missed[peer] = self.missed.get(peer, 0) + 1
+        logging.warning(f"Missed pong from {peer} ({self.missed[peer]}/{self.max_missed}) - {str(error) or 'timed out'}")
+        if self.missed[peer] < self.max_missed:
+            self.peers.record_failure(peer)
+            return
+        logging.warning(f"Evicting unresponsive peer {peer}")
+        self.missed.pop(peer, None)
+        self.histograms.pop(peer, None)
+        self.connections.remove(peer)
+        if self.on_evict:
+            self.on_evict(peer)
+        else:
+            self.peers.record_failure(peer)
+            self.peers.discard(peer)
+
+    def rtt_stats(self):
+        """ Round-trip time summary per peer. """
+        return {peer: histogram.to_dict() for peer, histogram in list(self.histograms.items())}
@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+# Domain separation keeps a leaf from ever being reinterpreted as an inner node.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()
+
+
+def transaction_hash(transaction):
+    """ Hash a transaction (a dict, or an object with `to_dict`) into a Merkle leaf. """
+    if hasattr(transaction, 'to_dict'):
+        transaction = transaction.to_dict()
+    encoded = json.dumps(transaction, sort_keys=True).encode()
+    return hashlib.sha256(LEAF_PREFIX + encoded).hexdigest()
+
+
+def _hash_pair(left, right):
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level):
+    # An odd last node is promoted unchanged. Pairing it with a copy of itself would let
+    # [a, b, c] and [a, b, c, c] share a root (CVE-2012-2459).
+    paired = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        paired.append(level[-1])
+    return paired
+
+
+def merkle_root(transactions):
+    """
+    Compute the Merkle root committing to a list of transactions.
+    :param transactions: <list> Transaction dicts or objects.
+    :return: <str> Hex root, or EMPTY_ROOT for an empty list.
+    """
+    level = [transaction_hash(tx) for tx in transactions]
+    if not level:
+        return EMPTY_ROOT
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+def merkle_proof(transactions, index):
+    """
+    Build an inclusion proof for the transaction at `index`.
+    :param transactions: <list> Transactions of the block.
+    :param index: <int> Position of the transaction to prove.
+    :return: <list> of (sibling hash, sibling_is_left) pairs, leaf to root.
+    """
+    level = [transaction_hash(tx) for tx in transactions]
+    if not 0 <= index < len(level):
+        raise IndexError("Transaction index out of range.")
+    proof = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < index))
+        # Otherwise the node is promoted to the next level without a sibling.
+        level = _next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(transaction, proof, root):
+    """
+    Check a transaction's inclusion against a Merkle root in O(log n).
+    :param transaction: The transaction dict or object.
+    :param proof: <list> Output of merkle_proof.
+    :param root: <str> Expected Merkle root.
+    :return: <bool>
+    """
+    current = transaction_hash(transaction)
+    for sibling, sibling_is_left in proof:
+        current = _hash_pair(sibling, current) if sibling_is_left else _hash_pair(current, sibling)
+    return current == root
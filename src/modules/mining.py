@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Nonces each worker tries between checks of the shared stop flag.
+CHUNK_SIZE = 20000
+# Below this difficulty a search takes less time than starting the worker processes; the
+# default difficulty of 4 is at the threshold, so it is mined in parallel.
+MIN_PARALLEL_DIFFICULTY = 4
+# Seconds between checks that the workers are still alive.
+POLL_INTERVAL = 1.0
+
+
+def target_for_difficulty(difficulty):
+    """ Return the integer a digest must stay below to have `difficulty` leading hex zeros. """
+    return 1 << (256 - 4 * difficulty)
+
+
+def search_nonces(prefix, suffix, target, start, stop):
+    """
+    Scan nonces in [start, stop) for a digest below the target.
+    The SHA-256 state over the prefix is computed once and copied per nonce,
+    so each attempt only hashes the nonce and the suffix that follows it.
+    :param prefix: <bytes> Serialized header up to the nonce.
+    :param suffix: <bytes> Serialized header after the nonce.
+    :param target: <int> Exclusive upper bound for the digest.
+    :return: (nonce, hex digest) of the first match, or None.
+    """
+    base = hashlib.sha256(prefix)
+    for nonce in range(start, stop):
+        candidate = base.copy()
+        candidate.update(b'%d' % nonce + suffix)
+        digest = candidate.digest()
+        if int.from_bytes(digest, 'big') < target:
+            return nonce, digest.hex()
+    return None
+
+
+def _mine_worker(prefix, suffix, target, worker_id, workers, start_nonce, found, results):
+    """ Process entry point: scan interleaved chunks of the nonce space until any worker succeeds. """
+    chunk = worker_id
+    while not found.is_set():
+        start = start_nonce + chunk * CHUNK_SIZE
+        match = search_nonces(prefix, suffix, target, start, start + CHUNK_SIZE)
+        if match:
+            found.set()
+            results.put(match)
+            return
+        chunk += workers
+
+
+class ParallelMiner:
+    def __init__(self, workers=None, min_parallel_difficulty=MIN_PARALLEL_DIFFICULTY):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_difficulty = min_parallel_difficulty
+
+    def mine(self, prefix, suffix, difficulty, start_nonce=0):
+        """
+        Find a nonce whose header hash has `difficulty` leading hex zeros.
+        Easy targets are searched in this process; harder ones are split over worker processes.
+        :param prefix: <bytes> Serialized header up to the nonce.
+        :param suffix: <bytes> Serialized header after the nonce.
+        :param difficulty: <int> Required number of leading zeros.
+        :return: (nonce, hex digest).
+        :raises RuntimeError: if every worker process died without finding a nonce.
+        """
+        target = target_for_difficulty(difficulty)
+        if self.workers == 1 or difficulty < self.min_parallel_difficulty:
+            return self.mine_serial(prefix, suffix, target, start_nonce)
+
+        context = multiprocessing.get_context()
+        found = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_mine_worker,
+                args=(prefix, suffix, target, worker_id, self.workers, start_nonce, found, results),
+                daemon=True
+            )
+            for worker_id in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            nonce, block_hash = self.wait_for_result(results, processes)
+        finally:
+            found.set()
+            for process in processes:
+                process.join()
+        logging.info(f"Nonce {nonce} found using {self.workers} worker processes.")
+        return nonce, block_hash
+
+    @staticmethod
+    def mine_serial(prefix, suffix, target, start_nonce=0):
+        start = start_nonce
+        while True:
+            match = search_nonces(prefix, suffix, target, start, start + CHUNK_SIZE)
+            if match:
+                return match
+            start += CHUNK_SIZE
+
+    @staticmethod
+    def wait_for_result(results, processes):
+        """ Wait for a worker's match, giving up if all of them have exited without one. """
+        while True:
+            try:
+                return results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    # A match put just before the last worker exited may still be in flight.
+                    try:
+                        return results.get(timeout=POLL_INTERVAL)
+                    except queue.Empty:
+                        raise RuntimeError("All mining workers exited without finding a nonce.")
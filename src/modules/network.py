@@ -1,102 +1,197 @@
 import socket
 import threading
-import json
 import logging
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from modules.config import load_config
+from modules.keepalive import KeepaliveScheduler
 from modules.node import Node
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+DEFAULT_SEEDS = [
+    ("127.0.0.1", 5001),
+    ("127.0.0.1", 5002)
+]
+
 
 class Network:
-    def __init__(self, host='127.0.0.1', port=5000):
+    def __init__(self, host='127.0.0.1', port=5000, seeds=None, connect_timeout=5, gossip_fanout=3,
+                 ping_interval=30, max_missed_pings=3, data_dir=None, max_peers=8, peers_file=None,
+                 pipelined_relay=False, parallel_validation=False):
+        """
+        :param peers_file: <str> Where the address book is saved, so a restart reconnects to known
+                           peers without going through the seeds first.
+        """
         self.host = host
         self.port = port
-        self.node = Node(host, port)
-        self.peers = set()
+        self.node = Node(host, port, data_dir=data_dir, max_peers=max_peers, pipelined_relay=pipelined_relay,
+                         parallel_validation=parallel_validation)
+        self.peers = self.node.peers
+        self.seeds = DEFAULT_SEEDS if seeds is None else seeds
+        self.peers_file = peers_file
+        if peers_file:
+            self.peers.load(peers_file)
+        self.ready = threading.Event()
+        self.connect_timeout = connect_timeout
+        self.gossip_fanout = gossip_fanout
         self.lock = threading.Lock()
+        self.node.connections.on_peer_failed = self.forget_peer
+        self.keepalive = KeepaliveScheduler(
+            self.node.connections, self.peers, interval=ping_interval, timeout=connect_timeout,
+            max_missed=max_missed_pings, on_evict=self.forget_peer
+        )
+        self.node.handlers.update({
+            "ping": self.respond_pong,
+            "new_peer": self.add_new_peer,
+            "sync_chain": self.sync_chain_with_peer,
+        })
+
+    @classmethod
+    def from_config(cls, config):
+        """ Build a Network from a configuration dict returned by `load_config`. """
+        return cls(
+            host=config["host"], port=config["port"], seeds=config["seeds"],
+            connect_timeout=config["connect_timeout"], data_dir=config["data_dir"],
+            max_peers=config["max_peers"], peers_file=config["peers_file"],
+            pipelined_relay=config["pipelined_relay"], parallel_validation=config["parallel_validation"],
+        )
 
     def start_network(self):
         """ Start network services for SypherCore. """
-        threading.Thread(target=self.node.start_server).start()
+        threading.Thread(target=self.listen_for_network_requests).start()
         self.auto_discovery()
+        self.keepalive.start()
+
+    def bootstrap(self, ready_timeout=10, min_peers=1, sync=True):
+        """
+        Start the node without any prompts and return once it is ready or `ready_timeout` has passed.
+        The server is started, then saved peers and seeds are connected to in parallel. The node
+        is ready once it is listening and has `min_peers` active peers. Chain sync and keepalive
+        pings keep running in the background.
+        :return: <bool> True if the node became ready in time.
+        """
+        deadline = time.monotonic() + ready_timeout
+        threading.Thread(target=self.listen_for_network_requests, name='peer-server', daemon=True).start()
+        if not self.node.listening.wait(ready_timeout):
+            logging.error(f"Peer server did not start within {ready_timeout}s.")
+            return False
+
+        # Peers that served us before are tried alongside the seeds rather than after them.
+        known = self.peers.candidates()[:self.peers.max_active * 2]
+        self.connect_to_peers(list(dict.fromkeys(list(self.seeds) + known)), deadline)
+        if len(self.peers) < self.peers.max_active and time.monotonic() < deadline:
+            self.exchange_peers()
+            self.fill_active_set(deadline)
+
+        self.keepalive.start()
+        if sync and len(self.peers):
+            threading.Thread(target=self.node.sync_with_peers, name='initial-sync', daemon=True).start()
+        self.save_peers()
+
+        if len(self.peers) >= min_peers:
+            self.ready.set()
+            logging.info(f"Node ready with {len(self.peers)} peers after "
+                         f"{ready_timeout - (deadline - time.monotonic()):.2f}s.")
+        else:
+            logging.warning(f"Only {len(self.peers)} of {min_peers} required peers reached within {ready_timeout}s.")
+        return self.ready.is_set()
 
     def auto_discovery(self):
-        """ Automatically discover and connect to other peers. """
+        """ Connect to the seed peers, learn addresses from them and fill the active set. """
         logging.info("Starting auto-discovery of peers.")
-        known_peers = [
-            ("127.0.0.1", 5001),
-            ("127.0.0.1", 5002)
-        ]
-        for peer_host, peer_port in known_peers:
-            self.connect_to_peer(peer_host, peer_port)
+        self.connect_to_peers(self.seeds)
+        self.exchange_peers()
+        self.fill_active_set()
+
+    def fill_active_set(self, deadline=None):
+        """ Connect to the best-scored addresses in the address book until the active set is full. """
+        free = self.peers.max_active - len(self.peers)
+        if free > 0:
+            self.connect_to_peers(self.peers.candidates()[:free], deadline)
+
+    def connect_to_peers(self, peers, deadline=None):
+        """
+        Connect to several peers concurrently, stopping once the active set is full.
+        Connections still pending at `deadline` (a time.monotonic() value) are left to finish on
+        their own.
+        """
+        if not peers:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(len(peers), 32), thread_name_prefix='peer-connect')
+        futures = [executor.submit(self.connect_if_room, peer_host, peer_port) for peer_host, peer_port in peers]
+        executor.shutdown(wait=False)
+        wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def connect_if_room(self, peer_host, peer_port):
+        if len(self.peers) >= self.peers.max_active:
+            self.peers.learn([(peer_host, peer_port)])
+            return False
+        return self.connect_to_peer(peer_host, peer_port)
 
     def connect_to_peer(self, peer_host, peer_port):
-        """ Connect to a new peer and add them to the peer list. """
-        with self.lock:
+        """ Connect to a peer, recording the connect latency, and make it active if there is room. """
+        peer = (peer_host, peer_port)
+        self.peers.learn([peer])
+        try:
+            started = time.monotonic()
+            peer_socket = socket.create_connection(peer, timeout=self.connect_timeout)
+            peer_socket.close()
+        except Exception as e:
+            logging.error(f"Failed to connect to peer {peer_host}:{peer_port} - {e}")
+            self.peers.record_failure(peer)
+            return False
+        self.peers.record_success(peer, time.monotonic() - started)
+        if self.peers.add(peer):
+            logging.info(f"Successfully connected to peer: {peer_host}:{peer_port}")
+        return True
+
+    def exchange_peers(self, count=None):
+        """ Ask a few random active peers for a sample of their address books. """
+        peers = list(self.peers)
+        for peer in random.sample(peers, min(count or self.gossip_fanout, len(peers))):
             try:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                peer_socket.connect((peer_host, peer_port))
-                self.peers.add((peer_host, peer_port))
-                logging.info(f"Successfully connected to peer: {peer_host}:{peer_port}")
-                peer_socket.close()
+                started = time.monotonic()
+                addresses = self.node.connections.request(peer, {"action": "get_peers"}, self.connect_timeout)
             except Exception as e:
-                logging.error(f"Failed to connect to peer {peer_host}:{peer_port} - {e}")
+                logging.error(f"Failed to fetch peers from {peer} - {e}")
+                self.peers.record_failure(peer)
+                continue
+            self.peers.record_success(peer, time.monotonic() - started)
+            self.peers.learn(addresses or [])
 
     def listen_for_network_requests(self):
-        """ Listen for incoming requests from peers. """
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((self.host, self.port))
-        server_socket.listen(10)
-        logging.info(f"Network server listening on {self.host}:{self.port}")
-
-        while True:
-            client_socket, client_address = server_socket.accept()
-            logging.info(f"Received connection from {client_address}")
-            threading.Thread(target=self.handle_request, args=(client_socket,)).start()
-
-    def handle_request(self, client_socket):
-        """ Handle incoming requests from peers. """
-        try:
-            data = client_socket.recv(4096).decode()
-            if not data:
-                return
-
-            request = json.loads(data)
-            action = request.get("action")
-
-            if action == "ping":
-                self.respond_pong(client_socket)
-            elif action == "new_peer":
-                self.add_new_peer(request)
-            elif action == "sync_chain":
-                self.sync_chain_with_peer(request)
-            else:
-                logging.warning(f"Unknown action received: {action}")
-
-        except Exception as e:
-            logging.error(f"Error handling peer request: {e}")
-        finally:
-            client_socket.close()
+        """ Listen for incoming requests from peers; node and network actions share one server. """
+        self.node.start_server()
 
-    def respond_pong(self, client_socket):
+    def respond_pong(self, request):
         """ Respond to a ping request from a peer. """
-        response = json.dumps({"action": "pong"})
-        client_socket.sendall(response.encode())
         logging.info("Responded with PONG to peer.")
+        return {"action": "pong"}
+
+    def forget_peer(self, peer):
+        """ Drop a peer whose connection could not be re-established. """
+        self.node.forget_peer(peer)
 
     def add_new_peer(self, request):
-        """ Add a new peer to the peer list. """
+        """ Record a newly announced peer and reply with a sample of our address book. """
         peer_host = request.get("peer_host")
         peer_port = request.get("peer_port")
         if peer_host and peer_port:
-            self.peers.add((peer_host, peer_port))
-            logging.info(f"Added new peer to network: {peer_host}:{peer_port}")
+            if self.peers.add((peer_host, peer_port)):
+                logging.info(f"Added new peer to network: {peer_host}:{peer_port}")
             self.broadcast_peer_list()
+        return {"peers": self.peers.sample()}
 
     def sync_chain_with_peer(self, request):
-        """ Sync blockchain with a peer. """
+        """ Sync blockchain with a peer, headers first; a full chain in the request is still accepted. """
+        peer_host = request.get("peer_host")
+        peer_port = request.get("peer_port")
+        if peer_host and peer_port:
+            self.node.synchronizer.sync([(peer_host, peer_port)])
+            return
+
         peer_chain = request.get("chain")
         if peer_chain:
             with self.lock:
@@ -108,55 +203,68 @@ class Network:
                     logging.info("Current chain is longer or equal. No replacement needed.")
 
     def broadcast_peer_list(self):
-        """ Broadcast updated peer list to all known peers. """
-        message = json.dumps({
+        """ Share a sample of our address book with a few random peers. """
+        message = {
             "action": "update_peers",
-            "peers": list(self.peers)
-        })
-        self.broadcast(message)
+            "peers": self.peers.sample()
+        }
+        peers = list(self.peers)
+        targets = random.sample(peers, min(self.gossip_fanout, len(peers)))
+        self.node.connections.broadcast(targets, message)
 
     def broadcast(self, message):
-        """ Send a message to all peers. """
+        """ Send a message to all peers over their pooled connections. """
         with self.lock:
-            for peer in list(self.peers):
-                try:
-                    peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    peer_socket.connect(peer)
-                    peer_socket.sendall(message.encode())
-                    peer_socket.close()
-                    logging.info(f"Broadcasted message to {peer}")
-                except Exception as e:
-                    logging.error(f"Failed to send message to {peer} - {e}")
-                    self.peers.discard(peer)
-
-    def initiate_ping(self):
-        """ Periodically ping all peers to maintain connections. """
-        while True:
-            time.sleep(30)
-            for peer in list(self.peers):
-                try:
-                    peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    peer_socket.connect(peer)
-                    ping_message = json.dumps({"action": "ping"})
-                    peer_socket.sendall(ping_message.encode())
-                    peer_socket.close()
-                    logging.info(f"Pinged {peer}")
-                except Exception as e:
-                    logging.error(f"Failed to ping {peer} - {e}")
-                    self.peers.discard(peer)
+            peers = list(self.peers)
+        self.node.connections.broadcast(peers, message)
+        logging.info(f"Broadcasted message to {len(peers)} peers")
+
+    def rtt_stats(self):
+        """ Round-trip times measured by the keepalive pings, per peer. """
+        return self.keepalive.rtt_stats()
+
+    def save_peers(self):
+        if not self.peers_file:
+            return
+        try:
+            self.peers.save(self.peers_file)
+        except OSError as e:
+            logging.error(f"Failed to save peer table to {self.peers_file} - {e}")
+
+    def stop_network(self):
+        self.keepalive.stop()
+        self.save_peers()
+        self.node.stop_node()
 
 
 if __name__ == "__main__":
     import argparse
+    from modules.config import parse_address
 
     parser = argparse.ArgumentParser(description="SypherCore Network")
-    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host address for the network")
-    parser.add_argument("--port", type=int, default=5000, help="Port for the network")
+    parser.add_argument("--config", type=str, default=None, help="JSON configuration file")
+    parser.add_argument("--host", type=str, default=None, help="Host address for the network")
+    parser.add_argument("--port", type=int, default=None, help="Port for the network")
+    parser.add_argument("--seed", action="append", type=parse_address, default=None,
+                        help="Seed peer as host:port; may be repeated and replaces the configured seeds")
+    parser.add_argument("--data-dir", type=str, default=None, help="Directory for the block store")
+    parser.add_argument("--peers-file", type=str, default=None, help="File the peer table is saved to")
+    parser.add_argument("--max-peers", type=int, default=None, help="Maximum number of active peers")
+    parser.add_argument("--ready-timeout", type=float, default=None, help="Seconds allowed to become ready")
+    parser.add_argument("--min-peers", type=int, default=None, help="Active peers needed to be ready")
+    parser.add_argument("--parallel-validation", action="store_true", default=None,
+                        help="Validate blocks through the staged pipeline with batched signature checks")
     args = parser.parse_args()
 
-    network = Network(host=args.host, port=args.port)
+    config = load_config(
+        args.config, host=args.host, port=args.port, seeds=args.seed, data_dir=args.data_dir,
+        peers_file=args.peers_file, max_peers=args.max_peers, ready_timeout=args.ready_timeout,
+        min_peers=args.min_peers, parallel_validation=args.parallel_validation,
+    )
+    network = Network.from_config(config)
     try:
-        threading.Thread(target=network.start_network).start()
-        network.listen_for_network_requests()
+        network.bootstrap(config["ready_timeout"], config["min_peers"], config["sync_on_start"])
+        threading.Event().wait()
     except KeyboardInterrupt:
         logging.info("Shutting down SypherCore Network...")
+        network.stop_network()
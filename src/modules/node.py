@@ -1,109 +1,268 @@
 import socket
 import threading
-import json
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from modules.blockchain import Blockchain
-from modules.transaction import Transaction
+from modules.compact import CompactBlockRelay
+from modules.gossip import InventoryGossip
+from modules.peers import PeerManager
+from modules.transaction import BatchVerifier, Transaction, TransactionPool
+from modules.connections import ConnectionManager
+from modules.protocol import PeerServer
+from modules.sync import ChainSynchronizer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class Node:
-    def __init__(self, host='127.0.0.1', port=5000):
+    def __init__(self, host='127.0.0.1', port=5000, data_dir=None, compact_blocks=True, max_peers=8,
+                 connection_factory=ConnectionManager, pipelined_relay=False, parallel_validation=False):
+        """
+        :param pipelined_relay: <bool> Relay a block as soon as its header extends our tip with valid
+                                proof of work, and validate the body afterwards. Such blocks are
+                                marked unvalidated, so an invalid one is blamed on the peer that
+                                originated it rather than on the nodes relaying it.
+        :param parallel_validation: <bool> Accept blocks through the staged ValidationPipeline, which
+                                    also verifies signatures (on the node's BatchVerifier) and rejects
+                                    blocks that overdraw an account.
+        """
         self.host = host
         self.port = port
-        self.blockchain = Blockchain()
-        self.peers = set()  # Set of known peer nodes
+        self.compact_blocks = compact_blocks
+        self.pipelined_relay = pipelined_relay
+        self.verifier = BatchVerifier()
+        self.blockchain = Blockchain(data_dir, parallel_validation=parallel_validation, verifier=self.verifier)
+        self.transaction_pool = TransactionPool()
+        self.peers = PeerManager(max_active=max_peers, own_address=(host, port))  # Active peers plus address book
         self.running = True
+        self.server = None
+        self.listening = threading.Event()  # set once the peer server accepts connections
+        self.block_lock = threading.Lock()  # handlers run concurrently; blocks are applied one at a time
+        self.connections = connection_factory(on_peer_failed=self.forget_peer)
+        self.synchronizer = ChainSynchronizer(self.blockchain, self.connections)
+        self.compact_relay = CompactBlockRelay(self.blockchain, self.transaction_pool, self.connections, (host, port))
+        self.gossip = InventoryGossip(self.transaction_pool, self.connections, (host, port), self.accept_transactions)
+        self.handlers = {
+            "new_transaction": self.handle_new_transaction,
+            "new_block": self.handle_new_block,
+            "get_chain": self.send_chain,
+            "get_peers": self.send_peers,
+            "update_peers": self.update_peers,
+            "get_headers": self.synchronizer.handle_get_headers,
+            "get_blocks": self.synchronizer.handle_get_blocks,
+            "compact_block": self.handle_compact_block,
+            "get_block_txns": self.compact_relay.handle_get_block_txns,
+            "inv": self.gossip.handle_inv,
+            "getdata": self.gossip.handle_getdata,
+        }
 
-    def start_node(self):
+    def start_node(self, peers=None):
+        """
+        Start serving and connect to peers.
+        :param peers: <list> (host, port) tuples to connect to in parallel. Without them the peers
+                      are read interactively.
+        """
         server_thread = threading.Thread(target=self.start_server)
         server_thread.start()
-        self.connect_to_network()
+        if peers is None:
+            self.connect_to_network()
+        else:
+            self.connect_peers(peers)
 
     def start_server(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((self.host, self.port))
-        server_socket.listen(5)
-        logging.info(f"Node server started on {self.host}:{self.port}")
-
-        while self.running:
-            client_socket, client_address = server_socket.accept()
-            logging.info(f"Connection established with {client_address}")
-            threading.Thread(target=self.handle_client, args=(client_socket,)).start()
-
-    def handle_client(self, client_socket):
-        try:
-            data = client_socket.recv(4096).decode()
-            if not data:
-                return
-
-            message = json.loads(data)
-            action = message.get("action")
-
-            if action == "new_transaction":
-                self.handle_new_transaction(message)
-            elif action == "new_block":
-                self.handle_new_block(message)
-            elif action == "get_chain":
-                self.send_chain(client_socket)
-            elif action == "get_peers":
-                self.send_peers(client_socket)
-            else:
-                logging.warning(f"Unknown action received: {action}")
-
-        except Exception as e:
-            logging.error(f"Error handling client: {e}")
-
-        finally:
-            client_socket.close()
+        self.server = PeerServer(self.host, self.port, self.handlers, started=self.listening)
+        self.server.run()
 
     def handle_new_transaction(self, message):
         try:
-            transaction_data = message.get("transaction")
-            transaction = Transaction(
-                sender=transaction_data["sender"],
-                receiver=transaction_data["receiver"],
-                amount=transaction_data["amount"],
-                signature=transaction_data["signature"]
-            )
-            if self.blockchain.validate_transaction(transaction):
-                self.blockchain.add_transaction(transaction)
-                logging.info(f"New transaction added: {transaction}")
-                self.broadcast_transaction(transaction)
-            else:
-                logging.warning("Transaction validation failed")
+            if not self.accept_transaction(message.get("transaction")):
+                logging.info("Transaction rejected or already pooled")
         except Exception as e:
             logging.error(f"Failed to handle new transaction: {e}")
 
+    def accept_transaction(self, data):
+        """
+        Verify a transaction, pool it and announce it to the peers that have not seen it.
+        :param data: <dict> The transaction.
+        :return: <bool> True if the transaction was new and valid.
+        """
+        return bool(self.accept_transactions([data]))
+
+    def accept_transactions(self, batch):
+        """
+        Verify a batch of transactions, pool the valid new ones and announce them together.
+        Senders must be able to cover amount and fee from their confirmed balance. Signatures are
+        checked by the BatchVerifier, which spreads large batches over processes.
+        :param batch: <list> Transaction dicts.
+        :return: <list> The transactions that were pooled.
+        """
+        candidates = []
+        for data in batch:
+            try:
+                transaction = Transaction.from_dict(data)
+                Transaction.validate_transaction(transaction)
+            except Exception as e:
+                logging.warning(f"Rejected malformed transaction - {e}")
+                continue
+            if transaction in self.transaction_pool:
+                continue
+            if not self.blockchain.state.admit(transaction):
+                logging.warning(f"Rejected transaction exceeding its sender's balance: {transaction.calculate_hash()}")
+                continue
+            candidates.append(transaction)
+        if not candidates:
+            return []
+
+        accepted = []
+        for transaction, valid in zip(candidates, self.verifier.verify(candidates)):
+            if not valid:
+                logging.warning(f"Rejected transaction with a bad signature: {transaction.calculate_hash()}")
+            elif self.transaction_pool.add_transaction(transaction):
+                logging.info(f"New transaction added: {transaction.calculate_hash()}")
+                accepted.append(transaction)
+        if accepted:
+            self.gossip.announce([transaction.calculate_hash() for transaction in accepted], self.peers)
+        return accepted
+
     def handle_new_block(self, message):
         try:
-            block_data = message.get("block")
-            block = self.blockchain.create_block_from_data(block_data)
-            if self.blockchain.add_block(block):
-                logging.info(f"New block added to the chain: {block.index}")
-                self.broadcast_block(block)
-            else:
-                logging.warning("Block validation failed")
+            block = message.get("block")
+            block_hash = self.blockchain.hash(block)
+            sender = self.sender_of(message)
+            origin = self.origin_of(message, sender)
+            relayed = self.pipelined_relay \
+                and self.relay_ahead(block, block_hash, self.block_message(block), sender, origin)
+            try:
+                self.accept_block(block, block_hash, origin, relayed)
+            finally:
+                self.compact_relay.settle(block_hash)
         except Exception as e:
             logging.error(f"Failed to handle new block: {e}")
 
-    def send_chain(self, client_socket):
-        try:
-            chain_data = json.dumps(self.blockchain.to_dict())
-            client_socket.sendall(chain_data.encode())
-            logging.info("Blockchain sent to requesting node")
-        except Exception as e:
-            logging.error(f"Failed to send blockchain: {e}")
+    def accept_block(self, block, block_hash, sender=None, relayed=False):
+        """
+        Validate a block, append it and relay it to peers that do not have it yet.
+        :param sender: <tuple> Peer answerable for the block (see origin_of), dropped if it is invalid.
+        :param relayed: <bool> The block was already relayed ahead of validation.
+        :return: <bool> True if the block was added.
+        """
+        with self.block_lock:
+            if self.blockchain.get_block_by_hash(block_hash) is not None:
+                return False  # already received from another peer
+            if not self.blockchain.add_block(block):
+                reason = self.blockchain.rejection
+                if reason == 'stale':
+                    # Not on our tip, e.g. a fork we lost the race for; only its own header can be checked.
+                    parent = self.blockchain.get_block_by_hash(block.get('previous_hash'))
+                    if parent is None or self.blockchain.validate_block(block, parent):
+                        logging.info(f"Block {block.get('index')} does not extend our tip")
+                        return False
+                    reason = 'invalid'
+                logging.warning(f"Block {block.get('index')} failed validation: {reason}")
+                self.penalize_invalid_block(block, sender)
+                return False
+            logging.info(f"New block added to the chain: {block['index']}")
+            # Build the relay message while the block's transactions are still pooled,
+            # so the compact form can refer to them by short id.
+            relay_message = None if relayed else self.block_message(block)
+            self.transaction_pool.remove_transactions(block['transactions'])
+            # Late announcements of these transactions must not put them back in the pool.
+            self.gossip.mark_seen(map(TransactionPool.transaction_id, block['transactions']))
+            # The new balances may make previously rejected transactions valid.
+            self.gossip.clear_rejected()
+        if relay_message is not None:
+            self.gossip.relay(block_hash, relay_message, self.peers)
+        return True
+
+    def relay_ahead(self, header, block_hash, message, sender=None, origin=None):
+        """
+        In pipelined mode, relay a block before its body is validated if the header extends our tip
+        with valid proof of work. The header check is cheap, so each hop adds only that delay.
+        The message is marked unvalidated and names `origin`, so peers do not blame us if it is invalid.
+        :return: <bool> True if the block was relayed.
+        """
+        if not self.pipelined_relay or self.blockchain.get_block_by_hash(block_hash) is not None:
+            return False
+        tip = self.blockchain.last_block
+        if header.get('previous_hash') != self.blockchain.hash(tip) \
+                or not self.blockchain.valid_proof(tip['proof'], header.get('proof')):
+            return False
+        self.compact_relay.expect(block_hash)
+        if sender is not None:
+            self.gossip.known_by(sender).add(block_hash)
+        self.gossip.relay(block_hash, dict(
+            message, peer_host=self.host, peer_port=self.port, unvalidated=True, origin=origin and list(origin)
+        ), self.peers)
+        return True
+
+    def penalize_invalid_block(self, block, peer):
+        """
+        Drop the peer answerable for an invalid block. Only active peers are dropped: the address is
+        self-reported, so an unknown address is not demoted.
+        """
+        if peer is None:
+            return
+        if peer not in self.peers:
+            logging.warning(f"Invalid block {block.get('index')} from {peer}, which is not an active peer")
+            return
+        logging.warning(f"Dropping peer {peer} for invalid block {block.get('index')}")
+        self.forget_peer(peer)
+
+    @staticmethod
+    def sender_of(message):
+        """
+        Address of the peer a message came from. The peer server sets the host from the connection,
+        so only the listening port is taken from the sender.
+        """
+        if message.get("peer_host") is None or message.get("peer_port") is None:
+            return None
+        return message["peer_host"], message["peer_port"]
+
+    @staticmethod
+    def origin_of(message, sender):
+        """
+        Peer answerable for the validity of a block message: the sender, unless it marked the block
+        as relayed ahead of validation, in which case the originator it names, if any.
+        """
+        if not message.get("unvalidated"):
+            return sender
+        origin = message.get("origin")
+        if not isinstance(origin, (list, tuple)) or len(origin) != 2:
+            return None
+        return origin[0], origin[1]
 
-    def send_peers(self, client_socket):
+    def handle_compact_block(self, message):
         try:
-            peers_data = json.dumps(list(self.peers))
-            client_socket.sendall(peers_data.encode())
-            logging.info("List of peers sent to requesting node")
+            block_hash = self.blockchain.hash(message["header"])
+            sender = self.sender_of(message)
+            origin = self.origin_of(message, sender)
+            self.gossip.known_by(sender).add(block_hash)
+            # Forwarding the compact block as received saves rebuilding it; peers fetch missing
+            # transactions from us once we have them.
+            relayed = self.relay_ahead(message["header"], block_hash, message, sender, origin)
+            try:
+                block = self.compact_relay.reconstruct(message)
+                if block is not None:
+                    self.accept_block(block, block_hash, origin, relayed)
+            finally:
+                self.compact_relay.settle(block_hash)
         except Exception as e:
-            logging.error(f"Failed to send peers: {e}")
+            logging.error(f"Failed to handle compact block: {e}")
+
+    def send_chain(self, message):
+        logging.info("Blockchain sent to requesting node")
+        return self.blockchain.chain_payload()
+
+    def sync_with_peers(self):
+        """ Catch up with our peers, downloading only the blocks we are missing. """
+        return self.synchronizer.sync(self.peers)
+
+    def send_peers(self, message):
+        logging.info("Sample of peers sent to requesting node")
+        return self.peers.sample()
+
+    def update_peers(self, message):
+        """ Remember the addresses a peer shared with us; they are only connected to when a slot frees up. """
+        self.peers.learn(message.get("peers") or [])
 
     def connect_to_network(self):
         while True:
@@ -119,57 +278,90 @@ class Node:
             except Exception as e:
                 logging.error(f"Failed to connect to peer: {e}")
 
-    def connect_peer(self, peer_host, peer_port):
+    def connect_peers(self, peers, timeout=5):
+        """
+        Connect to several peers at once, so startup takes one connect timeout instead of one per peer.
+        :return: <int> Number of peers reached.
+        """
+        peers = list(peers)
+        if not peers:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(len(peers), 32)) as executor:
+            results = executor.map(lambda peer: self.connect_peer(peer[0], peer[1], timeout), peers)
+            return sum(1 for reached in results if reached)
+
+    def connect_peer(self, peer_host, peer_port, timeout=None):
         try:
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect((peer_host, peer_port))
+            peer_socket = socket.create_connection((peer_host, peer_port), timeout=timeout)
             self.peers.add((peer_host, peer_port))
             logging.info(f"Connected to peer: {peer_host}:{peer_port}")
             peer_socket.close()
+            return True
         except Exception as e:
             logging.error(f"Failed to connect to peer {peer_host}:{peer_port} - {e}")
+            return False
 
     def broadcast_transaction(self, transaction):
-        message = json.dumps({
-            "action": "new_transaction",
-            "transaction": transaction.to_dict()
-        })
-        self.broadcast(message)
+        """ Announce a transaction by hash; peers fetch the body if they have not seen it. """
+        self.gossip.announce([transaction.calculate_hash()], self.peers)
 
-    def broadcast_block(self, block):
-        message = json.dumps({
+    def block_message(self, block):
+        if self.compact_blocks:
+            return self.compact_relay.make_compact_block(block)
+        return {
             "action": "new_block",
-            "block": block.to_dict()
-        })
-        self.broadcast(message)
+            "block": block,
+            "peer_host": self.host,
+            "peer_port": self.port,
+        }
+
+    def broadcast_block(self, block):
+        self.gossip.relay(self.blockchain.hash(block), self.block_message(block), self.peers)
 
     def broadcast(self, message):
-        for peer in list(self.peers):
-            try:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                peer_socket.connect(peer)
-                peer_socket.sendall(message.encode())
-                peer_socket.close()
-                logging.info(f"Message broadcasted to {peer}")
-            except Exception as e:
-                logging.error(f"Failed to send message to {peer} - {e}")
-                self.peers.discard(peer)
+        """ Queue a message on the pooled connection of every peer. """
+        self.connections.broadcast(self.peers, message)
+        logging.info(f"Message broadcasted to {len(self.peers)} peers")
+
+    def forget_peer(self, peer):
+        """ Demote a peer we could not reach and fill its slot from the address book. """
+        self.peers.record_failure(peer)
+        self.peers.discard(peer)
+        self.gossip.forget_peer(peer)
+        self.refill_peers(exclude=tuple(peer))
+
+    def refill_peers(self, exclude=None):
+        for candidate in self.peers.candidates():
+            if candidate == exclude:
+                continue
+            if not self.peers.add(candidate):
+                break
 
     def stop_node(self):
         logging.info("Stopping SypherCore Node...")
         self.running = False
+        if self.server:
+            self.server.stop()
+        self.connections.close()
+        self.gossip.close()
+        self.verifier.close()
         for peer in list(self.peers):
             self.peers.discard(peer)
 
 
 if __name__ == "__main__":
+    import argparse
+    from modules.config import parse_address
+
     parser = argparse.ArgumentParser(description="SypherCore Node")
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Host address of the node")
     parser.add_argument("--port", type=int, default=5000, help="Port to run the node on")
+    parser.add_argument("--peer", action="append", type=parse_address, default=None,
+                        help="Peer to connect to as host:port; may be repeated. Without it peers are prompted for")
     args = parser.parse_args()
 
     node = Node(host=args.host, port=args.port)
     try:
-        node.start_node()
+        node.start_node(args.peer)
     except KeyboardInterrupt:
         node.stop_node()
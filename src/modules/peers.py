@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_LATENCY = 0.5   # seconds assumed for a peer we have not measured yet
+FAILURE_PENALTY = 5.0   # seconds of latency one failed contact is worth when ranking peers
+
+
+class PeerInfo:
+    """ What we know about one address: smoothed latency and contact history. """
+    __slots__ = ('address', 'latency', 'successes', 'failures', 'last_seen')
+
+    def __init__(self, address):
+        self.address = address
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+        self.last_seen = None
+
+    def failure_rate(self):
+        # Laplace smoothing keeps a single early failure from ruining a peer's score.
+        return (self.failures + 1) / (self.successes + self.failures + 2)
+
+    def cost(self):
+        """ Ranking cost in seconds; lower is better. """
+        latency = DEFAULT_LATENCY if self.latency is None else self.latency
+        return latency + self.failure_rate() * FAILURE_PENALTY
+
+
+class PeerManager:
+    """
+    Bounded set of active peers backed by a larger address book.
+    Iterating, `len`, `in`, `add` and `discard` act on the active set, so it can stand in for the
+    plain peer sets used elsewhere. Addresses learnt from other peers go to the address book and
+    are promoted by score when an active slot frees up. Peer lists shared with others are random
+    samples, so peer gossip stays constant-size as the network grows. The address book and its
+    scores can be saved to disk, so a restarted node reconnects to known-good peers first.
+    """
+
+    def __init__(self, max_active=8, max_addresses=1000, sample_size=16, latency_alpha=0.2, own_address=None):
+        self.max_active = max_active
+        self.max_addresses = max_addresses
+        self.sample_size = sample_size
+        self.latency_alpha = latency_alpha
+        self.own_address = own_address
+        self.book = {}       # (host, port) -> PeerInfo
+        self.active = set()
+        self.lock = threading.RLock()
+
+    # -------------------------
+    # Set-like view of the active peers
+    # -------------------------
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.active))
+
+    def __len__(self):
+        return len(self.active)
+
+    def __contains__(self, peer):
+        return tuple(peer) in self.active
+
+    def add(self, peer):
+        """
+        Make a peer active if there is room; otherwise it is only remembered in the address book.
+        :return: <bool> True if the peer is active.
+        """
+        peer = tuple(peer)
+        with self.lock:
+            if not self.learn_one(peer):
+                return False
+            if peer not in self.active and len(self.active) >= self.max_active:
+                return False
+            self.active.add(peer)
+            return True
+
+    def discard(self, peer):
+        """ Stop using a peer; it stays in the address book. """
+        with self.lock:
+            self.active.discard(tuple(peer))
+
+    # -------------------------
+    # Address book
+    # -------------------------
+    def learn(self, addresses):
+        """ Remember addresses heard from other peers without connecting to them. """
+        with self.lock:
+            for address in addresses:
+                try:
+                    host, port = address
+                    self.learn_one((str(host), int(port)))
+                except (TypeError, ValueError):
+                    continue
+
+    def learn_one(self, peer):
+        if peer == self.own_address:
+            return False
+        if peer not in self.book:
+            if len(self.book) >= self.max_addresses and not self.evict():
+                return False
+            self.book[peer] = PeerInfo(peer)
+        return True
+
+    def evict(self):
+        """ Forget the worst inactive address to make room. """
+        inactive = [info for address, info in self.book.items() if address not in self.active]
+        if not inactive:
+            return False
+        del self.book[max(inactive, key=PeerInfo.cost).address]
+        return True
+
+    def forget(self, peer):
+        with self.lock:
+            peer = tuple(peer)
+            self.active.discard(peer)
+            self.book.pop(peer, None)
+
+    # -------------------------
+    # Scoring
+    # -------------------------
+    def record_success(self, peer, latency=None):
+        """ Note a successful contact, folding `latency` (seconds) into the peer's moving average. """
+        with self.lock:
+            info = self.book.get(tuple(peer))
+            if info is None:
+                return
+            info.successes += 1
+            info.last_seen = time.time()
+            if latency is not None:
+                if info.latency is None:
+                    info.latency = latency
+                else:
+                    info.latency += self.latency_alpha * (latency - info.latency)
+
+    def record_failure(self, peer):
+        with self.lock:
+            info = self.book.get(tuple(peer))
+            if info is not None:
+                info.failures += 1
+
+    def info(self, peer):
+        return self.book.get(tuple(peer))
+
+    def candidates(self):
+        """ Inactive addresses, best first. """
+        with self.lock:
+            inactive = [info for address, info in self.book.items() if address not in self.active]
+        return [info.address for info in sorted(inactive, key=PeerInfo.cost)]
+
+    def worst_active(self):
+        with self.lock:
+            if not self.active:
+                return None
+            return max(self.active, key=lambda peer: self.book[peer].cost())
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def save(self, path):
+        """ Write the address book to `path`, replacing the previous file atomically. """
+        with self.lock:
+            records = [
+                [info.address[0], info.address[1], info.latency, info.successes, info.failures, info.last_seen]
+                for info in self.book.values()
+            ]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as peer_file:
+            json.dump({'peers': records}, peer_file)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """
+        Restore addresses and scores saved by `save`. Restored peers are not made active.
+        :return: <int> Number of addresses restored.
+        """
+        try:
+            with open(path) as peer_file:
+                records = json.load(peer_file).get('peers', [])
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable peer table {path} - {e}")
+            return 0
+
+        restored = 0
+        with self.lock:
+            for record in records:
+                try:
+                    host, port, latency, successes, failures, last_seen = record
+                    peer = (str(host), int(port))
+                except (TypeError, ValueError):
+                    continue
+                if not self.learn_one(peer):
+                    continue
+                info = self.book[peer]
+                info.latency, info.successes, info.failures, info.last_seen = latency, successes, failures, last_seen
+                restored += 1
+        logging.info(f"Restored {restored} peer addresses from {path}.")
+        return restored
+
+    def sample(self, count=None):
+        """
+        A random sample of addresses worth sharing with another peer: active peers and the better
+        half of the address book.
+        """
+        count = self.sample_size if count is None else count
+        with self.lock:
+            pool = list(self.active)
+            ranked = sorted(
+                (info for address, info in self.book.items() if address not in self.active), key=PeerInfo.cost
+            )
+            pool.extend(info.address for info in ranked[:max(len(ranked) // 2, count)])
+        return random.sample(pool, min(count, len(pool)))
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import wire
+from modules.ingress import IngressQueue
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Every message on the wire is a 4-byte big-endian length followed by the payload.
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Messages a peer sends in chain order; each connection handles these one at a time, in the order
+# they arrived, so a block is never applied before the block it builds on.
+ORDERED_ACTIONS = frozenset(("new_block", "compact_block"))
+
+# 'binary' uses the compact wire encoding; 'json' sends readable JSON for debugging.
+# Receivers accept either format regardless of this setting.
+WIRE_FORMAT = os.environ.get('SYPHER_WIRE_FORMAT', 'binary')
+
+
+def encode_frame(payload):
+    """ Prefix a payload with its length. """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit.")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message):
+    """ Encode a message for the wire; bytes and str payloads are sent unchanged. """
+    if isinstance(message, bytes):
+        return message
+    if isinstance(message, str):
+        return message.encode()
+    if WIRE_FORMAT == 'json':
+        return json.dumps(message, default=wire.json_default).encode()
+    return wire.dumps(message)
+
+
+def decode_message(payload):
+    """ Decode a payload in either the binary wire format or JSON. """
+    if wire.is_binary(payload):
+        return wire.loads(payload)
+    return json.loads(payload)
+
+
+async def read_frame(reader):
+    """ Read one frame from an asyncio stream; returns None on a clean end of stream. """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Peer announced a {length} byte frame, above the {MAX_FRAME_SIZE} byte limit.")
+    return await reader.readexactly(length)
+
+
+def send_frame(sock, payload):
+    """ Send one frame over a blocking socket. """
+    sock.sendall(encode_frame(payload))
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """ Receive one frame from a blocking socket. """
+    (length,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Peer announced a {length} byte frame, above the {MAX_FRAME_SIZE} byte limit.")
+    return recv_exactly(sock, length)
+
+
+def request(peer, message, timeout=10):
+    """
+    Send one message to a peer and wait for its reply on a short-lived connection.
+    :param peer: (host, port) tuple.
+    :param message: Message dict or pre-encoded payload.
+    :return: The decoded reply.
+    """
+    with socket.create_connection(peer, timeout=timeout) as peer_socket:
+        send_frame(peer_socket, encode_message(message))
+        return decode_message(recv_frame(peer_socket))
+
+
+class PeerServer:
+    """
+    Asyncio server for peer connections.
+    Each connection carries any number of length-prefixed messages. Messages are routed by their
+    "action" field to blocking handlers, which run on a bounded thread pool; a handler's return
+    value (if not None) is sent back as the reply. The number of open connections is capped.
+    A message's self-reported "peer_host" is replaced by the connection's remote host before it
+    reaches a handler, so a peer cannot pass its messages off as another host's.
+    Messages pass through an IngressQueue, which rate-limits each peer and serves blocks ahead of
+    transactions; a connection with `max_inflight` messages outstanding is not read from until one
+    completes, so a fast sender is slowed down by TCP instead of filling memory. Block messages
+    (ORDERED_ACTIONS) from one connection are handled in the order they arrived; other messages
+    may complete out of order.
+    """
+
+    def __init__(self, host, port, handlers, max_connections=4096, max_workers=32, max_inflight=64,
+                 ingress=None, started=None):
+        self.host = host
+        self.port = port
+        self.handlers = handlers
+        self.max_connections = max_connections
+        self.max_workers = max_workers
+        self.max_inflight = max_inflight
+        self.connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.ingress = ingress or IngressQueue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='peer-handler')
+        self.loop = None
+        self.server = None
+        self.started = started or threading.Event()  # set once the server is accepting connections
+
+    def run(self):
+        """ Serve until stop() is called. Blocks the calling thread. """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.ingress.start()
+        workers = [asyncio.ensure_future(self.work()) for _ in range(self.max_workers)]
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, reuse_address=True)
+        logging.info(f"Node server started on {self.host}:{self.port}")
+        self.started.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        for worker in workers:
+            worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def work(self):
+        """ Take messages off the ingress queue and run their handlers on the thread pool. """
+        while True:
+            handler, message, future = await self.ingress.get()
+            if future.done():
+                continue
+            try:
+                result = await self.loop.run_in_executor(self.executor, handler, message)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+    def stop(self):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        if self.connections >= self.max_connections:
+            logging.warning(f"Connection limit reached, refusing {peer}")
+            writer.close()
+            return
+
+        self.connections += 1
+        inflight = asyncio.Semaphore(self.max_inflight)
+        ordered = asyncio.Lock()  # FIFO, and tasks reach it in the order their frames arrived
+        pending = set()
+        try:
+            while True:
+                payload = await read_frame(reader)
+                if payload is None:
+                    break
+                self.bytes_in += FRAME_HEADER.size + len(payload)
+                await inflight.acquire()
+                task = asyncio.ensure_future(self.process(payload, peer, writer, ordered))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                task.add_done_callback(lambda _: inflight.release())
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"Error handling client {peer}: {e}")
+        finally:
+            for task in pending:
+                task.cancel()
+            self.connections -= 1
+            writer.close()
+
+    async def process(self, payload, peer, writer, ordered=None):
+        """ Handle one message and write its reply, if any. """
+        try:
+            reply = await self.dispatch(payload, peer, ordered)
+            if reply is not None:
+                frame = encode_frame(reply)
+                self.bytes_out += len(frame)
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"Error handling message from {peer}: {e}")
+
+    async def admit(self, peer, handler, message):
+        """ Queue a message on the ingress queue and wait for its handler's result or rejection. """
+        admitted = self.ingress.admit(peer, handler, message)
+        if isinstance(admitted, dict):
+            logging.debug(f"Rejected {message.get('action')} from {peer}: {admitted['reason']}")
+            return admitted
+        return await admitted
+
+    async def dispatch(self, payload, peer, ordered=None):
+        """
+        Decode a message and queue it for its handler.
+        :param ordered: <asyncio.Lock> The connection's lock for ORDERED_ACTIONS, held from admission
+                        until the handler returns.
+        :return: <bytes> Encoded reply, or None if there is nothing to send back.
+        """
+        message = decode_message(payload)
+        if peer and message.get("peer_host") is not None:
+            # Only the listening port is taken on trust; the host is the one the frame arrived from.
+            message["peer_host"] = peer[0]
+        action = message.get("action")
+        handler = self.handlers.get(action)
+        reply = None
+        if handler is None:
+            logging.warning(f"Unknown action received: {action}")
+        elif ordered is not None and action in ORDERED_ACTIONS:
+            async with ordered:
+                reply = await self.admit(peer, handler, message)
+        else:
+            reply = await self.admit(peer, handler, message)
+
+        if "id" in message:
+            # Requests on pooled connections are matched to their reply by id, so always answer.
+            if isinstance(reply, bytes):
+                reply = wire.Encoded(reply)
+            return encode_message({"id": message["id"], "reply": reply})
+        return None if reply is None else encode_message(reply)
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import functools
+import logging
+import random
+import statistics
+import threading
+import time
+
+from modules.connections import ConnectionManager
+from modules.node import Node
+from modules.storage import IndexedChain
+from modules.transaction import Transaction
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class LossyConnectionManager(ConnectionManager):
+    """
+    ConnectionManager that adds one-way latency and drops messages, to emulate a real network
+    over loopback. Loss is modelled per message: a dropped broadcast never arrives and a dropped
+    request times out.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def deliver(self, peer, frame):
+        if random.random() < self.loss:
+            return
+        self.loop.call_later(self.delay(), super().deliver, peer, frame)
+
+    async def request_async(self, peer, message, timeout=10):
+        if random.random() < self.loss:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(self.delay())
+        reply = await super().request_async(peer, message, timeout)
+        await asyncio.sleep(self.delay())
+        return reply
+
+
+def percentiles(samples):
+    """ p50/p90/p99/max of a list of seconds, in milliseconds. """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+    return {'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+class NetworkSimulator:
+    """
+    Runs N nodes in this process on localhost ports, wired into a random topology (or a line, to
+    measure propagation over a known number of hops), and measures how transactions and blocks
+    spread between them.
+    """
+
+    def __init__(self, nodes=10, degree=4, base_port=7000, latency=0.02, jitter=0.005, loss=0.0, seed=None,
+                 topology='random', pipelined=False, parallel_validation=False):
+        if topology not in ('random', 'line'):
+            raise ValueError("Topology must be 'random' or 'line'.")
+        self.random = random.Random(seed)
+        factory = functools.partial(LossyConnectionManager, latency=latency, jitter=jitter, loss=loss)
+        self.nodes = [Node('127.0.0.1', base_port + number, connection_factory=factory, pipelined_relay=pipelined,
+                           parallel_validation=parallel_validation)
+                      for number in range(nodes)]
+        self.degree = degree
+        self.topology = topology
+        self.lock = threading.Lock()
+        self.arrivals = {}   # item hash -> {node port: monotonic arrival time}
+        self.injected = {}   # item hash -> (kind, monotonic injection time)
+        self.accounts = [Transaction.create_key_pair() for _ in range(4)]  # (private, public) PEM pairs
+        self.share_genesis()
+        self.fund_accounts()
+        for node in self.nodes:
+            self.instrument(node)
+
+    def share_genesis(self):
+        """ Every node creates its own genesis block; give them all the first node's. """
+        genesis = self.nodes[0].blockchain.chain[0]
+        for node in self.nodes[1:]:
+            node.blockchain.chain = IndexedChain(node.blockchain.hash, [genesis])
+            node.blockchain.update_checkpoint(0)
+            node.blockchain.state.reset()
+            node.blockchain.addresses.reset()
+            node.blockchain.sync_indexes()
+
+    def fund_accounts(self, amount=10 ** 9):
+        """ Mint `amount` to every simulated account in a block that all nodes start with. """
+        chain = self.nodes[0].blockchain
+        chain.current_transactions = [
+            {'sender': '0', 'recipient': public_key, 'amount': amount} for _, public_key in self.accounts
+        ]
+        block = chain.create_block(chain.proof_of_work(chain.last_block['proof']))
+        for node in self.nodes:
+            if not node.blockchain.add_block(block):
+                raise RuntimeError(f"Node {node.port} rejected the funding block.")
+
+    def instrument(self, node):
+        """ Record when each transaction and block first reaches `node`. """
+        pool, chain = node.transaction_pool, node.blockchain
+        add_transaction, add_block = pool.add_transaction, chain.add_block
+
+        def record(item_hash):
+            with self.lock:
+                self.arrivals.setdefault(item_hash, {}).setdefault(node.port, time.monotonic())
+
+        def recording_add_transaction(transaction):
+            added = add_transaction(transaction)
+            if added:
+                record(transaction.calculate_hash())
+            return added
+
+        def recording_add_block(block):
+            added = add_block(block)
+            if added:
+                record(chain.hash(block))
+            return added
+
+        pool.add_transaction = recording_add_transaction
+        chain.add_block = recording_add_block
+
+    def start(self):
+        for node in self.nodes:
+            threading.Thread(target=node.start_server, daemon=True).start()
+        time.sleep(0.5)
+        addresses = [(node.host, node.port) for node in self.nodes]
+        if self.topology == 'line':
+            for node, successor in zip(self.nodes, self.nodes[1:]):
+                node.peers.add((successor.host, successor.port))
+                successor.peers.add((node.host, node.port))
+            return
+        for number, node in enumerate(self.nodes):
+            others = addresses[:number] + addresses[number + 1:]
+            for peer in self.random.sample(others, min(self.degree, len(others))):
+                node.peers.add(peer)
+                self.nodes[addresses.index(peer)].peers.add((node.host, node.port))
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop_node()
+
+    def inject_transactions(self, count, rate):
+        """ Submit `count` transactions at `rate` per second, each to a random node. """
+        for number in range(count):
+            private_key, public_key = self.random.choice(self.accounts)
+            transaction = Transaction(public_key, f"receiver-{number}", number + 1, fee=self.random.randint(0, 10))
+            transaction.sign_transaction(private_key)
+            self.injected[transaction.calculate_hash()] = ('transaction', time.monotonic())
+            self.random.choice(self.nodes).accept_transaction(transaction.to_dict())
+            if rate:
+                time.sleep(1 / rate)
+
+    def mine_block(self):
+        """ Mine the pooled transactions on a random node (the first one of a line) and relay the block. """
+        node = self.nodes[0] if self.topology == 'line' else self.random.choice(self.nodes)
+        chain = node.blockchain
+        chain.current_transactions = node.transaction_pool.get_transactions()
+        block = chain.create_block(chain.proof_of_work(chain.last_block['proof']))
+        self.injected[chain.hash(block)] = ('block', time.monotonic())
+        node.handle_new_block({"block": block})
+
+    def consistent(self):
+        tips = {node.blockchain.hash(node.blockchain.last_block) for node in self.nodes}
+        pools = {frozenset(node.transaction_pool.transactions) for node in self.nodes}
+        return len(tips) == 1 and len(pools) == 1
+
+    def wait_for_consistency(self, timeout):
+        """ :return: <float> Seconds until every node has the same tip and pool, or None on timeout. """
+        started = time.monotonic()
+        while time.monotonic() - started < timeout:
+            if self.consistent():
+                return time.monotonic() - started
+            time.sleep(0.01)
+        return None
+
+    def report(self, consistency):
+        delays = {'transaction': [], 'block': []}
+        reached = {'transaction': [], 'block': []}
+        with self.lock:
+            for item_hash, (kind, injected_at) in self.injected.items():
+                arrivals = self.arrivals.get(item_hash, {})
+                delays[kind].extend(arrived - injected_at for arrived in arrivals.values())
+                reached[kind].append(len(arrivals) / len(self.nodes))
+        sent = [node.connections.bytes_sent + (node.server.bytes_out if node.server else 0) for node in self.nodes]
+        received = [node.connections.bytes_received + (node.server.bytes_in if node.server else 0)
+                    for node in self.nodes]
+        return {
+            'nodes': len(self.nodes),
+            'transaction_propagation_ms': percentiles(delays['transaction']),
+            'block_propagation_ms': percentiles(delays['block']),
+            'transaction_coverage': statistics.mean(reached['transaction']) if reached['transaction'] else None,
+            'block_coverage': statistics.mean(reached['block']) if reached['block'] else None,
+            'bytes_sent_per_node': {'mean': int(statistics.mean(sent)), 'max': max(sent)},
+            'bytes_received_per_node': {'mean': int(statistics.mean(received)), 'max': max(received)},
+            'time_to_consistency_s': None if consistency is None else round(consistency, 3),
+        }
+
+    def run(self, transactions=200, tx_rate=100, blocks=2, timeout=30):
+        self.start()
+        try:
+            for _ in range(blocks or 1):
+                self.inject_transactions(transactions // max(blocks, 1), tx_rate)
+                if blocks:
+                    self.mine_block()
+            consistency = self.wait_for_consistency(timeout)
+            return self.report(consistency)
+        finally:
+            self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a SypherCore network on localhost")
+    parser.add_argument("--nodes", type=int, default=10, help="Number of nodes")
+    parser.add_argument("--degree", type=int, default=4, help="Peers each node connects to")
+    parser.add_argument("--base-port", type=int, default=7000, help="Port of the first node")
+    parser.add_argument("--latency", type=float, default=0.02, help="One-way latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005, help="Latency jitter in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of messages dropped")
+    parser.add_argument("--transactions", type=int, default=200, help="Transactions to inject")
+    parser.add_argument("--tx-rate", type=float, default=100, help="Transactions injected per second")
+    parser.add_argument("--blocks", type=int, default=2, help="Blocks to mine")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for consistency")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for topology and load")
+    parser.add_argument("--topology", choices=('random', 'line'), default='random', help="How nodes are wired")
+    parser.add_argument("--pipelined", action="store_true", help="Relay block headers before full validation")
+    parser.add_argument("--parallel-validation", action="store_true", help="Validate blocks through the pipeline")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    simulator = NetworkSimulator(args.nodes, args.degree, args.base_port, args.latency, args.jitter, args.loss,
+                                 args.seed, args.topology, args.pipelined, args.parallel_validation)
+    results = simulator.run(args.transactions, args.tx_rate, args.blocks, args.timeout)
+    for key, value in results.items():
+        print(f"{key}: {value}")
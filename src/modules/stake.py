@@ -0,0 +1,172 @@
+import hashlib
+from decimal import Decimal
+
+# Stakes are kept as integer units, so cumulative sums are exact and identical on every node.
+STAKE_UNITS = 10 ** 8  # units per coin
+SEED_BITS = 64
+
+
+def to_units(amount):
+    """ Convert a stake in coins (int, float or decimal string) to integer stake units. """
+    return int((Decimal(str(amount)) * STAKE_UNITS).to_integral_value())
+
+
+def seed_bits(seed):
+    """
+    Map a seed to a SEED_BITS-bit integer that every node computes identically.
+    :param seed: <str|bytes|int> e.g. a block hash combined with a slot number.
+    """
+    if isinstance(seed, int):
+        seed = str(seed)
+    if isinstance(seed, str):
+        seed = seed.encode()
+    return int.from_bytes(hashlib.sha256(seed).digest()[:SEED_BITS // 8], 'big')
+
+
+def check_units(stake):
+    if not isinstance(stake, int) or isinstance(stake, bool):
+        raise TypeError(f"Stakes are integer units, not {type(stake).__name__}; convert them with to_units.")
+    return stake
+
+
+class StakeIndex:
+    """
+    Fenwick tree over integer stake units, for weighted selection in O(log n).
+    Each staker owns a slot; updating a stake and finding the staker at a point of the cumulative
+    stake both walk O(log n) tree nodes, and the total is kept alongside. Slots freed by removed
+    stakers are reused, and the tree doubles in size when it runs out of slots.
+    Selections are reproducible on any node that applied the same stake updates in the same order;
+    build the index with `from_stakes` over sorted keys to make it independent of that history.
+    """
+
+    def __init__(self, capacity=16):
+        self.tree = [0] * (capacity + 1)   # 1-based Fenwick array
+        self.slots = []                    # slot -> staker, or None once freed
+        self.stakes = []                   # slot -> stake
+        self.positions = {}                # staker -> slot
+        self.free = []
+        self.total = 0
+
+    @classmethod
+    def from_stakes(cls, stakes):
+        """
+        Build an index in O(n) from a {staker: stake units} mapping, in sorted staker order.
+        """
+        stakers = sorted(staker for staker, stake in stakes.items() if check_units(stake) > 0)
+        index = cls(max(len(stakers), 1))
+        for position, staker in enumerate(stakers):
+            index.slots.append(staker)
+            index.stakes.append(stakes[staker])
+            index.positions[staker] = position
+            index.tree[position + 1] = stakes[staker]
+            index.total += stakes[staker]
+        size = len(index.tree) - 1
+        for node in range(1, size + 1):
+            parent = node + (node & -node)
+            if parent <= size:
+                index.tree[parent] += index.tree[node]
+        return index
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, staker):
+        return staker in self.positions
+
+    def stake_of(self, staker):
+        position = self.positions.get(staker)
+        return 0 if position is None else self.stakes[position]
+
+    def update(self, staker, delta):
+        """
+        Change a staker's stake by `delta` units; a staker left with no stake is removed.
+        :return: <int> The staker's new stake.
+        """
+        check_units(delta)
+        position = self.positions.get(staker)
+        if position is None:
+            if delta <= 0:
+                return 0
+            position = self.allocate(staker)
+        new_stake = self.stakes[position] + delta
+        if new_stake <= 0:
+            delta = -self.stakes[position]
+            new_stake = 0
+        self.stakes[position] = new_stake
+        self.total += delta
+        self.add(position, delta)
+        if new_stake == 0:
+            self.release(staker, position)
+        return new_stake
+
+    def set(self, staker, stake):
+        return self.update(staker, stake - self.stake_of(staker))
+
+    def allocate(self, staker):
+        if self.free:
+            position = self.free.pop()
+            self.slots[position] = staker
+        else:
+            position = len(self.slots)
+            if position >= len(self.tree) - 1:
+                self.grow()
+            self.slots.append(staker)
+            self.stakes.append(0)
+        self.positions[staker] = position
+        return position
+
+    def release(self, staker, position):
+        del self.positions[staker]
+        self.slots[position] = None
+        self.free.append(position)
+
+    def grow(self):
+        """ Double the capacity, rebuilding the tree from the per-slot stakes in O(n). """
+        size = 2 * (len(self.tree) - 1)
+        self.tree = [0] * (size + 1)
+        for position, stake in enumerate(self.stakes):
+            self.tree[position + 1] = stake
+        for node in range(1, size + 1):
+            parent = node + (node & -node)
+            if parent <= size:
+                self.tree[parent] += self.tree[node]
+
+    def add(self, position, delta):
+        node = position + 1
+        size = len(self.tree) - 1
+        while node <= size:
+            self.tree[node] += delta
+            node += node & -node
+
+    def find(self, point):
+        """
+        Return the staker whose stake interval contains `point`, an integer in [0, total).
+        """
+        if not self.positions:
+            raise ValueError("The stake index is empty.")
+        if not 0 <= point < self.total:
+            raise ValueError(f"Point {point} is outside the total stake {self.total}.")
+        size = len(self.tree) - 1
+        node = 0
+        step = 1 << (size.bit_length() - 1)
+        while step:
+            following = node + step
+            if following <= size and self.tree[following] <= point:
+                node = following
+                point -= self.tree[node]
+            step >>= 1
+        # `node` slots hold at most `point` units in total, so the next slot is the one containing it.
+        # With exact integer sums that slot exists and, holding stake, has not been freed.
+        if node >= len(self.slots) or self.slots[node] is None:
+            raise RuntimeError(f"Stake index is inconsistent: point {point} landed on slot {node}.")
+        return self.slots[node]
+
+    def select(self, fraction):
+        """
+        Weighted selection: return the staker at `fraction` (in [0, 1)) of the total stake.
+        """
+        return self.find(min(int(fraction * self.total), self.total - 1))
+
+    def select_seeded(self, seed):
+        """ Deterministic weighted selection from a seed shared by every node, in integer arithmetic. """
+        return self.find(seed_bits(seed) * self.total >> SEED_BITS)
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+from collections import deque
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Senders that issue new coins (block rewards, faucet) rather than spend a balance.
+MINT_SENDERS = frozenset(("0", "Network"))
+STATE_FILE = 'state.json'
+
+
+def transaction_fields(transaction):
+    """ (sender, receiver, amount, fee) of a Transaction or a transaction dict. """
+    if hasattr(transaction, 'to_dict'):
+        transaction = transaction.to_dict()
+    receiver = transaction.get('receiver', transaction.get('recipient'))
+    return transaction.get('sender'), receiver, transaction.get('amount') or 0, transaction.get('fee') or 0
+
+
+class AccountState:
+    """
+    Balance and nonce per address, updated incrementally as blocks are appended.
+    Each applied block leaves an undo record of the accounts it changed, so a reorg rolls back
+    only the blocks above the fork point. Lookups are dictionary reads, independent of chain length.
+    The state can be snapshotted to disk; on restart only the blocks after the snapshot are replayed.
+    A nonce counts the transactions an address has sent.
+    """
+
+    def __init__(self, max_undo=1000):
+        self.balances = {}
+        self.nonces = {}
+        self.height = -1          # height of the last applied block
+        self.tip_hash = None
+        self.undo = deque()       # (height, previous tip hash, {address: (balance, nonce)}), oldest first
+        self.max_undo = max_undo
+
+    def balance_of(self, address):
+        return self.balances.get(address, 0)
+
+    def nonce_of(self, address):
+        return self.nonces.get(address, 0)
+
+    def can_afford(self, sender, amount, fee=0):
+        """ True if `sender` holds at least amount + fee. Minting senders can always pay. """
+        return sender in MINT_SENDERS or self.balance_of(sender) >= amount + fee
+
+    def admit(self, transaction):
+        """ Transaction admission check against the confirmed balances, in O(1). """
+        sender, _, amount, fee = transaction_fields(transaction)
+        return self.can_afford(sender, amount, fee)
+
+    def apply_block(self, height, block_hash, transactions, strict=False):
+        """
+        Apply the transactions of the block at `height`, which must follow the last applied block.
+        :param strict: <bool> Reject the block if any sender overdraws; by default balances may go
+                       negative, as the chain does not enforce funding yet.
+        :return: <bool> True if the block was applied.
+        """
+        if height != self.height + 1:
+            raise ValueError(f"Block {height} does not follow state height {self.height}.")
+        changed = {}
+
+        def touch(address):
+            if address not in changed:
+                changed[address] = (self.balances.get(address), self.nonces.get(address))
+
+        for transaction in transactions:
+            sender, receiver, amount, fee = transaction_fields(transaction)
+            if sender not in MINT_SENDERS:
+                touch(sender)
+                if strict and self.balance_of(sender) < amount + fee:
+                    self.restore(changed)
+                    return False
+                self.balances[sender] = self.balance_of(sender) - amount - fee
+                self.nonces[sender] = self.nonce_of(sender) + 1
+            touch(receiver)
+            self.balances[receiver] = self.balance_of(receiver) + amount
+
+        self.undo.append((height, self.tip_hash, changed))
+        if len(self.undo) > self.max_undo:
+            self.undo.popleft()
+        self.height = height
+        self.tip_hash = block_hash
+        return True
+
+    def restore(self, changed):
+        for address, (balance, nonce) in changed.items():
+            for values, value in ((self.balances, balance), (self.nonces, nonce)):
+                if value is None:
+                    values.pop(address, None)
+                else:
+                    values[address] = value
+
+    def rollback_to(self, height):
+        """
+        Undo every block above `height`.
+        :return: <bool> False if the undo history does not reach back that far; the state must
+                 then be rebuilt.
+        """
+        while self.height > height:
+            if not self.undo or self.undo[-1][0] != self.height:
+                return False
+            _, previous_hash, changed = self.undo.pop()
+            self.restore(changed)
+            self.height -= 1
+            self.tip_hash = previous_hash
+        return True
+
+    def reset(self):
+        self.balances = {}
+        self.nonces = {}
+        self.height = -1
+        self.tip_hash = None
+        self.undo.clear()
+
+    # -------------------------
+    # Snapshots
+    # -------------------------
+    def save(self, path):
+        """ Write the balances and nonces to `path`, replacing the previous snapshot atomically. """
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as state_file:
+            json.dump({
+                'height': self.height,
+                'tip_hash': self.tip_hash,
+                'balances': self.balances,
+                'nonces': self.nonces,
+            }, state_file)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """
+        Restore a snapshot written by `save`. Undo history is not saved, so a reorg below the
+        snapshot height needs a rebuild.
+        :return: <bool> True if a snapshot was loaded.
+        """
+        try:
+            with open(path) as state_file:
+                snapshot = json.load(state_file)
+            height, tip_hash = snapshot['height'], snapshot['tip_hash']
+            balances, nonces = snapshot['balances'], snapshot['nonces']
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable state snapshot {path} - {e}")
+            return False
+        self.reset()
+        self.balances, self.nonces = balances, nonces
+        self.height, self.tip_hash = height, tip_hash
+        logging.info(f"Loaded account state at height {height} from {path}.")
+        return True
@@ -0,0 +1,300 @@
+import logging
+import mmap
+import os
+import struct
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# One fixed-width index record per block: segment number, offset, length, block hash.
+INDEX_RECORD = struct.Struct('>IQI32s')
+INDEX_FILE = 'index.dat'
+SEGMENT_FILE = 'blocks-{:05d}.dat'
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class BlockStore:
+    """
+    Append-only, segmented on-disk block store.
+    Encoded blocks are appended to segment files; a fixed-width index maps height to
+    (segment, offset, length) and is the only file read on startup. Reads go through mmap.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, sync=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        self.entries = []   # height -> (segment, offset, length)
+        self.heights = {}   # raw block hash -> height
+        self.maps = {}      # segment -> (file, mmap)
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+        self.index_file = open(self.index_path, 'ab')
+        self.segment, self.segment_offset = self.tail_position()
+        self.recover_segment()
+        self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_FILE.format(segment))
+
+    def load_index(self):
+        """ Read the index into memory, dropping a torn trailing record if the last write was interrupted. """
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as index_file:
+            data = index_file.read()
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        if usable != len(data):
+            logging.warning("Discarding partial block index record.")
+            with open(self.index_path, 'r+b') as index_file:
+                index_file.truncate(usable)
+        for height, (segment, offset, length, block_hash) in enumerate(INDEX_RECORD.iter_unpack(data[:usable])):
+            self.entries.append((segment, offset, length))
+            self.heights[block_hash] = height
+        logging.info(f"Loaded block index with {len(self.entries)} entries from {self.directory}.")
+
+    def tail_position(self):
+        """ Return (segment, offset) just past the last indexed block. """
+        if not self.entries:
+            return 0, 0
+        segment, offset, length = self.entries[-1]
+        return segment, offset + length
+
+    def recover_segment(self):
+        """ Drop bytes written to the active segment after the last indexed block. """
+        path = self.segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) > self.segment_offset:
+            logging.warning("Discarding unindexed data at the end of the block store.")
+            with open(path, 'r+b') as segment_file:
+                segment_file.truncate(self.segment_offset)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, data, block_hash):
+        """
+        Append an encoded block.
+        :param data: <bytes> Encoded block.
+        :param block_hash: <str> Hex hash of the block.
+        :return: <int> Height of the stored block.
+        """
+        if self.segment_offset and self.segment_offset + len(data) > self.segment_size:
+            self.segment_file.close()
+            self.segment += 1
+            self.segment_offset = 0
+            self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+        self.segment_file.write(data)
+        self.flush(self.segment_file)
+        raw_hash = bytes.fromhex(block_hash)
+        self.index_file.write(INDEX_RECORD.pack(self.segment, self.segment_offset, len(data), raw_hash))
+        self.flush(self.index_file)
+
+        height = len(self.entries)
+        self.entries.append((self.segment, self.segment_offset, len(data)))
+        self.heights[raw_hash] = height
+        self.segment_offset += len(data)
+        return height
+
+    def flush(self, file):
+        file.flush()
+        if self.sync:
+            os.fsync(file.fileno())
+
+    def get(self, height):
+        """ Return the encoded block at `height` without copying the segment into memory. """
+        segment, offset, length = self.entries[height]
+        view = self.view(segment, offset + length)
+        return view[offset:offset + length]
+
+    def view(self, segment, end):
+        """ Return an mmap of the segment covering at least `end` bytes, remapping a grown segment. """
+        cached = self.maps.get(segment)
+        if cached is None or len(cached[1]) < end:
+            self.unmap(segment)
+            segment_file = open(self.segment_path(segment), 'rb')
+            cached = (segment_file, mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ))
+            self.maps[segment] = cached
+        return cached[1]
+
+    def unmap(self, segment):
+        cached = self.maps.pop(segment, None)
+        if cached:
+            cached[1].close()
+            cached[0].close()
+
+    def height_of(self, block_hash):
+        """ Return the height of the block with the given hex hash, or None. """
+        return self.heights.get(bytes.fromhex(block_hash))
+
+    def get_by_hash(self, block_hash):
+        height = self.height_of(block_hash)
+        return None if height is None else self.get(height)
+
+    def truncate(self, height):
+        """
+        Remove every block at or above `height`, e.g. when a fork replaces the tip.
+        :param height: <int> First height to remove.
+        """
+        if height >= len(self.entries):
+            return
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(height * INDEX_RECORD.size)
+            removed = index_file.read()
+        for *_, block_hash in INDEX_RECORD.iter_unpack(removed):
+            self.heights.pop(block_hash, None)
+
+        segment, offset, _ = self.entries[height]
+        self.segment_file.close()
+        for stale in range(segment, self.segment + 1):
+            self.unmap(stale)
+            if stale > segment:
+                os.remove(self.segment_path(stale))
+        with open(self.segment_path(segment), 'r+b') as segment_file:
+            segment_file.truncate(offset)
+        self.index_file.truncate(height * INDEX_RECORD.size)
+
+        del self.entries[height:]
+        self.segment, self.segment_offset = segment, offset
+        self.segment_file = open(self.segment_path(segment), 'ab')
+
+    def close(self):
+        for segment in list(self.maps):
+            self.unmap(segment)
+        self.segment_file.close()
+        self.index_file.close()
+
+
+class StoredChain:
+    """
+    List-like view of a chain kept in a BlockStore.
+    Blocks are decoded on access, so only the blocks actually read are held in memory.
+    """
+
+    def __init__(self, store, encode, decode, block_hash):
+        self.store = store
+        self.encode = encode
+        self.decode = decode
+        self.block_hash = block_hash
+        self.tip = None
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("chain index out of range")
+        if item == len(self) - 1 and self.tip is not None:
+            return self.tip
+        block = self.decode(self.store.get(item))
+        if item == len(self) - 1:
+            self.tip = block
+        return block
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def __delitem__(self, item):
+        if not isinstance(item, slice) or item.stop is not None or item.step not in (None, 1):
+            raise TypeError("Only the tail of a stored chain can be removed.")
+        start = item.indices(len(self))[0]
+        self.store.truncate(start)
+        self.tip = None
+
+    def append(self, block):
+        self.store.append(self.encode(block), self.block_hash(block))
+        self.tip = block
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
+
+    def raw(self, height):
+        """ Encoded bytes of the block at `height`, without decoding it. """
+        return self.store.get(height)
+
+    def __iadd__(self, blocks):
+        self.extend(blocks)
+        return self
+
+    def pop(self, index=-1):
+        if index not in (-1, len(self) - 1):
+            raise TypeError("Only the tip of a chain can be popped.")
+        if not len(self):
+            raise IndexError("pop from empty chain")
+        block = self[-1]
+        self.store.truncate(len(self) - 1)
+        self.tip = None
+        return block
+
+    def clear(self):
+        self.store.truncate(0)
+        self.tip = None
+
+    def _unsupported(self, *args, **kwargs):
+        raise TypeError("Blocks can only be appended to or removed from the tip of a chain.")
+
+    __setitem__ = insert = remove = reverse = sort = __imul__ = _unsupported
+
+    def index_of_hash(self, block_hash):
+        return self.store.height_of(block_hash)
+
+
+class IndexedChain(list):
+    """
+    In-memory chain that keeps a block-hash -> height index in step with appends and tail removals.
+    Blocks are only ever added or removed at the tip; every other list mutator raises TypeError, so
+    the index cannot drift from the blocks it describes.
+    """
+
+    def __init__(self, block_hash, blocks=()):
+        super().__init__()
+        self.block_hash = block_hash
+        self.heights = {}
+        self.extend(blocks)
+
+    def append(self, block):
+        self.heights[self.block_hash(block)] = len(self)
+        super().append(block)
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
+
+    def __delitem__(self, item):
+        if not isinstance(item, slice) or item.stop is not None or item.step not in (None, 1):
+            raise TypeError("Only the tail of a chain can be removed.")
+        for block in self[item]:
+            self.heights.pop(self.block_hash(block), None)
+        super().__delitem__(item)
+
+    def __iadd__(self, blocks):
+        self.extend(blocks)
+        return self
+
+    def pop(self, index=-1):
+        if index not in (-1, len(self) - 1):
+            raise TypeError("Only the tip of a chain can be popped.")
+        block = super().pop()
+        self.heights.pop(self.block_hash(block), None)
+        return block
+
+    def clear(self):
+        super().clear()
+        self.heights.clear()
+
+    def _unsupported(self, *args, **kwargs):
+        raise TypeError("Blocks can only be appended to or removed from the tip of a chain.")
+
+    __setitem__ = insert = remove = reverse = sort = __imul__ = _unsupported
+
+    def index_of_hash(self, block_hash):
+        return self.heights.get(block_hash)
@@ -0,0 +1,167 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ChainSynchronizer:
+    """
+    Headers-first chain synchronisation.
+    Peers are asked for headers following our block locator; the longest valid header chain wins,
+    and only the block bodies after the fork point are downloaded, in pages spread over every peer
+    that advertised the same tip.
+    """
+
+    def __init__(self, blockchain, connections, header_batch=2000, page_size=200, timeout=30):
+        self.blockchain = blockchain
+        self.connections = connections
+        self.header_batch = header_batch
+        self.page_size = page_size
+        self.timeout = timeout
+
+    # -------------------------
+    # Serving peers
+    # -------------------------
+    def handle_get_headers(self, message):
+        """ Reply to a get_headers request with the headers following the peer's locator. """
+        limit = min(message.get("limit") or self.header_batch, self.header_batch)
+        fork_height, headers = self.blockchain.headers_after(message.get("locator", []), limit)
+        return {"fork_height": fork_height, "headers": headers}
+
+    def handle_get_blocks(self, message):
+        """ Reply to a get_blocks request with the bodies of the requested block hashes. """
+        blocks = []
+        for block_hash in message.get("hashes", [])[:self.page_size]:
+            block = self.blockchain.get_block_by_hash(block_hash)
+            if block is None:
+                break
+            blocks.append(block)
+        return {"blocks": blocks}
+
+    # -------------------------
+    # Catching up
+    # -------------------------
+    def sync(self, peers):
+        """
+        Bring our chain up to the best chain offered by `peers`.
+        :param peers: <list> (host, port) tuples.
+        :return: <bool> True if our chain was extended.
+        """
+        peers = list(peers)
+        if not peers:
+            return False
+
+        candidates = self.collect_headers(peers)
+        if not candidates:
+            logging.info("No peer offered a longer chain.")
+            return False
+
+        fork_height, headers, sources = max(candidates, key=lambda candidate: candidate[0] + len(candidate[1]))
+        if fork_height + 1 + len(headers) <= len(self.blockchain.chain):
+            return False
+
+        blocks = self.download_blocks(headers, sources)
+        if blocks is None:
+            return False
+        if self.blockchain.extend_chain(fork_height, blocks):
+            logging.info(f"Synchronised {len(blocks)} blocks from height {fork_height + 1}.")
+            return True
+        logging.warning("Downloaded blocks failed validation.")
+        return False
+
+    def collect_headers(self, peers):
+        """
+        Ask every peer for headers after our locator, concurrently.
+        :return: <list> of (fork height, headers, peers advertising that tip) for valid header chains.
+        """
+        locator = self.blockchain.block_locator()
+        by_tip = {}
+        with ThreadPoolExecutor(max_workers=min(len(peers), 16)) as executor:
+            futures = {executor.submit(self.fetch_headers, peer, locator): peer for peer in peers}
+            for future in as_completed(futures):
+                peer = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to fetch headers from {peer} - {e}")
+                    continue
+                if result is None:
+                    continue
+                fork_height, headers = result
+                tip = self.blockchain.hash(headers[-1])
+                if tip in by_tip:
+                    by_tip[tip][2].append(peer)
+                else:
+                    by_tip[tip] = (fork_height, headers, [peer])
+        return list(by_tip.values())
+
+    def fetch_headers(self, peer, locator):
+        """ Pull header batches from one peer until it has nothing more to give. """
+        reply = self.connections.request(peer, {"action": "get_headers", "locator": locator}, self.timeout)
+        fork_height = reply.get("fork_height")
+        headers = reply.get("headers") or []
+        if fork_height is None or not headers:
+            return None
+        if not self.blockchain.is_fork_height(fork_height):
+            logging.warning(f"Peer {peer} sent an out-of-range fork height {fork_height!r}.")
+            return None
+
+        batch = headers
+        while len(batch) >= self.header_batch:
+            reply = self.connections.request(
+                peer, {"action": "get_headers", "locator": [self.blockchain.hash(headers[-1])]}, self.timeout
+            )
+            batch = reply.get("headers") or []
+            headers.extend(batch)
+
+        if not self.valid_headers(fork_height, headers):
+            logging.warning(f"Peer {peer} sent an invalid header chain.")
+            return None
+        return fork_height, headers
+
+    def valid_headers(self, fork_height, headers):
+        """ Check that headers link to each other and to our fork block, with valid proofs. """
+        previous = self.blockchain.get_block(fork_height)
+        for header in headers:
+            if header['previous_hash'] != self.blockchain.hash(previous):
+                return False
+            if not self.blockchain.valid_proof(previous['proof'], header['proof']):
+                return False
+            previous = header
+        return True
+
+    def download_blocks(self, headers, sources):
+        """
+        Download the bodies for `headers` in pages, spreading pages over `sources`.
+        A page that fails is retried on the next source.
+        :return: <list> Blocks in header order, or None if a page could not be fetched.
+        """
+        hashes = [self.blockchain.hash(header) for header in headers]
+        pages = [hashes[i:i + self.page_size] for i in range(0, len(hashes), self.page_size)]
+        results = [None] * len(pages)
+
+        with ThreadPoolExecutor(max_workers=min(len(pages), len(sources) * 2, 16)) as executor:
+            futures = {
+                executor.submit(self.fetch_page, page, sources, number): number
+                for number, page in enumerate(pages)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        if any(page is None for page in results):
+            return None
+        return [block for page in results for block in page]
+
+    def fetch_page(self, hashes, sources, number):
+        for attempt in range(len(sources)):
+            peer = sources[(number + attempt) % len(sources)]
+            try:
+                reply = self.connections.request(peer, {"action": "get_blocks", "hashes": hashes}, self.timeout)
+            except Exception as e:
+                logging.error(f"Failed to fetch blocks from {peer} - {e}")
+                continue
+            blocks = reply.get("blocks") or []
+            if [self.blockchain.hash(block) for block in blocks] == hashes:
+                return blocks
+            logging.warning(f"Peer {peer} returned blocks that do not match the requested headers.")
+        return None
@@ -1,19 +1,69 @@
 import hashlib
+import heapq
+import itertools
 import json
+import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 from cryptography.exceptions import InvalidSignature
 
+PUBLIC_KEY_CACHE_SIZE = 4096
+_public_key_cache = OrderedDict()  # PEM fingerprint -> parsed public key
+_public_key_lock = threading.Lock()
+
+
+def load_public_key(public_key_pem):
+    """ Parse a PEM public key, reusing the parsed object for keys seen recently. """
+    fingerprint = hashlib.sha256(public_key_pem.encode()).digest()
+    with _public_key_lock:
+        public_key = _public_key_cache.get(fingerprint)
+        if public_key is not None:
+            _public_key_cache.move_to_end(fingerprint)
+            return public_key
+
+    public_key = serialization.load_pem_public_key(public_key_pem.encode(), backend=default_backend())
+    with _public_key_lock:
+        _public_key_cache[fingerprint] = public_key
+        if len(_public_key_cache) > PUBLIC_KEY_CACHE_SIZE:
+            _public_key_cache.popitem(last=False)
+    return public_key
+
+
 class Transaction:
-    def __init__(self, sender, receiver, amount, timestamp=None, signature=None):
+    """
+    A signed value transfer.
+    The canonical JSON encoding, the transaction hash and the signing hash are computed on first
+    use and cached; assigning to a field clears only the cached values that depend on it.
+    """
+    __slots__ = ('sender', 'receiver', 'amount', 'timestamp', 'signature', 'fee',
+                 '_canonical', '_hash', '_signing_hash')
+
+    UNSIGNED_CACHE = ('_canonical', '_hash')
+    SIGNED_CACHE = ('_canonical', '_hash', '_signing_hash')
+    SIGNED_FIELDS = frozenset(('sender', 'receiver', 'amount', 'timestamp', 'fee'))
+
+    def __init__(self, sender, receiver, amount, timestamp=None, signature=None, fee=0):
         self.sender = sender
         self.receiver = receiver
         self.amount = amount
         self.timestamp = timestamp or time.time()
         self.signature = signature
+        self.fee = fee
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Transaction.SIGNED_FIELDS:
+            for cached in Transaction.SIGNED_CACHE:
+                object.__setattr__(self, cached, None)
+        elif name == 'signature':
+            for cached in Transaction.UNSIGNED_CACHE:
+                object.__setattr__(self, cached, None)
 
     def to_dict(self):
         """ Convert transaction data to a dictionary format. """
@@ -22,17 +72,34 @@ class Transaction:
             'receiver': self.receiver,
             'amount': self.amount,
             'timestamp': self.timestamp,
-            'signature': self.signature
+            'signature': self.signature,
+            'fee': self.fee
         }
 
+    def canonical_bytes(self):
+        """ Canonical (sorted-key JSON) encoding of the transaction, computed once. """
+        if self._canonical is None:
+            object.__setattr__(self, '_canonical', json.dumps(self.to_dict(), sort_keys=True).encode())
+        return self._canonical
+
     def to_json(self):
         """ Convert transaction data to JSON format. """
-        return json.dumps(self.to_dict(), sort_keys=True)
+        return self.canonical_bytes().decode()
 
     def calculate_hash(self):
         """ Calculate a SHA-256 hash of the transaction. """
-        transaction_json = self.to_json()
-        return hashlib.sha256(transaction_json.encode()).hexdigest()
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hashlib.sha256(self.canonical_bytes()).hexdigest())
+        return self._hash
+
+    def signing_hash(self):
+        """ Hash of every field except the signature; this is what gets signed. """
+        if self._signing_hash is None:
+            transaction_data = self.to_dict()
+            del transaction_data['signature']
+            signing_json = json.dumps(transaction_data, sort_keys=True).encode()
+            object.__setattr__(self, '_signing_hash', hashlib.sha256(signing_json).hexdigest())
+        return self._signing_hash
 
     def sign_transaction(self, private_key_pem):
         """ Sign the transaction using the sender's private key (in PEM format). """
@@ -42,7 +109,7 @@ class Transaction:
                 password=None,
                 backend=default_backend()
             )
-            transaction_hash = self.calculate_hash()
+            transaction_hash = self.signing_hash()
             self.signature = private_key.sign(
                 transaction_hash.encode(),
                 padding.PSS(
@@ -58,11 +125,8 @@ class Transaction:
     def verify_signature(self, public_key_pem):
         """ Verify the signature of the transaction using the sender's public key. """
         try:
-            public_key = serialization.load_pem_public_key(
-                public_key_pem.encode(),
-                backend=default_backend()
-            )
-            transaction_hash = self.calculate_hash()
+            public_key = load_public_key(public_key_pem)
+            transaction_hash = self.signing_hash()
             public_key.verify(
                 bytes.fromhex(self.signature),
                 transaction_hash.encode(),
@@ -107,7 +171,8 @@ class Transaction:
             receiver=data['receiver'],
             amount=data['amount'],
             timestamp=data['timestamp'],
-            signature=data['signature']
+            signature=data['signature'],
+            fee=data.get('fee', 0)
         )
 
     @staticmethod
@@ -123,38 +188,193 @@ class Transaction:
             raise ValueError("Transaction must have a sender, receiver, and an amount.")
         if transaction.amount <= 0:
             raise ValueError("Transaction amount must be greater than zero.")
+        if transaction.fee < 0:
+            raise ValueError("Transaction fee cannot be negative.")
         if not transaction.signature:
             raise ValueError("Transaction must be signed.")
         return True
 
 
+def _verify_chunk(items):
+    """ Worker entry point: verify (transaction dict, public key PEM) pairs. """
+    results = []
+    for transaction_data, public_key_pem in items:
+        try:
+            results.append(Transaction.from_dict(transaction_data).verify_signature(public_key_pem))
+        except Exception:
+            results.append(False)
+    return results
+
+
+class BatchVerifier:
+    """
+    Verifies many transaction signatures at once by fanning chunks out over a process pool.
+    Each worker keeps its own parsed public-key cache, so repeated senders are only parsed once.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=256, min_parallel=512):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.executor = None
+
+    def verify(self, transactions, public_keys=None):
+        """
+        Verify a batch of transactions.
+        :param transactions: <list> Transaction objects or transaction dicts.
+        :param public_keys: <list> PEM keys matching `transactions`; defaults to each sender.
+        :return: <list> One bool per transaction; malformed transactions verify as False.
+        """
+        items = []
+        for position, transaction in enumerate(transactions):
+            transaction_data = transaction if isinstance(transaction, dict) else transaction.to_dict()
+            public_key_pem = public_keys[position] if public_keys else transaction_data.get('sender')
+            items.append((transaction_data, public_key_pem))
+
+        if self.max_workers == 1 or len(items) < self.min_parallel:
+            return _verify_chunk(items)
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        results = []
+        for chunk_results in self.executor.map(_verify_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
 class TransactionPool:
-    def __init__(self):
-        self.transactions = []
+    """
+    Mempool indexed by transaction hash.
+    A priority heap orders transactions for block assembly (highest fee first, or oldest first
+    with order='age') and a mirrored heap finds the eviction candidate when the pool is full.
+    Removed entries are dropped from the heaps lazily.
+    """
+
+    def __init__(self, max_size=50000, order='fee'):
+        if order not in ('fee', 'age'):
+            raise ValueError("Pool order must be 'fee' or 'age'.")
+        self.max_size = max_size
+        self.order = order
+        self.transactions = {}  # txid -> Transaction
+        self.entries = {}       # txid -> sequence number of its live heap entries
+        self.best = []          # (priority, seq, txid), best transaction first
+        self.worst = []         # (inverted priority, seq, txid), eviction candidate first
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, transaction):
+        return self.transaction_id(transaction) in self.transactions
+
+    @staticmethod
+    def transaction_id(transaction):
+        """ Hash of a Transaction, a transaction dict, or a hash passed through unchanged. """
+        if isinstance(transaction, str):
+            return transaction
+        if isinstance(transaction, dict):
+            return hashlib.sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+        return transaction.calculate_hash()
+
+    def priority(self, transaction):
+        """ Sort key where smaller means the transaction goes into a block sooner. """
+        if self.order == 'fee':
+            return (-transaction.fee, transaction.timestamp)
+        return (transaction.timestamp,)
 
     def add_transaction(self, transaction):
-        """ Add a new transaction to the pool after validation. """
-        if Transaction.validate_transaction(transaction):
-            self.transactions.append(transaction)
-            return True
-        else:
+        """ Add a new transaction to the pool after validation. Duplicates are ignored. """
+        if not Transaction.validate_transaction(transaction):
+            return False
+        txid = transaction.calculate_hash()
+        if txid in self.transactions:
             return False
 
+        priority = self.priority(transaction)
+        if len(self.transactions) >= self.max_size:
+            worst_txid = self.peek_worst()
+            if worst_txid is None or priority >= self.priority(self.transactions[worst_txid]):
+                return False
+            self.remove_transaction(worst_txid)
+
+        seq = next(self.counter)
+        self.transactions[txid] = transaction
+        self.entries[txid] = seq
+        heapq.heappush(self.best, (priority, seq, txid))
+        heapq.heappush(self.worst, (tuple(-value for value in priority), seq, txid))
+        return True
+
+    def is_live(self, entry):
+        return self.entries.get(entry[2]) == entry[1]
+
+    def peek_worst(self):
+        """ Return the hash of the lowest-priority transaction, discarding stale heap entries. """
+        while self.worst and not self.is_live(self.worst[0]):
+            heapq.heappop(self.worst)
+        return self.worst[0][2] if self.worst else None
+
+    def get(self, txid):
+        return self.transactions.get(txid)
+
     def get_transactions(self):
-        """ Retrieve all transactions in the pool. """
-        return [transaction.to_dict() for transaction in self.transactions]
+        """ Retrieve all transactions in the pool, in block-assembly order. """
+        return [transaction.to_dict() for transaction in self.select_transactions()]
+
+    def select_transactions(self, limit=None):
+        """
+        Return up to `limit` transactions in priority order without removing them.
+        :param limit: <int> Maximum number of transactions, or None for all of them.
+        """
+        live = (entry for entry in self.best if self.is_live(entry))
+        # A bounded selection costs O(n log limit); the heap itself is left untouched.
+        entries = sorted(live) if limit is None else heapq.nsmallest(limit, live)
+        return [self.transactions[entry[2]] for entry in entries]
 
     def clear_transactions(self):
         """ Clear all transactions from the pool. """
-        self.transactions = []
+        self.transactions = {}
+        self.entries = {}
+        self.best = []
+        self.worst = []
 
     def remove_transaction(self, transaction):
         """ Remove a specific transaction from the pool. """
-        for tx in self.transactions:
-            if tx.calculate_hash() == transaction.calculate_hash():
-                self.transactions.remove(tx)
-                return True
-        return False
+        txid = self.transaction_id(transaction)
+        if self.transactions.pop(txid, None) is None:
+            return False
+        del self.entries[txid]
+        self.compact()
+        return True
+
+    def remove_transactions(self, transactions):
+        """
+        Evict every pooled transaction included in a new block.
+        :param transactions: <list> Transactions, transaction dicts or hashes.
+        :return: <int> Number of transactions removed.
+        """
+        removed = 0
+        for transaction in transactions:
+            txid = self.transaction_id(transaction)
+            if self.transactions.pop(txid, None) is not None:
+                del self.entries[txid]
+                removed += 1
+        self.compact()
+        return removed
+
+    def compact(self):
+        """ Rebuild the heaps once stale entries outnumber live ones. """
+        if len(self.best) <= 2 * len(self.transactions) + 64:
+            return
+        self.best = [entry for entry in self.best if self.is_live(entry)]
+        self.worst = [entry for entry in self.worst if self.is_live(entry)]
+        heapq.heapify(self.best)
+        heapq.heapify(self.worst)
 
 
 if __name__ == "__main__":
@@ -175,6 +395,11 @@ if __name__ == "__main__":
     verification_result = transaction.verify_signature(public_key)
     print("Transaction verification:", "Passed" if verification_result else "Failed")
 
+    # Verify a batch of transactions
+    verifier = BatchVerifier()
+    print("Batch verification:", verifier.verify([transaction, transaction], [public_key, public_key]))
+    verifier.close()
+
     # Serialize and Deserialize example
     transaction_json = transaction.to_json()
     deserialized_transaction = Transaction.from_json(transaction_json)
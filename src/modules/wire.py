@@ -0,0 +1,236 @@
+import json
+import struct
+
+# Binary payloads start with the format version; JSON payloads start with '{' or '[',
+# so a receiver can tell the two apart from the first byte.
+WIRE_VERSION = 1
+VERSION_BYTE = bytes([WIRE_VERSION])
+
+TAG_NONE = 0x00
+TAG_FALSE = 0x01
+TAG_TRUE = 0x02
+TAG_INT = 0x03
+TAG_BIGINT = 0x04
+TAG_FLOAT = 0x05
+TAG_STR = 0x06
+TAG_SYMBOL = 0x07
+TAG_HEX = 0x08
+TAG_BYTES = 0x09
+TAG_LIST = 0x0A
+TAG_DICT = 0x0B
+TAG_TRANSACTION = 0x0C
+TAG_BLOCK = 0x0D
+TAG_JSON = 0x0E
+
+INT64 = struct.Struct('>q')
+FLOAT64 = struct.Struct('>d')
+UINT32 = struct.Struct('>I')
+UINT16 = struct.Struct('>H')
+# Hex strings and big integers carry a 2-byte length; longer hex strings are sent as plain strings.
+MAX_SHORT_LENGTH = 0xFFFF
+
+# Field order of the fixed transaction and block layouts; field names are not sent.
+TRANSACTION_FIELDS = ('sender', 'receiver', 'amount', 'timestamp', 'signature', 'fee')
+BLOCK_FIELDS = ('index', 'timestamp', 'merkle_root', 'proof', 'previous_hash', 'transactions')
+TRANSACTION_KEYS = frozenset(TRANSACTION_FIELDS)
+BLOCK_KEYS = frozenset(BLOCK_FIELDS)
+
+# Frequent strings are sent as one-byte symbols. Only ever append to this table:
+# the position of each entry is part of the wire format.
+SYMBOLS = (
+    'action', 'id', 'reply',
+    'new_transaction', 'new_block', 'get_chain', 'get_peers', 'ping', 'pong',
+    'new_peer', 'sync_chain', 'update_peers',
+    'transaction', 'block', 'chain', 'length', 'peers', 'peer_host', 'peer_port',
+    'sender', 'receiver', 'recipient', 'amount', 'timestamp', 'signature', 'fee',
+    'index', 'transactions', 'merkle_root', 'proof', 'previous_hash',
+    'get_headers', 'get_blocks', 'headers', 'blocks', 'locator', 'hashes', 'fork_height', 'limit',
+    'compact_block', 'get_block_txns', 'header', 'short_ids', 'prefilled', 'block_hash', 'indexes',
+    'inv', 'getdata',
+    'proposer',
+    'unvalidated', 'origin',
+)
+SYMBOL_INDEX = {symbol: position for position, symbol in enumerate(SYMBOLS)}
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+class Encoded:
+    """
+    A value that is already encoded, e.g. a block read straight from the block store.
+    It is spliced into the output without being decoded first.
+    """
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = bytes(payload)
+
+    def value(self):
+        return loads(self.payload)
+
+
+def is_hex(text):
+    """ Lowercase, even-length hex strings (hashes, signatures) are sent as raw bytes. """
+    return len(text) >= 16 and len(text) % 2 == 0 and HEX_DIGITS.issuperset(text)
+
+
+def _write(value, out):
+    if value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif isinstance(value, int):
+        if -2 ** 63 <= value < 2 ** 63:
+            out.append(TAG_INT)
+            out += INT64.pack(value)
+        else:
+            raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+            if len(raw) > MAX_SHORT_LENGTH:
+                raise ValueError(f"Integer of {len(raw)} bytes exceeds the {MAX_SHORT_LENGTH} byte wire limit.")
+            out.append(TAG_BIGINT)
+            out += UINT16.pack(len(raw)) + raw
+    elif isinstance(value, float):
+        out.append(TAG_FLOAT)
+        out += FLOAT64.pack(value)
+    elif isinstance(value, str):
+        symbol = SYMBOL_INDEX.get(value)
+        if symbol is not None:
+            out.append(TAG_SYMBOL)
+            out.append(symbol)
+        elif is_hex(value) and len(value) <= 2 * MAX_SHORT_LENGTH:
+            raw = bytes.fromhex(value)
+            out.append(TAG_HEX)
+            out += UINT16.pack(len(raw)) + raw
+        else:
+            raw = value.encode()
+            out.append(TAG_STR)
+            out += UINT32.pack(len(raw)) + raw
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(TAG_BYTES)
+        out += UINT32.pack(len(value)) + bytes(value)
+    elif isinstance(value, Encoded):
+        if value.payload[:1] == VERSION_BYTE:
+            out += value.payload[1:]
+        else:
+            out.append(TAG_JSON)
+            out += UINT32.pack(len(value.payload)) + value.payload
+    elif isinstance(value, (list, tuple)):
+        out.append(TAG_LIST)
+        out += UINT32.pack(len(value))
+        for item in value:
+            _write(item, out)
+    elif isinstance(value, dict):
+        keys = value.keys()
+        if keys == TRANSACTION_KEYS:
+            out.append(TAG_TRANSACTION)
+            for field in TRANSACTION_FIELDS:
+                _write(value[field], out)
+        elif keys == BLOCK_KEYS:
+            out.append(TAG_BLOCK)
+            for field in BLOCK_FIELDS:
+                _write(value[field], out)
+        else:
+            out.append(TAG_DICT)
+            out += UINT32.pack(len(value))
+            for key, item in value.items():
+                _write(key, out)
+                _write(item, out)
+    elif hasattr(value, 'to_dict'):
+        _write(value.to_dict(), out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} for the wire.")
+
+
+def _read(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_FALSE:
+        return False, offset
+    if tag == TAG_TRUE:
+        return True, offset
+    if tag == TAG_INT:
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if tag == TAG_FLOAT:
+        return FLOAT64.unpack_from(data, offset)[0], offset + FLOAT64.size
+    if tag == TAG_SYMBOL:
+        return SYMBOLS[data[offset]], offset + 1
+    if tag in (TAG_HEX, TAG_BIGINT):
+        (length,) = UINT16.unpack_from(data, offset)
+        offset += UINT16.size
+        raw = bytes(data[offset:offset + length])
+        value = raw.hex() if tag == TAG_HEX else int.from_bytes(raw, 'big', signed=True)
+        return value, offset + length
+    if tag in (TAG_STR, TAG_BYTES, TAG_JSON):
+        (length,) = UINT32.unpack_from(data, offset)
+        offset += UINT32.size
+        raw = bytes(data[offset:offset + length])
+        if tag == TAG_STR:
+            return raw.decode(), offset + length
+        if tag == TAG_JSON:
+            return json.loads(raw), offset + length
+        return raw, offset + length
+    if tag == TAG_LIST:
+        (count,) = UINT32.unpack_from(data, offset)
+        offset += UINT32.size
+        items = []
+        for _ in range(count):
+            item, offset = _read(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == TAG_DICT:
+        (count,) = UINT32.unpack_from(data, offset)
+        offset += UINT32.size
+        result = {}
+        for _ in range(count):
+            key, offset = _read(data, offset)
+            result[key], offset = _read(data, offset)
+        return result, offset
+    if tag in (TAG_TRANSACTION, TAG_BLOCK):
+        fields = TRANSACTION_FIELDS if tag == TAG_TRANSACTION else BLOCK_FIELDS
+        result = {}
+        for field in fields:
+            result[field], offset = _read(data, offset)
+        return result, offset
+    raise ValueError(f"Unknown wire tag {tag:#04x}.")
+
+
+def dumps(value):
+    """
+    Encode a value (message, block, transaction, ...) in the binary wire format.
+    :return: <bytes> Version byte followed by the encoded value.
+    """
+    out = bytearray(VERSION_BYTE)
+    _write(value, out)
+    return bytes(out)
+
+
+def loads(data):
+    """
+    Decode a binary wire payload.
+    :param data: <bytes> Output of dumps.
+    :return: The decoded value; transactions and blocks come back as dicts.
+    """
+    data = memoryview(data)
+    if data[:1] != VERSION_BYTE:
+        raise ValueError(f"Unsupported wire format version {data[0] if len(data) else None}.")
+    value, offset = _read(data, 1)
+    if offset != len(data):
+        raise ValueError("Trailing bytes after wire payload.")
+    return value
+
+
+def is_binary(payload):
+    return payload[:1] == VERSION_BYTE
+
+
+def json_default(value):
+    """ `default` hook that lets json.dumps handle wire-only values for the JSON fallback. """
+    if isinstance(value, Encoded):
+        return value.value()
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
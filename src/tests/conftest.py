@@ -0,0 +1,16 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# The modules are imported as `modules.<name>`, relative to src/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def free_port():
+    """ A localhost port nothing is listening on. """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
@@ -0,0 +1,42 @@
+import pytest
+
+from modules import protocol
+from modules.blockchain import Blockchain
+from modules.compact import CompactBlockRelay
+from modules.transaction import Transaction, TransactionPool
+
+
+class NoConnections:
+    """ Fails the test if reconstruction has to fetch anything from the sender. """
+
+    def request(self, peer, message, timeout=None):
+        raise AssertionError(f"Unexpected request to {peer}: {message['action']}")
+
+
+@pytest.fixture
+def block_and_pool():
+    pool = TransactionPool()
+    private_key, public_key = Transaction.create_key_pair()
+    for amount in range(1, 4):
+        transaction = Transaction(sender=public_key, receiver="receiver_address", amount=amount)
+        transaction.sign_transaction(private_key)
+        pool.add_transaction(transaction)
+    blockchain = Blockchain()
+    blockchain.current_transactions = pool.get_transactions()
+    block = blockchain.create_block(blockchain.proof_of_work(blockchain.last_block['proof']))
+    return blockchain, pool, block
+
+
+@pytest.mark.parametrize('wire_format', ['binary', 'json'])
+def test_compact_block_survives_both_wire_formats(monkeypatch, block_and_pool, wire_format):
+    monkeypatch.setattr(protocol, 'WIRE_FORMAT', wire_format)
+    blockchain, pool, block = block_and_pool
+    sender = CompactBlockRelay(blockchain, pool, NoConnections(), ('10.0.0.1', 5000))
+    message = protocol.decode_message(protocol.encode_message(sender.make_compact_block(block)))
+    assert message["short_ids"]
+
+    receiver = CompactBlockRelay(Blockchain(), pool, NoConnections(), ('10.0.0.2', 5000))
+    rebuilt = receiver.reconstruct(message)
+    assert rebuilt is not None
+    assert [transaction['amount'] for transaction in rebuilt['transactions']] == \
+        [transaction['amount'] for transaction in block['transactions']]
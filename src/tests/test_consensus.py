@@ -0,0 +1,103 @@
+import pytest
+
+from modules.blockchain import Blockchain
+from modules.consensus import STAKES_FILE, Consensus
+from modules.transaction import TransactionPool
+
+EPOCH_LENGTH = 4
+
+
+def mine(blockchain, consensus=None, transactions=()):
+    """ The next block on our tip, proposed by the scheduled leader if `consensus` is given. """
+    blockchain.current_transactions = list(transactions)
+    proof = blockchain.proof_of_work(blockchain.last_block['proof'])
+    return consensus.create_block(proof) if consensus else blockchain.create_block(proof)
+
+
+def block_after(blockchain, previous, transactions=()):
+    """ A block on a side branch, following `previous`. """
+    blockchain.current_transactions = list(transactions)
+    block = blockchain.create_block(blockchain.proof_of_work(previous['proof']), Blockchain.hash(previous))
+    block['index'] = previous['index'] + 1
+    return block
+
+
+def mint(receiver, amount):
+    return {'sender': '0', 'recipient': receiver, 'amount': amount}
+
+
+def staked_chain(data_dir=None):
+    blockchain = Blockchain(data_dir)
+    consensus = Consensus(blockchain, TransactionPool(), epoch_length=EPOCH_LENGTH)
+    # Two stakers registered in epoch 0; epoch 1 is seeded by block 3.
+    consensus.add_stakeholder('alice', 5)
+    consensus.add_stakeholder('bob', 1)
+    for _ in range(3):
+        assert blockchain.add_block(mine(blockchain))
+    return blockchain, consensus
+
+
+@pytest.fixture
+def chain():
+    return staked_chain()
+
+
+def test_proposer_is_committed_to_by_the_header(chain):
+    blockchain, consensus = chain
+    block = mine(blockchain, consensus)
+    assert block['proposer'] in ('alice', 'bob')
+    header = Blockchain.block_header(block)
+    assert header['proposer'] == block['proposer']
+    assert Blockchain.hash(dict(block, proposer='mallory')) != Blockchain.hash(block)
+    # Blocks without a proposer keep the header (and hash) they had before.
+    assert 'proposer' not in Blockchain.block_header(blockchain.chain[1])
+
+
+def test_locally_produced_blocks_pass_validation(chain):
+    blockchain, consensus = chain
+    for _ in range(2 * EPOCH_LENGTH):
+        block = mine(blockchain, consensus)
+        assert consensus.validate_block(block)
+        assert not consensus.validate_block(dict(block, proposer='mallory'))
+        assert blockchain.add_block(block)
+
+
+def test_schedule_uses_the_epoch_snapshot_not_the_current_registry(chain):
+    blockchain, consensus = chain
+    before = consensus.prepare_epoch(1)
+    assert set(before) <= {'alice', 'bob'}
+    # Stake registered after epoch 1 was scheduled only counts from the next epoch.
+    consensus.add_stakeholder('carol', 1000)
+    assert consensus.compute_schedule(1) == before
+    for _ in range(EPOCH_LENGTH):
+        assert blockchain.add_block(mine(blockchain, consensus))
+    assert 'carol' in set(consensus.prepare_epoch(2))
+
+
+def test_stake_snapshots_are_saved_with_the_state(tmp_path):
+    blockchain, consensus = staked_chain(str(tmp_path))
+    schedule = consensus.prepare_epoch(1)
+    consensus.add_stakeholder('carol', 1000)
+    assert (tmp_path / STAKES_FILE).exists()
+
+    restarted = Consensus(Blockchain(str(tmp_path)), TransactionPool(), epoch_length=EPOCH_LENGTH)
+    assert restarted.stakeholders == consensus.stakeholders
+    assert restarted.compute_schedule(1) == schedule
+
+
+def test_reorg_invalidates_cached_schedules(chain):
+    blockchain, consensus = chain
+    assert blockchain.add_block(mine(blockchain, consensus))
+    stale_boundary = Blockchain.hash(blockchain.chain[3])
+    assert consensus.schedules[1][0] == stale_boundary
+    consensus.add_stakeholder('carol', 1000)
+
+    # A longer branch from height 2 replaces epoch 1's boundary block, and with it the seed.
+    branch = [block_after(blockchain, blockchain.chain[2], [mint('dave', 1)])]
+    for _ in range(2):
+        branch.append(block_after(blockchain, branch[-1]))
+    assert blockchain.extend_chain(2, branch)
+
+    # Recomputed for the new seed, from the stakes the epoch was first scheduled with.
+    assert 'carol' not in set(consensus.schedule_for(1))
+    assert consensus.schedules[1][0] == Blockchain.hash(blockchain.chain[3]) != stale_boundary
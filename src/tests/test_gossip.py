@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from modules.gossip import InventoryGossip
+from modules.transaction import Transaction, TransactionPool
+
+
+def signed_transaction(amount):
+    private_key, public_key = Transaction.create_key_pair()
+    transaction = Transaction(sender=public_key, receiver="receiver_address", amount=amount)
+    transaction.sign_transaction(private_key)
+    return transaction.to_dict()
+
+
+class FakeConnections:
+    """ Replies to getdata from a per-peer table of transaction dicts, recording every request. """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, peer, message, timeout=10):
+        with self.lock:
+            self.requests.append((peer, list(message["hashes"])))
+        return {"transactions": self.replies.get(peer, [])}
+
+    def send(self, peer, message):
+        pass
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the gossip fetcher.")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def transactions():
+    return [signed_transaction(amount) for amount in (1, 2)]
+
+
+def inv(peer, hashes):
+    return {"action": "inv", "hashes": hashes, "peer_host": peer[0], "peer_port": peer[1]}
+
+
+def test_only_requested_transactions_are_accepted(transactions):
+    wanted, unrequested = transactions
+    peer = ('10.0.0.1', 5000)
+    pool = TransactionPool()
+    received = []
+    gossip = InventoryGossip(pool, FakeConnections({peer: [unrequested, wanted]}), ('10.0.0.9', 5000),
+                             received.extend)
+    try:
+        gossip.handle_inv(inv(peer, [TransactionPool.transaction_id(wanted)]))
+        wait_until(lambda: received)
+        assert received == [wanted]
+    finally:
+        gossip.close()
+
+
+def test_rejected_hashes_are_not_fetched_again(transactions):
+    transaction = transactions[0]
+    hash_value = TransactionPool.transaction_id(transaction)
+    first, second = ('10.0.0.1', 5000), ('10.0.0.2', 5000)
+    connections = FakeConnections({first: [transaction], second: [transaction]})
+    gossip = InventoryGossip(TransactionPool(), connections, ('10.0.0.9', 5000), lambda batch: [])
+    try:
+        gossip.handle_inv(inv(first, [hash_value]))
+        wait_until(lambda: hash_value in gossip.rejected)
+        gossip.handle_inv(inv(second, [hash_value]))
+        assert connections.requests == [(first, [hash_value])]
+        gossip.clear_rejected()
+        gossip.handle_inv(inv(second, [hash_value]))
+        wait_until(lambda: len(connections.requests) == 2)
+    finally:
+        gossip.close()
+
+
+def test_undelivered_hashes_are_fetched_from_another_announcer(transactions):
+    transaction = transactions[0]
+    hash_value = TransactionPool.transaction_id(transaction)
+    slow, honest = ('10.0.0.1', 5000), ('10.0.0.2', 5000)
+    release = threading.Event()
+
+    class SlowConnections(FakeConnections):
+        def request(self, peer, message, timeout=10):
+            if peer == slow:
+                release.wait(5)
+            return super().request(peer, message, timeout)
+
+    pool = TransactionPool()
+    connections = SlowConnections({honest: [transaction]})
+
+    def accept(batch):
+        for data in batch:
+            pool.add_transaction(Transaction.from_dict(data))
+
+    gossip = InventoryGossip(pool, connections, ('10.0.0.9', 5000), accept)
+    try:
+        gossip.handle_inv(inv(slow, [hash_value]))
+        gossip.handle_inv(inv(honest, [hash_value]))
+        release.set()
+        wait_until(lambda: hash_value in pool)
+        assert [peer for peer, _ in connections.requests] == [slow, honest]
+    finally:
+        gossip.close()
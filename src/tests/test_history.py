@@ -0,0 +1,29 @@
+import pytest
+
+import blockchain as legacy
+
+
+@pytest.fixture(autouse=True)
+def easy_proof_of_work(monkeypatch):
+    monkeypatch.setattr(legacy.Blockchain, 'difficulty', 1)
+
+
+def mine(chain, *transactions):
+    for transaction in transactions:
+        chain.add_transaction(transaction)
+    assert chain.mine_pending_transactions('miner')
+
+
+def test_block_object_chain_pages_an_address_history(tmp_path):
+    chain = legacy.Blockchain(mining_workers=1, data_dir=str(tmp_path))
+    mine(chain, {'sender': 'alice', 'receiver': 'bob', 'amount': 1})
+    mine(chain, {'sender': 'bob', 'receiver': 'carol', 'amount': 1})
+
+    history = chain.transactions_for('bob')
+    assert history['total'] == 2
+    assert [(entry['height'], entry['position']) for entry in history['transactions']] == [(2, 1), (1, 0)]
+    assert history['transactions'][0]['transaction']['receiver'] == 'carol'
+    assert chain.transactions_for('miner')['total'] == 1  # the reward paid out in block 2
+
+    reopened = legacy.Blockchain(mining_workers=1, data_dir=str(tmp_path))
+    assert reopened.transactions_for('bob') == history
@@ -0,0 +1,30 @@
+import hashlib
+
+import pytest
+
+from modules.mining import ParallelMiner, target_for_difficulty
+
+PREFIX = b'{"index": 1, "nonce": '
+SUFFIX = b', "previous_hash": "00"}'
+
+
+def check(nonce, digest, difficulty):
+    expected = hashlib.sha256(PREFIX + b'%d' % nonce + SUFFIX).hexdigest()
+    assert digest == expected
+    assert int(digest, 16) < target_for_difficulty(difficulty)
+
+
+def test_serial_path_finds_a_valid_nonce():
+    check(*ParallelMiner(workers=1).mine(PREFIX, SUFFIX, 3), 3)
+
+
+@pytest.mark.parametrize('difficulty', [3, 4])
+def test_parallel_path_finds_a_valid_nonce(difficulty):
+    miner = ParallelMiner(workers=2, min_parallel_difficulty=3)
+    check(*miner.mine(PREFIX, SUFFIX, difficulty), difficulty)
+
+
+def test_default_difficulty_uses_the_worker_processes(monkeypatch):
+    miner = ParallelMiner(workers=2)
+    monkeypatch.setattr(ParallelMiner, 'mine_serial', staticmethod(lambda *args: pytest.fail("mined serially")))
+    check(*miner.mine(PREFIX, SUFFIX, 4), 4)
@@ -0,0 +1,116 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from modules.node import Node
+from modules.protocol import encode_message, send_frame
+from modules.transaction import Transaction
+
+
+@pytest.fixture
+def node(free_port):
+    node = Node('127.0.0.1', free_port)
+    threading.Thread(target=node.start_server, daemon=True).start()
+    assert node.listening.wait(5)
+    yield node
+    node.stop_node()
+
+
+def invalid_block(blockchain):
+    tip = blockchain.last_block
+    block = blockchain.create_block(blockchain.proof_of_work(tip['proof']), blockchain.hash(tip))
+    block['merkle_root'] = 'ff' * 32
+    return block
+
+
+def test_invalid_block_is_blamed_on_the_connection_not_the_claimed_host(node):
+    victim, relay_port = ('10.1.1.1', 7000), node.port + 1
+    node.peers.add(victim)
+    node.peers.add(('127.0.0.1', relay_port))
+    block = invalid_block(node.blockchain)
+    with socket.create_connection((node.host, node.port)) as peer_socket:
+        for host, port in (victim, ('10.2.2.2', relay_port)):
+            message = {"action": "new_block", "block": block, "peer_host": host, "peer_port": port}
+            send_frame(peer_socket, encode_message(message))
+        deadline = time.monotonic() + 5
+        while ('127.0.0.1', relay_port) in node.peers and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert victim in node.peers
+    assert ('127.0.0.1', relay_port) not in node.peers
+
+
+def test_transactions_must_be_covered_by_the_confirmed_balance(node):
+    private_key, public_key = Transaction.create_key_pair()
+    transaction = Transaction(sender=public_key, receiver="receiver_address", amount=10, fee=1)
+    transaction.sign_transaction(private_key)
+    assert not node.accept_transaction(transaction.to_dict())
+
+    blockchain = node.blockchain
+    blockchain.current_transactions = [{'sender': '0', 'recipient': public_key, 'amount': 11}]
+    assert blockchain.add_block(blockchain.create_block(blockchain.proof_of_work(blockchain.last_block['proof'])))
+    assert node.accept_transaction(transaction.to_dict())
+
+
+class RecordingConnections:
+    def __init__(self, on_peer_failed=None):
+        self.sent = []
+
+    def broadcast(self, peers, message):
+        self.sent.extend((peer, message) for peer in peers)
+
+    def send(self, peer, message):
+        self.sent.append((peer, message))
+
+    def close(self):
+        pass
+
+
+def block_message(block, sender, **extra):
+    return dict({"action": "new_block", "block": block, "peer_host": sender[0], "peer_port": sender[1]}, **extra)
+
+
+def test_block_relayed_ahead_is_blamed_on_its_originator():
+    node = Node('127.0.0.1', 1, connection_factory=RecordingConnections)
+    relayer, originator = ('10.0.0.1', 7000), ('10.0.0.2', 7000)
+    node.peers.add(relayer)
+    node.peers.add(originator)
+    node.handle_new_block(block_message(
+        invalid_block(node.blockchain), relayer, unvalidated=True, origin=list(originator)
+    ))
+    assert relayer in node.peers
+    assert originator not in node.peers
+
+
+def test_pipelined_relay_marks_blocks_unvalidated():
+    node = Node('127.0.0.1', 1, compact_blocks=False, connection_factory=RecordingConnections, pipelined_relay=True)
+    sender, downstream = ('10.0.0.1', 7000), ('10.0.0.3', 7000)
+    node.peers.add(sender)
+    node.peers.add(downstream)
+    node.handle_new_block(block_message(invalid_block(node.blockchain), sender))
+
+    [(peer, relayed)] = node.connections.sent
+    assert peer == downstream
+    assert relayed["unvalidated"] and tuple(relayed["origin"]) == sender
+    # Our own check failed, so the sender that vouched for the block is dropped.
+    assert sender not in node.peers
+
+
+def test_state_stage_failure_drops_the_sender():
+    node = Node('127.0.0.1', 1, connection_factory=RecordingConnections, parallel_validation=True)
+    try:
+        sender = ('10.0.0.1', 7000)
+        node.peers.add(sender)
+        private_key, public_key = Transaction.create_key_pair()
+        overdraft = Transaction(sender=public_key, receiver="receiver_address", amount=10, fee=1)
+        overdraft.sign_transaction(private_key)
+        blockchain = node.blockchain
+        blockchain.current_transactions = [overdraft.to_dict()]
+        block = blockchain.create_block(blockchain.proof_of_work(blockchain.last_block['proof']))
+
+        node.handle_new_block(block_message(block, sender))
+        assert blockchain.rejection == 'state'
+        assert sender not in node.peers
+    finally:
+        node.blockchain.pipeline.close()
@@ -0,0 +1,64 @@
+import random
+import socket
+import threading
+import time
+
+import pytest
+
+from modules.ingress import IngressQueue, peer_key
+from modules.protocol import PeerServer, encode_message, send_frame
+
+
+@pytest.fixture
+def server(free_port):
+    handled = []
+    lock = threading.Lock()
+
+    def handle_block(message):
+        # Later blocks finish faster, so without per-connection ordering they would overtake.
+        time.sleep(random.uniform(0, 0.02) + (20 - message["block"]["index"]) * 0.001)
+        with lock:
+            handled.append((message["block"]["index"], message.get("peer_host")))
+
+    server = PeerServer('127.0.0.1', free_port, {"new_block": handle_block})
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    assert server.started.wait(5)
+    yield server, handled
+    server.stop()
+    thread.join(5)
+
+
+def test_blocks_from_one_connection_are_handled_in_order(server):
+    server, handled = server
+    with socket.create_connection((server.host, server.port)) as peer_socket:
+        for index in range(20):
+            message = {"action": "new_block", "block": {"index": index}, "peer_host": "10.9.9.9", "peer_port": 1}
+            send_frame(peer_socket, encode_message(message))
+        deadline = time.monotonic() + 5
+        while len(handled) < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert [index for index, _ in handled] == list(range(20))
+    # The claimed host is replaced by the connection's.
+    assert {host for _, host in handled} == {'127.0.0.1'}
+
+
+def test_reconnecting_does_not_reset_the_rate_limit():
+    ingress = IngressQueue(peer_rate=0, peer_burst=1)
+    assert ingress.bucket(peer_key(('10.0.0.1', 4000))).take()
+    assert not ingress.bucket(peer_key(('10.0.0.1', 4000))).take()
+    # Same host on a new ephemeral port: the spent budget follows it.
+    assert not ingress.bucket(peer_key(('10.0.0.1', 4001))).take()
+    assert ingress.bucket(peer_key(('10.0.0.2', 4000))).take()
+
+
+def test_idle_buckets_expire_once_refilled():
+    ingress = IngressQueue(peer_rate=10, peer_burst=5)
+    now = time.monotonic()
+    assert ingress.bucket('10.0.0.1', now).take(now)
+    assert ingress.bucket('10.0.0.2', now).take(now)
+    # 0.05s refills half a token, not the one spent; 0.2s refills it, so the bucket is forgotten.
+    ingress.expire(now + 0.05)
+    assert list(ingress.buckets) == ['10.0.0.1', '10.0.0.2']
+    ingress.bucket('10.0.0.2', now + 0.2)
+    assert list(ingress.buckets) == ['10.0.0.2']
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from modules.stake import StakeIndex, to_units
+
+
+def brute_force(stakes, point, order=None):
+    for staker in order or sorted(stakes):
+        if point < stakes[staker]:
+            return staker
+        point -= stakes[staker]
+    raise AssertionError("point past the total stake")
+
+
+def test_every_boundary_point_selects_the_right_staker():
+    stakes = {'a': 3, 'b': 1, 'c': 5, 'd': 2}
+    index = StakeIndex.from_stakes(stakes)
+    for point in range(index.total):
+        assert index.find(point) == brute_force(stakes, point)
+    with pytest.raises(ValueError):
+        index.find(index.total)
+    with pytest.raises(ValueError):
+        index.find(-1)
+
+
+def test_updates_with_freed_slots_match_a_rebuilt_index():
+    generator = random.Random(7)
+    index = StakeIndex(capacity=2)
+    stakes = {}
+    for _ in range(2000):
+        staker = f"staker-{generator.randrange(40)}"
+        delta = generator.randint(-50, 100)
+        remaining = index.update(staker, delta)
+        if remaining:
+            stakes[staker] = remaining
+        else:
+            stakes.pop(staker, None)
+        assert index.total == sum(stakes.values())
+    # Stake intervals follow slot order, which depends on the update history.
+    order = [staker for staker in index.slots if staker is not None]
+    for point in list(range(0, index.total, 37)) + [index.total - 1]:
+        assert index.find(point) == brute_force(stakes, point, order)
+    assert index.select(0.999999999999) in stakes
+    rebuilt = StakeIndex.from_stakes(stakes)
+    assert [rebuilt.select_seeded(f"seed:{slot}") for slot in range(100)] == \
+        [StakeIndex.from_stakes(dict(sorted(stakes.items(), reverse=True))).select_seeded(f"seed:{slot}")
+         for slot in range(100)]
+
+
+def test_fractional_coins_are_exact_units():
+    assert to_units(0.1) + to_units(0.2) == to_units(0.3)
+    assert to_units("12.5") == to_units(12.5) == 1250000000
+    with pytest.raises(TypeError):
+        StakeIndex().update('a', 0.5)
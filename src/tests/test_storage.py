@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+import pytest
+
+from modules.storage import BlockStore, IndexedChain, StoredChain
+
+
+def block_hash(block):
+    return f"hash-{block['index']}"
+
+
+@pytest.fixture
+def chain():
+    return IndexedChain(block_hash, [{'index': height} for height in range(5)])
+
+
+def test_appends_and_tail_removals_keep_the_index(chain):
+    chain += [{'index': 5}]
+    assert chain.index_of_hash('hash-5') == 5
+    assert chain.pop() == {'index': 5}
+    assert chain.index_of_hash('hash-5') is None
+    del chain[3:]
+    assert len(chain) == 3
+    assert chain.index_of_hash('hash-3') is None
+    assert chain.index_of_hash('hash-2') == 2
+    chain.clear()
+    assert chain.index_of_hash('hash-0') is None
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda chain: chain.pop(0),
+    lambda chain: chain.insert(0, {'index': 9}),
+    lambda chain: chain.__setitem__(1, {'index': 9}),
+    lambda chain: chain.__setitem__(slice(1, 2), [{'index': 9}]),
+    lambda chain: chain.__delitem__(0),
+    lambda chain: chain.__delitem__(slice(1, 2)),
+    lambda chain: chain.remove({'index': 1}),
+    lambda chain: chain.reverse(),
+    lambda chain: chain.sort(key=lambda block: block['index']),
+])
+def test_other_mutators_raise(chain, mutate):
+    with pytest.raises(TypeError):
+        mutate(chain)
+    assert [chain.index_of_hash(f"hash-{height}") for height in range(5)] == list(range(5))
+
+
+@pytest.fixture
+def stored_chain(tmp_path):
+    def stored_hash(block):
+        return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+    store = BlockStore(str(tmp_path))
+    chain = StoredChain(store, lambda block: json.dumps(block).encode(), json.loads, stored_hash)
+    chain.extend({'index': height} for height in range(5))
+    yield chain, stored_hash
+    store.close()
+
+
+def test_stored_chain_pop_and_clear_truncate_the_store(stored_chain):
+    chain, stored_hash = stored_chain
+    chain += [{'index': 5}]
+    assert chain.index_of_hash(stored_hash({'index': 5})) == 5
+    assert chain.pop() == {'index': 5}
+    assert len(chain) == 5
+    assert chain.index_of_hash(stored_hash({'index': 5})) is None
+    assert chain[-1] == {'index': 4}
+    del chain[3:]
+    assert chain[-1] == {'index': 2}
+    chain.clear()
+    assert len(chain) == 0
+    assert chain.index_of_hash(stored_hash({'index': 0})) is None
+    with pytest.raises(IndexError):
+        chain.pop()
+    chain.append({'index': 0})
+    assert chain[0] == {'index': 0}
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda chain: chain.pop(0),
+    lambda chain: chain.insert(0, {'index': 9}),
+    lambda chain: chain.__setitem__(1, {'index': 9}),
+    lambda chain: chain.__delitem__(0),
+    lambda chain: chain.__delitem__(slice(1, 2)),
+    lambda chain: chain.reverse(),
+])
+def test_stored_chain_other_mutators_raise(stored_chain, mutate):
+    chain, _ = stored_chain
+    with pytest.raises(TypeError):
+        mutate(chain)
+    assert [block['index'] for block in chain] == list(range(5))
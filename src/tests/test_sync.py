@@ -0,0 +1,118 @@
+import pytest
+
+from modules.blockchain import Blockchain
+from modules.sync import ChainSynchronizer
+
+
+def grow(blockchain, count):
+    for _ in range(count):
+        assert blockchain.add_block(blockchain.create_block(blockchain.proof_of_work(blockchain.last_block['proof'])))
+
+
+def blocks_after(blockchain, previous, count):
+    """ Valid blocks following `previous`, built without appending them. """
+    blocks = []
+    for _ in range(count):
+        block = blockchain.create_block(blockchain.proof_of_work(previous['proof']), Blockchain.hash(previous))
+        block['index'] = previous['index'] + 1
+        blocks.append(block)
+        previous = block
+    return blocks
+
+
+class HostilePeer:
+    """ Serves valid blocks that follow our tip, but claims they fork at `fork_height`. """
+
+    def __init__(self, fork_height, blocks):
+        self.fork_height = fork_height
+        self.blocks = blocks
+
+    def request(self, peer, message, timeout=10):
+        if message["action"] == "get_headers":
+            if message["locator"][0] == Blockchain.hash(self.blocks[-1]):
+                return {"fork_height": self.fork_height, "headers": []}
+            return {"fork_height": self.fork_height, "headers": [Blockchain.block_header(b) for b in self.blocks]}
+        return {"blocks": self.blocks}
+
+
+@pytest.mark.parametrize('fork_height', [-1, -3, 99, 1.0, "0", True, None])
+def test_hostile_fork_height_leaves_the_chain_intact(fork_height):
+    blockchain = Blockchain()
+    grow(blockchain, 2)
+    before = [Blockchain.hash(block) for block in blockchain.chain]
+    # With fork_height -1 these blocks link to our tip, which get_block(-1) would return.
+    blocks = blocks_after(blockchain, blockchain.last_block, 4)
+
+    synchronizer = ChainSynchronizer(blockchain, HostilePeer(fork_height, blocks))
+    assert not synchronizer.sync([('10.0.0.1', 5000)])
+    assert not blockchain.extend_chain(fork_height, blocks)
+    assert [Blockchain.hash(block) for block in blockchain.chain] == before
+
+
+def test_honest_fork_height_is_accepted():
+    blockchain = Blockchain()
+    grow(blockchain, 2)
+    blocks = blocks_after(blockchain, blockchain.last_block, 2)
+    synchronizer = ChainSynchronizer(blockchain, HostilePeer(len(blockchain.chain) - 1, blocks))
+    assert synchronizer.sync([('10.0.0.1', 5000)])
+    assert len(blockchain.chain) == 5
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def serve_chains(monkeypatch, chains, with_length):
+    """ Route requests.get to in-memory neighbours; returns the list of /chain downloads. """
+    downloads = []
+
+    def get(url, timeout=None):
+        node, path = url[len('http://'):].split('/', 1)
+        if path == 'chain/length':
+            if node not in with_length:
+                return FakeResponse(404)
+            return FakeResponse(200, {'length': len(chains[node])})
+        downloads.append(node)
+        return FakeResponse(200, {'chain': chains[node]})
+
+    monkeypatch.setattr('modules.blockchain.requests.get', get)
+    return downloads
+
+
+def longer_chain(blockchain, count):
+    return list(blockchain.chain) + blocks_after(blockchain, blockchain.last_block, count)
+
+
+def test_resolve_conflicts_downloads_only_the_longest_chain(monkeypatch):
+    blockchain = Blockchain()
+    chains = {'a:1': longer_chain(blockchain, 1), 'b:1': longer_chain(blockchain, 3)}
+    downloads = serve_chains(monkeypatch, chains, with_length=set(chains))
+    blockchain.nodes.update(chains)
+
+    assert blockchain.resolve_conflicts()
+    assert downloads == ['b:1']
+    assert len(blockchain.chain) == 4
+
+
+def test_resolve_conflicts_falls_back_lazily_without_length_endpoint(monkeypatch):
+    blockchain = Blockchain()
+    chains = {'a:1': longer_chain(blockchain, 2), 'b:1': longer_chain(blockchain, 1), 'c:1': longer_chain(blockchain, 1)}
+    downloads = serve_chains(monkeypatch, chains, with_length={'a:1'})
+    blockchain.nodes.update(chains)
+
+    # The advertised longer chain is tried first and nothing else is downloaded once it is adopted.
+    assert blockchain.resolve_conflicts()
+    assert downloads == ['a:1']
+
+    # With nothing advertised, peers without /chain/length are downloaded one at a time until one is longer.
+    downloads.clear()
+    chains['a:1'] = list(blockchain.chain)
+    chains['b:1'] = longer_chain(blockchain, 1)
+    assert blockchain.resolve_conflicts()
+    assert downloads[-1] == 'b:1' and 'a:1' not in downloads
+    assert len(blockchain.chain) == 4
@@ -0,0 +1,54 @@
+import pytest
+
+from modules.blockchain import Blockchain
+from modules.transaction import BatchVerifier, Transaction
+
+
+@pytest.fixture
+def account():
+    return Transaction.create_key_pair()
+
+
+@pytest.fixture
+def blockchain():
+    verifier = BatchVerifier(max_workers=1)
+    blockchain = Blockchain(parallel_validation=True, verifier=verifier)
+    yield blockchain
+    blockchain.pipeline.close()
+    verifier.close()
+
+
+def next_block(blockchain, transactions):
+    blockchain.current_transactions = list(transactions)
+    return blockchain.create_block(blockchain.proof_of_work(blockchain.last_block['proof']))
+
+
+def payment(account, amount):
+    private_key, public_key = account
+    transaction = Transaction(sender=public_key, receiver="receiver_address", amount=amount, fee=1)
+    transaction.sign_transaction(private_key)
+    return transaction.to_dict()
+
+
+def test_pipeline_accepts_funded_signed_transactions(blockchain, account):
+    assert blockchain.add_block(next_block(blockchain, [{'sender': '0', 'recipient': account[1], 'amount': 100}]))
+    assert blockchain.add_block(next_block(blockchain, [payment(account, 10), payment(account, 20)]))
+    assert blockchain.balance_of(account[1]) == 68
+    assert blockchain.pipeline.stats()['blocks_validated'] == 2
+
+
+def test_pipeline_rejects_bad_signatures_and_overdrafts(blockchain, account):
+    assert blockchain.add_block(next_block(blockchain, [{'sender': '0', 'recipient': account[1], 'amount': 100}]))
+    tampered = dict(payment(account, 10), amount=99)
+    assert not blockchain.add_block(next_block(blockchain, [tampered]))
+    assert not blockchain.add_block(next_block(blockchain, [payment(account, 100)]))
+    assert len(blockchain.chain) == 2
+    assert blockchain.balance_of(account[1]) == 100
+
+
+def test_shared_verifier_outlives_the_pipeline(account):
+    verifier = BatchVerifier(max_workers=1)
+    blockchain = Blockchain(parallel_validation=True, verifier=verifier)
+    assert blockchain.pipeline.verifier is verifier
+    blockchain.pipeline.close()
+    assert verifier.verify([payment(account, 1)]) == [True]
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from modules import protocol, wire
+from modules.merkle import merkle_root
+from modules.transaction import Transaction
+
+
+@pytest.fixture(scope='module')
+def key_pair():
+    return Transaction.create_key_pair()
+
+
+@pytest.fixture
+def transaction(key_pair):
+    private_key, public_key = key_pair
+    transaction = Transaction(sender=public_key, receiver="receiver_address", amount=12.5, fee=1)
+    transaction.sign_transaction(private_key)
+    return transaction
+
+
+@pytest.fixture
+def block(transaction):
+    block = {
+        'index': 2,
+        'timestamp': 1700000000.25,
+        'transactions': [transaction.to_dict(), {'sender': 'a', 'recipient': 'b', 'amount': 2 ** 70}],
+        'proof': 35293,
+        'previous_hash': '00' * 32,
+    }
+    block['merkle_root'] = merkle_root(block['transactions'])
+    return block
+
+
+@pytest.fixture
+def message(block):
+    return {"action": "new_block", "block": block, "peers": [["127.0.0.1", 5001]], "note": "ok", "flag": None}
+
+
+def test_message_round_trip(message):
+    encoded = wire.dumps(message)
+    assert wire.is_binary(encoded)
+    assert wire.loads(encoded) == message
+    assert len(encoded) < len(json.dumps(message).encode())
+
+
+def test_transaction_round_trip_keeps_signature(transaction, key_pair):
+    restored = Transaction.from_dict(wire.loads(wire.dumps(transaction)))
+    assert restored.calculate_hash() == transaction.calculate_hash()
+    assert restored.verify_signature(key_pair[1])
+
+
+@pytest.mark.parametrize('value', [
+    0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 63, -2 ** 63 - 1, 2 ** 70, -(2 ** 200),
+    0.5, True, False, None, "", "abc", "ABCDEF", "0abc", "ab" * 40000, "ab" * 70000, b"\x00\xff", [], {}, [1, [2, [3]]],
+])
+def test_scalar_round_trip(value):
+    assert wire.loads(wire.dumps(value)) == value
+
+
+def test_oversized_integer_raises_value_error():
+    with pytest.raises(ValueError):
+        wire.dumps(1 << (8 * (wire.MAX_SHORT_LENGTH + 1)))
+
+
+def test_encoded_payloads_are_spliced(block):
+    assert wire.loads(wire.dumps({"reply": wire.Encoded(wire.dumps(block))})) == {"reply": block}
+    assert wire.loads(wire.dumps({"reply": wire.Encoded(json.dumps(block).encode())})) == {"reply": block}
+
+
+def test_trailing_bytes_and_unknown_version_are_rejected(message):
+    with pytest.raises(ValueError):
+        wire.loads(wire.dumps(message) + b"\x00")
+    with pytest.raises(ValueError):
+        wire.loads(b"\x7f" + wire.dumps(message)[1:])
+
+
+@pytest.mark.parametrize('wire_format', ['binary', 'json'])
+def test_encoded_message_decodes_the_same_in_both_formats(monkeypatch, message, wire_format):
+    monkeypatch.setattr(protocol, 'WIRE_FORMAT', wire_format)
+    payload = protocol.encode_message(message)
+    assert wire.is_binary(payload) == (wire_format == 'binary')
+    assert protocol.decode_message(payload) == message
+
+
+def test_json_fallback_handles_encoded_values(monkeypatch, block):
+    monkeypatch.setattr(protocol, 'WIRE_FORMAT', 'json')
+    payload = protocol.encode_message({"reply": wire.Encoded(wire.dumps(block))})
+    assert json.loads(payload) == {"reply": block}
+
+
+def test_wire_format_is_read_from_the_environment(monkeypatch, message):
+    import importlib
+    monkeypatch.setenv('SYPHER_WIRE_FORMAT', 'json')
+    try:
+        importlib.reload(protocol)
+        assert protocol.WIRE_FORMAT == 'json'
+        assert not wire.is_binary(protocol.encode_message(message))
+    finally:
+        monkeypatch.delenv('SYPHER_WIRE_FORMAT')
+        importlib.reload(protocol)
+    assert protocol.WIRE_FORMAT == 'binary'